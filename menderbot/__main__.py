@@ -1,4 +1,13 @@
+import os
 import sys
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from contextlib import ExitStack
 
 import rich_click as click
 from click import Abort
@@ -7,26 +16,39 @@ from rich.progress import Progress
 from rich.prompt import Confirm
 
 from menderbot import __version__
-from menderbot.check import run_check
-from menderbot.config import create_default_config, has_config, has_llm_consent
-from menderbot.git_client import git_commit, git_diff_head, git_show_top_level
-from menderbot.ingest import ask_index, get_chat_engine, index_exists, ingest_repo
-from menderbot.llm import (
-    INSTRUCTIONS,
-    get_response,
-    has_key,
-    key_env_var,
-    unwrap_codeblock,
+from menderbot.check import CHECKERS, errors_in_paths, select_checker
+from menderbot.config import (
+    create_default_config,
+    has_config,
+    has_llm_consent,
+    repo_context,
 )
+from menderbot.git_client import git_commit, git_diff_head
+from menderbot.llm_config import has_key, key_env_var
 from menderbot.prompts import (
+    INSTRUCTIONS,
     change_list_prompt,
     code_review_prompt,
     commit_msg_prompt,
     type_prompt,
 )
-from menderbot.source_file import SourceFile
+from menderbot.server import (
+    RemoteError,
+    ServerRunningError,
+    run_server,
+    socket_path,
+    try_call,
+)
+from menderbot.source_file import Insertion, SourceFile
+from menderbot.watch import WATCH_DEBOUNCE_SECONDS
 
 console = Console()
+# Upper bound on LLM requests in flight when typing many functions.
+LLM_CONCURRENCY = 4
+# Upper bound on files typed at once by `menderbot type` on a project.
+FILE_JOBS = 4
+# Diagnostics that must not end up in piped output.
+err_console = Console(stderr=True)
 
 
 @click.group(context_settings=dict(help_option_names=["-h", "--help"]))
@@ -42,41 +64,147 @@ def cli(ctx):
     Connects to OpenAI using OPENAI_API_KEY environment variable.
     """
     if not has_key():
-        console.log(f"{key_env_var()} not found in env, will not be able to connect.")
+        err_console.log(
+            f"{key_env_var()} not found in env, will not be able to connect."
+        )
     ctx.ensure_object(dict)
 
 
+def get_response(instructions, history, question):
+    # llama_index takes seconds to import, only load it when asking the LLM.
+    from menderbot.llm import get_response as llm_get_response  # Lazy import
+
+    return llm_get_response(instructions, history, question)
+
+
+def call_server(method, params):
+    """
+    (True, result) when a running `menderbot serve` handled the request,
+    (False, None) when the command should run in this process.
+    """
+    with Progress(transient=True) as progress:
+        progress.add_task("[green]Processing...", total=None)
+        try:
+            return try_call(
+                method, params, lambda text: console.out(text, end="", highlight=False)
+            )
+        except RemoteError as e:
+            raise click.ClickException(f"menderbot serve: {e}") from e
+
+
+def write_if_confirmed(file, mtime, insertions):
+    """Write insertions computed elsewhere, unless the file changed since."""
+    if not Confirm.ask(f"Write '{file}'?"):
+        console.print("Skipping.")
+        return
+    source_file = SourceFile(file)
+    if mtime is not None and source_file.initial_modified_time > mtime:
+        raise click.FileError(file, "File was externally modified, try again.")
+    source_file.load_source_as_utf8()
+    source_file.update_file(insertions, suffix="")
+    console.print("Done.")
+
+
 @cli.command()
 @click.argument("q", required=False)
-def ask(q):
+@click.option(
+    "--cache/--no-cache",
+    "use_cache",
+    default=True,
+    help="Reuse the answer to the same question from the same index.",
+)
+@click.option(
+    "--path",
+    "path",
+    default=None,
+    help="Only search files under this directory or at this path.",
+)
+@click.option(
+    "--lang",
+    "langs",
+    multiple=True,
+    help="Only search files in this language, such as python or py. Repeatable.",
+)
+def ask(q, use_cache, path, langs):
     """Ask a question about a specific piece of code or concept."""
-    if not index_exists():
-        console.print("[red]Index not found[/red]: please run menderbot ingest")
-        return
     check_llm_consent()
     new_question = q
     if not new_question:
         new_question = console.input("[green]Ask[/green]: ")
+    served, response = call_server(
+        "ask",
+        {
+            "question": new_question,
+            "use_cache": use_cache,
+            "path": path,
+            "langs": list(langs),
+        },
+    )
+    if served:
+        if response is None:
+            console.print("[red]Index not found[/red]: please run menderbot ingest")
+        else:
+            console.print(f"[cyan]Bot[/cyan]: {response}")
+        return
+    from menderbot.answer_cache import AnswerCache  # Lazy import
+    from menderbot.ingest import (  # Lazy import
+        ask_cache_settings,
+        ask_index,
+        index_exists,
+    )
+
+    if not index_exists():
+        console.print("[red]Index not found[/red]: please run menderbot ingest")
+        return
+    settings = ask_cache_settings()
+    cache = AnswerCache(max_answers=settings["max_answers"]) if use_cache else None
     with Progress(transient=True) as progress:
         task = progress.add_task("[green]Processing...", total=None)
-        response = ask_index(new_question)
+        response = ask_index(
+            new_question,
+            cache,
+            threshold=settings["threshold"],
+            path=path,
+            langs=langs,
+        )
         progress.update(task, completed=True)
     console.print(f"[cyan]Bot[/cyan]: {response}")
 
 
 @cli.command()
-def chat():
+@click.option(
+    "--path",
+    "path",
+    default=None,
+    help="Only search files under this directory or at this path.",
+)
+@click.option(
+    "--lang",
+    "langs",
+    multiple=True,
+    help="Only search files in this language, such as python or py. Repeatable.",
+)
+def chat(path, langs):
     """Interactively chat in the context of the current directory."""
-    if not index_exists():
-        console.print("[red]Index not found[/red]: please run menderbot ingest")
-    else:
-        console.print("Loading index...")
     check_llm_consent()
-    chat_engine = get_chat_engine()
+    # Importing llama_index and loading the index take seconds, both happen
+    # while the first question is typed.
+    loader = ThreadPoolExecutor(max_workers=1)
+    loading = loader.submit(load_chat_engine, path, langs)
+    loader.shutdown(wait=False)
+    chat_engine = None
     while True:
         new_question = console.input("[green]Ask[/green]: ")
         # new_question += "\nUse your tool to query for context."
         if new_question:
+            if chat_engine is None:
+                with Progress(transient=True) as progress:
+                    progress.add_task("[green]Loading index...", total=None)
+                    found, chat_engine = loading.result()
+                if not found:
+                    console.print(
+                        "[red]Index not found[/red]: please run menderbot ingest"
+                    )
             streaming_response = chat_engine.stream_chat(new_question)
             console.print("[cyan]Bot[/cyan]: ", end="")
             for token in streaming_response.response_gen:
@@ -84,79 +212,555 @@ def chat():
             console.out("\n")
 
 
-def try_function_type_hints(mypy_cmd, source_file, function_ast, needs_typing):
-    from menderbot.typing import add_type_hints, parse_type_hint_answer  # Lazy import
-
-    function_text = function_ast.text
-    check_command = (
-        f"{mypy_cmd} --shadow-file {source_file.path} {source_file.path}.shadow"
+def load_chat_engine(path=None, langs=()):
+    """(index found, chat engine), the index itself loads on another thread."""
+    from menderbot.answer_cache import AnswerCache  # Lazy import
+    from menderbot.ingest import (  # Lazy import
+        ask_cache_settings,
+        get_chat_engine,
+        index_exists,
     )
-    max_tries = 2
-    check_output = None
-    # First set them all to wrong type, to produce an error message.
+
+    cache = AnswerCache(max_answers=ask_cache_settings()["max_answers"])
+    return (index_exists(), get_chat_engine(cache=cache, path=path, langs=langs))
+
+
+def precheck_function(checker, source_file, function_ast, needs_typing):
+    """
+    Check with every missing hint set to None, the resulting errors are clues
+    for the LLM. Returns the checker output, or None when it passed.
+    """
+    from menderbot.typing import add_type_hints  # Lazy import
+
     hints = [(ident, "None") for ident in needs_typing]
-    # TODO
-    imports = []
-    insertions_for_function = add_type_hints(function_ast, hints, imports)
+    insertions_for_function = add_type_hints(function_ast, hints, imports=[])
     if insertions_for_function:
-        source_file.update_file(insertions_for_function, suffix=".shadow")
-        console.print("> ", check_command)
-        (success, pre_check_output) = run_check(check_command)
+        shadow_path = source_file.write_shadow(insertions_for_function)
+        success, check_output = errors_in_paths(
+            checker.check(source_file.path, shadow_path), [source_file.path]
+        )
         if not success:
-            check_output = pre_check_output
+            return check_output
+    return None
+
+
+def verify_function_hints(checker, source_file, function_ast, hints):
+    """
+    Returns the insertions for `hints` if the checker accepts them, else an
+    empty list and the checker output, which is None if there was nothing to try.
+    """
+    from menderbot.typing import add_type_hints  # Lazy import
+
+    name = function_ast.props["name"]
+    insertions_for_function = add_type_hints(function_ast, hints, imports=[])
+    if not insertions_for_function:
+        console.print(f"[cyan]Bot[/cyan]: No changes for {name}")
+        return ([], None)
+    console.print(f"[cyan]Bot[/cyan]: {name}: {hints}")
+    shadow_path = source_file.write_shadow(insertions_for_function)
+    # Files typed at the same time have candidate hints in their shadows,
+    # their errors are not this function's.
+    success, check_output = errors_in_paths(
+        checker.check(source_file.path, shadow_path), [source_file.path]
+    )
+    if success:
+        console.print(f"[green]Type checker passed[/green] for {name}, keeping")
+        return (insertions_for_function, None)
+    console.out(check_output)
+    console.print(f"\n[red]Type checker failed[/red] for {name}, discarding")
+    return ([], check_output)
+
+
+def try_function_type_hints(checker, source_file, function_ast, needs_typing):
+    from menderbot.typing import parse_type_hint_answer  # Lazy import
+
+    max_tries = 2
+    check_output = precheck_function(checker, source_file, function_ast, needs_typing)
     for try_num in range(0, max_tries):
         if try_num > 0:
             console.print("Retrying")
-        prompt = type_prompt(function_text, needs_typing, previous_error=check_output)
+        prompt = type_prompt(
+            function_ast.text, needs_typing, previous_error=check_output
+        )
         answer = get_response_with_progress(INSTRUCTIONS, [], prompt)
-        hints = parse_type_hint_answer(answer)
-
-        insertions_for_function = add_type_hints(function_ast, hints, imports)
-        if insertions_for_function:
-            console.print(f"[cyan]Bot[/cyan]: {hints}")
-            source_file.update_file(insertions_for_function, suffix=".shadow")
-            (success, check_output) = run_check(check_command)
-            if success:
-                console.print("[green]Type checker passed[/green], keeping")
-                return insertions_for_function
+        insertions_for_function, check_output = verify_function_hints(
+            checker, source_file, function_ast, parse_type_hint_answer(answer)
+        )
+        # No retry if it passed or didn't try to hint anything.
+        if insertions_for_function or check_output is None:
+            return insertions_for_function
+    return []
+
+
+def type_functions_concurrently(
+    checker,
+    source_file,
+    untyped,
+    concurrency=LLM_CONCURRENCY,
+    cache=None,
+    imports=(),
+):
+    """
+    Checks one function at a time, but all prompts go out up front (at most
+    `concurrency` in flight) and answers are verified in the order they
+    arrive, so LLM latency overlaps with type-checking. With a `cache`,
+    hints accepted before are tried first and answers known to fail are
+    not checked again.
+    """
+    from menderbot.hint_cache import HintCache  # Lazy import
+    from menderbot.typing import (  # Lazy import
+        merge_insertions,
+        parse_type_hint_answer,
+    )
+
+    max_tries = 2
+    insertions: list = []
+    pending: dict[Future, tuple] = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+
+        def ask(function_ast, needs_typing, previous_error, try_num):
+            prompt = type_prompt(
+                function_ast.text, needs_typing, previous_error=previous_error
+            )
+            future = executor.submit(get_response, INSTRUCTIONS, [], prompt)
+            pending[future] = (function_ast, needs_typing, try_num)
+
+        def verify(function_ast, hints):
+            key = HintCache.key(function_ast.text, imports)
+            known_errors = cache and cache.rejection(key, hints)
+            if known_errors:
+                name = function_ast.props["name"]
+                console.print(f"[cyan]Bot[/cyan]: {name}: {hints}, failed before")
+                return ([], known_errors)
+            insertions_for_function, check_output = verify_function_hints(
+                checker, source_file, function_ast, hints
+            )
+            if cache and insertions_for_function:
+                cache.accept(key, hints)
+            elif cache and check_output:
+                cache.reject(key, hints, check_output)
+            return (insertions_for_function, check_output)
+
+        for function_ast, needs_typing in untyped:
+            if not needs_typing:
+                continue
+            cached = cache and cache.accepted(HintCache.key(function_ast.text, imports))
+            if cached:
+                insertions_for_function, _ = verify(function_ast, cached)
+                if insertions_for_function:
+                    insertions += insertions_for_function
+                    continue
+            check_output = precheck_function(
+                checker, source_file, function_ast, needs_typing
+            )
+            ask(function_ast, needs_typing, check_output, 0)
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                function_ast, needs_typing, try_num = pending.pop(future)
+                hints = parse_type_hint_answer(future.result())
+                insertions_for_function, check_output = verify(function_ast, hints)
+                insertions += insertions_for_function
+                if check_output and try_num + 1 < max_tries:
+                    console.print(f"Retrying {function_ast.props['name']}")
+                    ask(function_ast, needs_typing, check_output, try_num + 1)
+    return merge_insertions(insertions)
+
+
+def check_together(checker, source_file, fn_asts, candidates, accepted, isolate=True):
+    """
+    Check all candidate insertions in one shadow file and return the errors
+    of each failing candidate, keyed by function name. Errors that cannot be
+    placed in a function mean checking the candidates one at a time instead,
+    unless `isolate` is off, then they are ignored.
+    """
+    from menderbot.typing import attribute_errors, merge_insertions  # Lazy import
+
+    insertions = merge_insertions(
+        accepted + [ins for group in candidates.values() for ins in group]
+    )
+    shadow_path = source_file.write_shadow(insertions)
+    success, check_output = errors_in_paths(
+        checker.check(source_file.path, shadow_path), [source_file.path]
+    )
+    if success:
+        return {}
+    by_function, unattributed = attribute_errors(
+        check_output,
+        source_file.path,
+        [fn_asts[name] for name in candidates],
+        insertions,
+    )
+    if not by_function and not unattributed:
+        # Failed without an error to read, such as a crashed checker.
+        return {name: check_output for name in candidates}
+    if unattributed and isolate:
+        if len(candidates) > 1:
+            failures = {}
+            for name, group in candidates.items():
+                failures.update(
+                    check_together(
+                        checker, source_file, fn_asts, {name: group}, accepted
+                    )
+                )
+            return failures
+        by_function.setdefault(next(iter(candidates)), []).extend(unattributed)
+    return {name: "\n".join(errors) for name, errors in by_function.items()}
+
+
+def try_file_type_hints(
+    checker,
+    source_file,
+    untyped,
+    concurrency=LLM_CONCURRENCY,
+    executor=None,
+    progress=None,
+    cache=None,
+    imports=(),
+):
+    """
+    Type all functions of a file together: each round sends every prompt at
+    once (at most `concurrency` in flight), puts all candidates into one
+    shadow file and runs the checker once, then only the functions with
+    errors are retried. With a `cache`, hints accepted before join the first
+    round without asking the LLM, and answers known to fail are not checked.
+    """
+    from menderbot.hint_cache import HintCache  # Lazy import
+    from menderbot.typing import (  # Lazy import
+        add_type_hints,
+        merge_insertions,
+        parse_type_hint_answer,
+    )
+
+    max_tries = 2
+    fn_asts = {}
+    needs_by_name = {}
+    for function_ast, needs_typing in untyped:
+        if needs_typing:
+            name = function_ast.props["name"]
+            fn_asts[name] = function_ast
+            needs_by_name[name] = needs_typing
+    if not needs_by_name:
+        return []
+    keys = {name: HintCache.key(fn_asts[name].text, imports) for name in fn_asts}
+    cached = {}
+    if cache:
+        for name in needs_by_name:
+            hints = cache.accepted(keys[name])
+            if hints:
+                console.print(f"[cyan]Cached[/cyan]: {name}: {hints}")
+                cached[name] = hints
+    pending = [name for name in needs_by_name if name not in cached]
+    previous_errors = {}
+    if pending:
+        # First set them all to wrong type, to produce error messages.
+        none_hints = {
+            name: add_type_hints(
+                fn_asts[name],
+                [(ident, "None") for ident in needs_by_name[name]],
+                imports=[],
+            )
+            for name in pending
+        }
+        previous_errors = check_together(
+            checker, source_file, fn_asts, none_hints, [], isolate=False
+        )
+    accepted: list = []
+    for try_num in range(0, max_tries):
+        if try_num > 0:
+            console.print(f"Retrying {len(pending)} function(s)")
+        hints_by_name = dict(cached) if try_num == 0 else {}
+        failures = {}
+        prompts = {
+            name: type_prompt(
+                fn_asts[name].text,
+                needs_by_name[name],
+                previous_error=previous_errors.get(name),
+            )
+            for name in pending
+        }
+        if prompts:
+            answers = get_responses_concurrently(
+                prompts, concurrency, executor, progress
+            )
+            for name, answer in answers:
+                hints = parse_type_hint_answer(answer)
+                known_errors = cache and cache.rejection(keys[name], hints)
+                if known_errors:
+                    console.print(f"[cyan]Bot[/cyan]: {name}: {hints}, failed before")
+                    failures[name] = known_errors
+                else:
+                    hints_by_name[name] = hints
+        candidates = {}
+        for name, hints in hints_by_name.items():
+            insertions_for_function = add_type_hints(fn_asts[name], hints, imports=[])
+            if insertions_for_function:
+                if name not in cached or try_num > 0:
+                    console.print(f"[cyan]Bot[/cyan]: {name}: {hints}")
+                candidates[name] = insertions_for_function
+            else:
+                console.print(f"[cyan]Bot[/cyan]: No changes for {name}")
+        if candidates:
+            failures.update(
+                check_together(checker, source_file, fn_asts, candidates, accepted)
+            )
+        for name, insertions_for_function in candidates.items():
+            if name in failures:
+                console.out(failures[name])
+                console.print(f"[red]Type checker failed[/red] for {name}, discarding")
+                if cache:
+                    cache.reject(keys[name], hints_by_name[name], failures[name])
             else:
-                console.out(check_output)
-                console.print("\n[red]Type checker failed[/red], discarding")
+                console.print(f"[green]Type checker passed[/green] for {name}, keeping")
+                accepted += insertions_for_function
+                if cache:
+                    cache.accept(keys[name], hints_by_name[name])
+        previous_errors = failures
+        pending = list(failures)
+        if not pending:
+            break
+    return merge_insertions(accepted)
+
+
+def release_shadows(checker, source_files):
+    """Unregister the shadows of `source_files` from the checker and delete them."""
+    try:
+        checker.release(*(source_file.path for source_file in source_files))
+    finally:
+        for source_file in source_files:
+            source_file.remove_shadow()
+
+
+def type_files_in_order(checker, analyses, batch, concurrency, jobs, cache=None):
+    """
+    Type several files, each one after the local modules it imports, so the
+    hints accepted there are seen when checking it. Files that do not depend
+    on each other run at the same time, up to `jobs`, sharing one pool of
+    LLM requests. A shadow is released once its file and every file importing
+    it are done. Returns the insertions for each path.
+    """
+    from menderbot.analysis import dependency_order, import_graph  # Lazy import
+    from menderbot.typing import what_needs_typing  # Lazy import
+
+    by_path = {analysis.path: analysis for analysis in analyses}
+    graph = import_graph(analyses)
+    importers: dict[str, set[str]] = {path: set() for path in graph}
+    for importer, imported in graph.items():
+        for path in imported:
+            importers[path].add(importer)
+    sorter = dependency_order(graph)
+    results: dict[str, list] = {}
+    released: set[str] = set()
+
+    def type_one(path, llm_executor, progress):
+        analysis = by_path[path]
+        source_file = analysis.source_file
+        console.print(f"Typing '{path}'")
+        untyped = [(fn, what_needs_typing(fn)) for fn in analysis.function_asts]
+        if batch:
+            insertions = try_file_type_hints(
+                checker,
+                source_file,
+                untyped,
+                concurrency,
+                llm_executor,
+                progress,
+                cache=cache,
+                imports=analysis.imports,
+            )
         else:
-            console.print("[cyan]Bot[/cyan]: No changes")
-            # No retry if it didn't try to hint anything.
-            return []
-    return []
+            insertions = type_functions_concurrently(
+                checker,
+                source_file,
+                untyped,
+                concurrency,
+                cache=cache,
+                imports=analysis.imports,
+            )
+        # Leave only accepted hints in the shadow for the modules importing it.
+        source_file.write_shadow(insertions)
+        checker.refresh(path)
+        return insertions
+
+    with ExitStack() as stack:
+        progress = stack.enter_context(Progress(transient=True))
+        llm_executor = stack.enter_context(ThreadPoolExecutor(max_workers=concurrency))
+        file_executor = stack.enter_context(ThreadPoolExecutor(max_workers=jobs))
+        running: dict[Future, str] = {}
+        while sorter.is_active():
+            for path in sorter.get_ready():
+                future = file_executor.submit(type_one, path, llm_executor, progress)
+                running[future] = path
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path = running.pop(future)
+                results[path] = future.result()
+                sorter.done(path)
+                finished = [
+                    other
+                    for other in (path, *graph[path])
+                    if other in results
+                    and other not in released
+                    and importers[other] <= results.keys()
+                ]
+                if finished:
+                    released.update(finished)
+                    release_shadows(
+                        checker, [by_path[other].source_file for other in finished]
+                    )
+    return results
 
 
 @cli.command("type")
-@click.argument("file")
-def type_command(file):
-    """Insert type hints (Python only)"""
-    from menderbot.typing import process_untyped_functions  # Lazy import
+@click.argument("paths", nargs=-1, required=True)
+@click.option(
+    "--checker",
+    "checker_name",
+    type=click.Choice(["auto", *CHECKERS]),
+    default="auto",
+    show_default=True,
+    help="Type checker to verify hints with, auto uses dmypy if installed, "
+    "else mypy.",
+)
+@click.option(
+    "--batch/--no-batch",
+    default=True,
+    help="Check the hints for all functions in one type-checker run.",
+)
+@click.option(
+    "--concurrency",
+    default=LLM_CONCURRENCY,
+    show_default=True,
+    help="Most LLM requests in flight at once.",
+)
+@click.option(
+    "--jobs",
+    default=FILE_JOBS,
+    show_default=True,
+    help="Most files typed at once, among those not importing each other.",
+)
+@click.option(
+    "--cache/--no-cache",
+    "use_cache",
+    default=True,
+    help="Reuse hints the checker accepted or rejected on earlier runs.",
+)
+def type_command(paths, checker_name, batch, concurrency, jobs, use_cache):
+    """
+    Insert type hints (Python only)
 
+    Takes files or directories. Files are typed after the modules they
+    import, so hints found in those are used when checking them.
+    """
+    if checker_name != "auto" and not CHECKERS[checker_name].available():
+        raise click.UsageError(f"{checker_name} is not installed")
     check_llm_consent()
-    console.print("Running type-checker baseline")
-    mypy_cmd = f"mypy --ignore-missing-imports --no-error-summary --soft-error-limit 10 '{file}'"
-    (success, check_output) = run_check(f"{mypy_cmd}")
-    if not success:
-        console.print(check_output)
-        console.print("Baseline failed, aborting.")
-        return
-    source_file = SourceFile(file)
-    insertions = []
-    for function_ast, needs_typing in process_untyped_functions(source_file):
-        insertions += try_function_type_hints(
-            mypy_cmd, source_file, function_ast, needs_typing
+    options = dict(
+        checker_name=checker_name,
+        batch=batch,
+        concurrency=concurrency,
+        jobs=jobs,
+        use_cache=use_cache,
+    )
+    abs_paths = [os.path.abspath(path) for path in paths]
+    served, served_results = call_server("type", {"paths": abs_paths, **options})
+    if served:
+        if served_results is None:
+            console.print("Baseline failed, aborting.")
+            return
+        results = {
+            os.path.relpath(path): (
+                result["mtime"],
+                [Insertion(**insertion) for insertion in result["insertions"]],
+            )
+            for path, result in served_results.items()
+        }
+    else:
+        results = infer_type_hints(paths, **options)
+        if results is None:
+            return
+    for file, (mtime, insertions) in results.items():
+        if not insertions:
+            console.print(f"No changes for '{file}'.")
+            continue
+        write_if_confirmed(file, mtime, insertions)
+
+
+def infer_type_hints(paths, checker_name, batch, concurrency, jobs, use_cache):
+    """
+    {path: (mtime, insertions)} for the Python files under `paths`, in path
+    order, or None when the type checker fails before any hints are added.
+    """
+    from menderbot.analysis import analyze_files  # Lazy import
+    from menderbot.hint_cache import HintCache  # Lazy import
+    from menderbot.python_cst import iter_python_paths  # Lazy import
+
+    analyses = []
+    for analysis in analyze_files(iter_python_paths(paths), with_types=True):
+        if analysis.error or not analysis.source_file:
+            console.print(
+                f"[red]Could not read[/red] '{analysis.path}': {analysis.error}"
+            )
+            continue
+        analyses.append(analysis)
+    if not analyses:
+        console.print("No Python files found.")
+        return {}
+    analyses.sort(key=lambda analysis: analysis.path)
+    # Every check sees the others' shadows, begin with copies.
+    shadows = {
+        analysis.path: analysis.source_file.write_shadow([]) for analysis in analyses
+    }
+    checker = select_checker(shadows, checker_name)
+    cache = HintCache() if use_cache else None
+    try:
+        console.print("Running type-checker baseline")
+        success, check_output = checker.baseline(*shadows)
+        if not success:
+            console.print(check_output)
+            console.print("Baseline failed, aborting.")
+            return None
+        results = type_files_in_order(
+            checker, analyses, batch, concurrency, jobs, cache
         )
-    if not insertions:
-        console.print(f"No changes for '{file}.")
-        return
-    if not Confirm.ask(f"Write '{file}'?"):
-        console.print("Skipping.")
-        return
-    source_file.update_file(insertions, suffix="")
-    console.print("Done.")
+    finally:
+        try:
+            # Those left by a failure, the others are gone already.
+            release_shadows(checker, [analysis.source_file for analysis in analyses])
+        finally:
+            checker.stop()
+            if cache:
+                cache.save()
+    return {
+        analysis.path: (
+            analysis.source_file.initial_modified_time,
+            results.get(analysis.path, []),
+        )
+        for analysis in analyses
+    }
+
+
+def get_responses_concurrently(
+    prompts: dict, concurrency=LLM_CONCURRENCY, executor=None, progress=None
+):
+    """
+    Yields (key, answer) for each prompt as soon as its answer arrives. Files
+    typed at the same time share one `executor` and `progress` display.
+    """
+    with ExitStack() as stack:
+        if progress is None:
+            progress = stack.enter_context(Progress(transient=True))
+        if executor is None:
+            executor = stack.enter_context(ThreadPoolExecutor(max_workers=concurrency))
+        task = progress.add_task("[green]Processing...", total=len(prompts))
+        futures = {
+            executor.submit(get_response, INSTRUCTIONS, [], prompt): key
+            for key, prompt in prompts.items()
+        }
+        for future in as_completed(futures):
+            progress.advance(task)
+            yield (futures[future], future.result())
+        progress.remove_task(task)
 
 
 def get_response_with_progress(instructions, history, question):
@@ -193,22 +797,70 @@ CODE:
 
 
 @cli.command()
-@click.argument("file")
-def doc(file):
+@click.argument("files", nargs=-1, required=True)
+def doc(files):
     """Generate function-level documentation for the existing code (Python only)."""
-    from menderbot.doc import document_file  # Lazy import
-
     check_llm_consent()
-    source_file = SourceFile(file)
-    insertions = document_file(source_file, generate_doc)
-    if not insertions:
-        console.print(f"No updates found for '{file}'.")
-        return
-    if not Confirm.ask(f"Write '{file}'?"):
-        console.print("Skipping.")
-        return
-    source_file.update_file(insertions, suffix="")
-    console.print("Done.")
+    abs_files = [os.path.abspath(file) for file in files]
+    served, served_results = call_server("doc", {"files": abs_files})
+    if served:
+        results = (
+            (
+                os.path.relpath(result["path"]),
+                result["mtime"],
+                [Insertion(**insertion) for insertion in result["insertions"]],
+                result["error"],
+            )
+            for result in served_results
+        )
+    else:
+        results = document_paths(files)
+    for file, mtime, insertions, error in results:
+        if error:
+            console.print(f"[red]Could not read[/red] '{file}': {error}")
+            continue
+        if not insertions:
+            console.print(f"No updates found for '{file}'.")
+            continue
+        write_if_confirmed(file, mtime, insertions)
+
+
+def document_paths(files):
+    """
+    Yields (path, mtime, insertions, error) for each file, documenting each
+    one as soon as it is parsed, so in completion order.
+    """
+    from menderbot.analysis import analyze_files  # Lazy import
+    from menderbot.doc import document_functions  # Lazy import
+
+    for analysis in analyze_files(files):
+        if analysis.error or not analysis.source_file:
+            yield (analysis.path, None, [], analysis.error)
+            continue
+        _, file_extension = os.path.splitext(analysis.path)
+        insertions = document_functions(
+            analysis.functions, file_extension, generate_doc
+        )
+        mtime = analysis.source_file.initial_modified_time
+        yield (analysis.path, mtime, insertions, None)
+
+
+@cli.command()
+@click.argument("paths", nargs=-1)
+@click.option("--text", is_flag=True, help="Include the source text of each function.")
+def functions(paths, text):
+    """
+    Stream Python function metadata as NDJSON, one function per line.
+
+    Takes files or directories, the current directory by default.
+    """
+    from menderbot.python_cst import (  # Lazy import
+        iter_function_records,
+        write_ndjson,
+    )
+
+    records = iter_function_records(paths or ["."], include_text=text)
+    write_ndjson(records, click.get_text_stream("stdout"))
 
 
 @cli.command()
@@ -217,17 +869,18 @@ def review():
     check_llm_consent()
     console.print("Reading diff from STDIN...")
     diff_text = click.get_text_stream("stdin").read()
-    new_question = code_review_prompt(diff_text)
-    with Progress(transient=True) as progress:
-        task = progress.add_task("[green]Processing...", total=None)
-        response_1 = get_response(INSTRUCTIONS, [], new_question)
-        progress.update(task, completed=True)
+    served, response_1 = call_server("review", {"diff": diff_text})
+    if not served:
+        new_question = code_review_prompt(diff_text)
+        response_1 = get_response_with_progress(INSTRUCTIONS, [], new_question)
     console.print(f"[cyan]Bot[/cyan]:\n{response_1}")
 
 
 @cli.command()
 def commit():
     """Generate an informative commit message based on a changeset."""
+    from menderbot.llm import unwrap_codeblock  # Lazy import
+
     check_llm_consent()
     diff_text = git_diff_head(staged=True)
     if not diff_text.strip():
@@ -267,19 +920,55 @@ def diff():
     check_llm_consent()
     console.print("Reading diff from STDIN...")
     diff_text = click.get_text_stream("stdin").read()
-    new_question = change_list_prompt(diff_text)
-    with Progress(transient=True) as progress:
-        task = progress.add_task("[green]Processing...", total=None)
-        response_1 = get_response(INSTRUCTIONS, [], new_question)
-        progress.update(task, completed=True)
+    served, response_1 = call_server("diff", {"diff": diff_text})
+    if not served:
+        new_question = change_list_prompt(diff_text)
+        response_1 = get_response_with_progress(INSTRUCTIONS, [], new_question)
     console.print(f"[cyan]Bot[/cyan]:\n{response_1}")
 
 
 @cli.command()
-def ingest():
+@click.option(
+    "--watch",
+    is_flag=True,
+    help="Keep running and re-index files as they change in the working tree.",
+)
+@click.option(
+    "--debounce",
+    default=WATCH_DEBOUNCE_SECONDS,
+    show_default=True,
+    help="With --watch, seconds without changes before updating the index.",
+)
+@click.option(
+    "--poll",
+    is_flag=True,
+    help="With --watch, poll file mtimes even when watchdog is installed.",
+)
+def ingest(watch, debounce, poll):
     """Index files in current repo to be used with 'ask' and 'chat'."""
+    from menderbot.ingest import ingest_repo, watch_repo  # Lazy import
+
+    check_llm_consent()
+    if watch:
+        watch_repo(debounce, poll)
+    else:
+        ingest_repo()
+
+
+@cli.command()
+def serve():
+    """
+    Keep the index and LLM client loaded and run ask, doc, type, review and
+    diff for other menderbot commands in this repo.
+
+    Commands use the server while it runs, set MENDERBOT_NO_SERVER=1 to skip it.
+    """
     check_llm_consent()
-    ingest_repo()
+    console.print(f"Serving on {socket_path()}, Ctrl-C to stop.")
+    try:
+        run_server()
+    except ServerRunningError as e:
+        raise click.ClickException(str(e)) from e
 
 
 def check_llm_consent():
@@ -295,7 +984,7 @@ def check_llm_consent():
 @cli.command()
 def check():
     """Verify we have what we need to run."""
-    git_dir = git_show_top_level()
+    git_dir = repo_context().top_level
     failed = False
 
     def check_condition(condition, ok_msg, failed_msg):
@@ -0,0 +1,167 @@
+import os
+from collections.abc import Mapping
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from functools import partial
+from graphlib import CycleError, TopologicalSorter
+from typing import Iterable, Iterator, Optional
+
+from menderbot import python_cst
+from menderbot.check import package_root
+from menderbot.code import (
+    LANGUAGE_STRATEGIES,
+    LanguageStrategy,
+    node_start_line,
+    node_stop_line,
+    node_str,
+)
+from menderbot.source_file import SourceFile
+
+
+@dataclass
+class FunctionSummary:
+    """Plain data about one function, safe to pickle across processes."""
+
+    name: str
+    start_line: int
+    end_line: int
+    text: str
+    has_comment: bool
+    doc_line: int
+
+
+@dataclass
+class FileAnalysis:
+    path: str
+    # Loaded in the worker, so it knows the encoding and the mtime at parse time.
+    source_file: Optional[SourceFile] = None
+    functions: list[FunctionSummary] = field(default_factory=list)
+    imports: list[tuple[str, str]] = field(default_factory=list)
+    # Only filled for Python when asked for, see `analyze_file`.
+    function_asts: list[python_cst.AstNode] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+def summarize_functions(
+    language_strategy: LanguageStrategy, tree
+) -> list[FunctionSummary]:
+    return [
+        FunctionSummary(
+            name=language_strategy.get_function_node_name(node),
+            start_line=node_start_line(node),
+            end_line=node_stop_line(node),
+            text=node_str(node),
+            has_comment=language_strategy.function_has_comment(node),
+            doc_line=node_start_line(node) + language_strategy.function_doc_line_offset,
+        )
+        for node in language_strategy.get_function_nodes(tree)
+    ]
+
+
+def analyze_file(path: str, with_types: bool = False) -> FileAnalysis:
+    """
+    Parse one file into picklable summaries. With `with_types`, Python files
+    get their python_cst function ASTs and imports for type hinting instead,
+    from libcst alone, and no function summaries.
+    """
+    analysis = FileAnalysis(path=path)
+    _, file_extension = os.path.splitext(path)
+    language_strategy = LANGUAGE_STRATEGIES.get(file_extension)
+    try:
+        analysis.source_file = SourceFile(path)
+        if not language_strategy:
+            return analysis
+        source = analysis.source_file.load_source_as_utf8()
+        if with_types and file_extension == ".py":
+            analysis.function_asts, analysis.imports = (
+                python_cst.collect_functions_and_imports(source)
+            )
+            return analysis
+        tree = language_strategy.parse_source_to_tree(source)
+        analysis.imports = language_strategy.get_imports(tree)
+        analysis.functions = summarize_functions(language_strategy, tree)
+    # pylint: disable-next=broad-exception-caught
+    except Exception as e:
+        analysis.error = f"{type(e).__name__}: {e}"
+    return analysis
+
+
+def analyze_files(
+    paths: Iterable[str], max_workers: Optional[int] = None, with_types=False
+) -> Iterator[FileAnalysis]:
+    """
+    Analyze files on a process pool, yielding each result as soon as it is
+    done, so in completion order rather than input order.
+    """
+    paths = list(paths)
+    analyze = partial(analyze_file, with_types=with_types)
+    if max_workers == 1 or len(paths) < 2:
+        yield from map(analyze, paths)
+        return
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(analyze, path) for path in paths]
+        for future in as_completed(futures):
+            yield future.result()
+
+
+def module_name(path: str) -> str:
+    """Dotted module name of a Python file, going by its `__init__.py` files."""
+    root = package_root(path)
+    relative = os.path.relpath(
+        os.path.abspath(path), os.path.dirname(os.path.abspath(root))
+    )
+    name = os.path.splitext(relative)[0].replace(os.sep, ".")
+    return name[: -len(".__init__")] if name.endswith(".__init__") else name
+
+
+def _imported_modules(package: str, module: str, name: str) -> list[str]:
+    """Modules that one `get_imports` entry may refer to."""
+    name = name.split(" as ")[0].strip()
+    if not module:
+        return [name]
+    level = len(module) - len(module.lstrip("."))
+    if level:
+        parts = package.split(".")[: len(package.split(".")) - level + 1]
+        module = ".".join(part for part in [*parts, module[level:]] if part)
+    # `from pkg import mod` imports a module too.
+    return [module, f"{module}.{name}"]
+
+
+def import_graph(analyses: Iterable[FileAnalysis]) -> dict[str, set[str]]:
+    """
+    Map each analyzed path to the analyzed paths it imports from. Imports of
+    anything outside the set are left out.
+    """
+    analyses = list(analyses)
+    by_module = {module_name(a.path): a.path for a in analyses}
+    graph: dict[str, set[str]] = {}
+    for analysis in analyses:
+        package = module_name(analysis.path)
+        if os.path.basename(analysis.path) != "__init__.py":
+            package = package.rpartition(".")[0]
+        deps = {
+            by_module[target]
+            for module, name in analysis.imports
+            for target in _imported_modules(package, module, name)
+            if target in by_module
+        }
+        deps.discard(analysis.path)
+        graph[analysis.path] = deps
+    return graph
+
+
+def dependency_order(graph: Mapping[str, Iterable[str]]) -> TopologicalSorter:
+    """
+    A prepared sorter handing out paths after the paths they import. Each
+    import cycle is broken by dropping one of its edges.
+    """
+    edges = {path: set(deps) for path, deps in graph.items()}
+    while True:
+        sorter = TopologicalSorter(edges)
+        try:
+            sorter.prepare()
+            return sorter
+        except CycleError as e:
+            # Each node in the reported cycle is imported by the next one.
+            imported, importer = e.args[1][:2]
+            edges[importer].discard(imported)
@@ -0,0 +1,204 @@
+import base64
+import hashlib
+import json
+import math
+import os
+import re
+import tempfile
+import threading
+from array import array
+from contextlib import suppress
+from typing import Optional
+
+ANSWER_CACHE_FILE = ".menderbot/answers.json"
+# Answers kept across index versions, oldest dropped first. As many question
+# embeddings are kept, in a file of their own read only when needed.
+MAX_ANSWERS = 500
+# Cosine similarity from which a paraphrase gets the earlier answer.
+DEFAULT_SIMILARITY_THRESHOLD = 0.95
+
+
+def normalize_question(question: str) -> str:
+    """Case, spacing and closing punctuation do not make a new question."""
+    return re.sub(r"\s+", " ", question).strip().rstrip("?!. ").lower()
+
+
+def question_key(question: str, scope: str = "") -> str:
+    """`scope` tells apart the same question asked of part of the index."""
+    text = normalize_question(question) + (f"\0{scope}" if scope else "")
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def cosine_similarity(a: list[float], b: list[float]) -> float:
+    norms = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return sum(x * y for x, y in zip(a, b)) / norms if norms else 0.0
+
+
+def encode_embedding(embedding: list[float]) -> str:
+    """Base64 of float32s, a quarter of the size of a JSON list."""
+    return base64.b64encode(array("f", embedding).tobytes()).decode("ascii")
+
+
+def decode_embedding(encoded: str) -> list[float]:
+    floats = array("f")
+    floats.frombytes(base64.b64decode(encoded))
+    return floats.tolist()
+
+
+def _read_json(path: str) -> dict:
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, "r", encoding="utf-8") as cache_file:
+            saved = json.load(cache_file)
+        return saved if isinstance(saved, dict) else {}
+    except (OSError, ValueError):
+        # Only a cache, start over.
+        return {}
+
+
+def _write_json(path: str, data: dict) -> None:
+    """Write through a temporary file, so a crash never leaves half of it."""
+    cache_dir = os.path.dirname(path)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(
+        dir=cache_dir or ".", prefix=f".{os.path.basename(path)}.", suffix=".tmp"
+    )
+    try:
+        with open(fd, "w", encoding="utf-8") as cache_file:
+            json.dump(data, cache_file)
+        os.replace(temp_path, path)
+    except BaseException:
+        with suppress(FileNotFoundError):
+            os.unlink(temp_path)
+        raise
+
+
+class AnswerCache:
+    """
+    Answers from `ask`, keyed by the normalized question and the stamp of
+    the index that answered it, so re-ingesting misses every old answer.
+    Question embeddings do not depend on the index and are kept across
+    stamps and scopes. Served answers move to the back, so the least
+    recently used are evicted, but serving alone does not rewrite the file.
+    Safe to use from the server's request threads.
+    """
+
+    def __init__(self, path: str = ANSWER_CACHE_FILE, max_answers=MAX_ANSWERS):
+        self.path = path
+        self.embeddings_path = f"{os.path.splitext(path)[0]}.embeddings.json"
+        self.max_answers = max_answers
+        answers = _read_json(path).get("answers", {})
+        self.answers: dict[str, dict] = answers if isinstance(answers, dict) else {}
+        self._embeddings: Optional[dict[str, str]] = None
+        self._dirty = False
+        self._embeddings_dirty = False
+        self._lock = threading.Lock()
+
+    @property
+    def embeddings(self) -> dict[str, str]:
+        """Encoded embeddings by question key, read on first use."""
+        if self._embeddings is None:
+            embeddings = _read_json(self.embeddings_path)
+            self._embeddings = {
+                key: value
+                for key, value in embeddings.items()
+                if isinstance(value, str)
+            }
+        return self._embeddings
+
+    def answer(
+        self, stamp: Optional[str], question: str, scope: str = ""
+    ) -> Optional[str]:
+        if stamp is None:
+            return None
+        key = question_key(question, scope)
+        with self._lock:
+            entry = self.answers.get(key)
+            if not entry or entry["stamp"] != stamp:
+                return None
+            self._touch(key)
+            return entry["answer"]
+
+    def similar(
+        self,
+        stamp: Optional[str],
+        embedding: list[float],
+        threshold: float,
+        scope: str = "",
+    ) -> Optional[tuple[str, str, float]]:
+        """(question, answer, similarity) of the closest earlier question."""
+        best = None
+        with self._lock:
+            for key, entry in self.answers.items():
+                if entry["stamp"] != stamp or entry.get("scope", "") != scope:
+                    continue
+                other = self.embeddings.get(question_key(entry["question"]))
+                if other is None:
+                    continue
+                score = cosine_similarity(embedding, decode_embedding(other))
+                if score >= threshold and (best is None or score > best[0]):
+                    best = (score, key)
+            if best is None:
+                return None
+            score, key = best
+            self._touch(key)
+            entry = self.answers[key]
+            return (entry["question"], entry["answer"], score)
+
+    def _touch(self, key: str) -> None:
+        self.answers[key] = self.answers.pop(key)
+        if self._embeddings is not None:
+            embedding_key = question_key(self.answers[key]["question"])
+            if embedding_key in self._embeddings:
+                self._embeddings[embedding_key] = self._embeddings.pop(embedding_key)
+
+    def embedding(self, question: str) -> Optional[list[float]]:
+        with self._lock:
+            encoded = self.embeddings.get(question_key(question))
+        return None if encoded is None else decode_embedding(encoded)
+
+    def put(
+        self,
+        stamp: Optional[str],
+        question: str,
+        answer: str,
+        embedding: Optional[list[float]] = None,
+        scope: str = "",
+    ) -> None:
+        key = question_key(question, scope)
+        with self._lock:
+            if stamp is not None:
+                # Answers from an older index can never be served again.
+                self.answers = {
+                    other: entry
+                    for other, entry in self.answers.items()
+                    if entry["stamp"] == stamp and other != key
+                }
+                self.answers[key] = {
+                    "stamp": stamp,
+                    "question": question,
+                    "answer": answer,
+                    "scope": scope,
+                }
+                for stale in list(self.answers)[: -self.max_answers]:
+                    del self.answers[stale]
+                self._dirty = True
+            if embedding is not None:
+                embeddings = self.embeddings
+                embedding_key = question_key(question)
+                embeddings.pop(embedding_key, None)
+                embeddings[embedding_key] = encode_embedding(embedding)
+                for stale in list(embeddings)[: -self.max_answers]:
+                    del embeddings[stale]
+                self._embeddings_dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if self._dirty:
+                _write_json(self.path, {"answers": self.answers})
+                self._dirty = False
+            if self._embeddings_dirty and self._embeddings is not None:
+                _write_json(self.embeddings_path, self._embeddings)
+                self._embeddings_dirty = False
@@ -1,4 +1,33 @@
+import json
+import os
+import re
+import shlex
+import shutil
 import subprocess
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Optional
+
+# One incremental cache for every check of a run, and across runs.
+MYPY_CACHE_DIR = ".menderbot/mypy_cache"
+MYPY_FLAGS = (
+    "--ignore-missing-imports --no-error-summary --soft-error-limit 10"
+    f" --cache-dir {MYPY_CACHE_DIR}"
+)
+DMYPY_STATUS_FILE = ".menderbot/dmypy.json"
+PYRIGHT_COMMAND = "pyright-langserver --stdio"
+# Seconds to wait for the language server to answer.
+PYRIGHT_TIMEOUT = 120.0
+# Close to what MYPY_FLAGS checks, a pyrightconfig.json in the repo wins.
+PYRIGHT_SETTINGS = {
+    "typeCheckingMode": "basic",
+    "diagnosticSeverityOverrides": {
+        "reportMissingImports": "none",
+        "reportMissingModuleSource": "none",
+    },
+}
+ERROR_LINE_RE = re.compile(r"^[^:\n]+:\d+:(?:\d+:)? error:", re.MULTILINE)
 
 
 def run_check(command: str) -> tuple[bool, str]:
@@ -11,3 +40,452 @@ def run_check(command: str) -> tuple[bool, str]:
         )
     except subprocess.CalledProcessError as e:
         return (False, e.output)
+
+
+def errors_in_paths(result: tuple[bool, str], paths) -> tuple[bool, str]:
+    """
+    A check result counting only the errors in `paths`, as checkers also
+    report errors in modules they followed or were given besides.
+    """
+    from menderbot.typing import parse_check_errors  # Lazy import
+
+    success, output = result
+    if success or not ERROR_LINE_RE.search(output):
+        # Passed, or the checker itself failed.
+        return result
+    errors = [error for path in paths for _, error in parse_check_errors(output, path)]
+    return (not errors, "\n".join(errors))
+
+
+def package_root(path: str) -> str:
+    """The outermost package directory containing `path`, or `path` itself."""
+    root = os.path.abspath(path)
+    parent = os.path.dirname(root)
+    while os.path.exists(os.path.join(parent, "__init__.py")):
+        root = parent
+        parent = os.path.dirname(parent)
+    return os.path.relpath(root)
+
+
+def shadow_file_args(shadows: dict[str, str]) -> str:
+    return " ".join(
+        f"--shadow-file {shlex.quote(source)} {shlex.quote(shadow)}"
+        for source, shadow in shadows.items()
+    )
+
+
+class TypeChecker(ABC):
+    """
+    Checks files with hints applied in shadow copies, the files themselves
+    are only read. Output has errors in mypy's `path:line: error: message`
+    form, whichever checker produced them.
+    """
+
+    def __init__(self, shadows: Optional[dict[str, str]] = None):
+        # Relative like the paths checkers report, so they can be matched.
+        self.shadows = {
+            os.path.relpath(p): shadow for p, shadow in (shadows or {}).items()
+        }
+
+    @staticmethod
+    def available() -> bool:
+        return True
+
+    @abstractmethod
+    def baseline(self, *paths: str) -> tuple[bool, str]:
+        pass
+
+    @abstractmethod
+    def check(self, path: str, shadow_path: str) -> tuple[bool, str]:
+        pass
+
+    def refresh(self, path: str) -> None:
+        """Make modules checked later see the final shadow of `path`."""
+        del path
+
+    def release(self, *paths: str) -> None:
+        """Forget the shadows of `paths`, once no later check needs them."""
+        for path in paths:
+            self.shadows.pop(os.path.relpath(path), None)
+
+    def stop(self) -> None:
+        pass
+
+
+class MypyChecker(TypeChecker):
+    """
+    Runs a fresh mypy process for every check. Registered `shadows` are read
+    in place of their files by every check, so other modules being typed in
+    the same run are seen with their hints.
+    """
+
+    def __init__(
+        self, shadows: Optional[dict[str, str]] = None, flags: str = MYPY_FLAGS
+    ):
+        super().__init__(shadows)
+        self.flags = flags
+
+    @staticmethod
+    def available() -> bool:
+        return shutil.which("mypy") is not None
+
+    def baseline(self, *paths: str) -> tuple[bool, str]:
+        path_args = " ".join(shlex.quote(path) for path in paths)
+        return run_check(f"mypy {self.flags} {path_args}")
+
+    def check(self, path: str, shadow_path: str) -> tuple[bool, str]:
+        shadows = {**self.shadows, os.path.relpath(path): shadow_path}
+        shadow_args = shadow_file_args(shadows)
+        return run_check(f"mypy {self.flags} {shadow_args} {shlex.quote(path)}")
+
+
+class DmypyChecker(TypeChecker):
+    """
+    Keeps a mypy daemon warm for the session, so only the first check pays
+    for a cold start.
+
+    The daemon decides what changed by hashing the real file, so it never
+    notices new shadow content by itself. Each check removes and re-adds the
+    module, which makes it read the shadow again. That needs imports to be
+    skipped rather than followed, so the whole package is given as sources to
+    keep types from sibling modules. Errors in those other modules are not
+    the checked file's, only errors in the files asked about count.
+
+    Checks may come from several threads, they run one at a time.
+    """
+
+    def __init__(
+        self, shadows: dict[str, str], flags: str = MYPY_FLAGS, status_file=None
+    ):
+        super().__init__(shadows)
+        self.flags = flags
+        self.status_file = status_file or DMYPY_STATUS_FILE
+        self.started = False
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def available() -> bool:
+        return shutil.which("dmypy") is not None
+
+    def _dmypy(self, args: str) -> tuple[bool, str]:
+        status_dir = os.path.dirname(self.status_file)
+        if status_dir:
+            os.makedirs(status_dir, exist_ok=True)
+        command = f"dmypy --status-file {shlex.quote(self.status_file)} {args}"
+        with self._lock:
+            completed = subprocess.run(
+                command,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT,
+                shell=True,
+                text=True,
+                check=False,
+            )
+        output = completed.stdout
+        # Rechecks exit with 1 for notes alone, so look for actual errors.
+        if completed.returncode == 1:
+            return (not ERROR_LINE_RE.search(output), output)
+        return (completed.returncode == 0, output)
+
+    def _run(self) -> tuple[bool, str]:
+        shadow_args = shadow_file_args(self.shadows)
+        roots = sorted({package_root(source) for source in self.shadows})
+        sources = " ".join(shlex.quote(root) for root in roots)
+        result = self._dmypy(
+            f"run -- {self.flags} --follow-imports=skip {shadow_args} {sources}"
+        )
+        self.started = True
+        return result
+
+    def baseline(self, *paths: str) -> tuple[bool, str]:
+        # All registered files are checked together.
+        with self._lock:
+            return errors_in_paths(self._run(), paths or list(self.shadows))
+
+    def check(self, path: str, shadow_path: str) -> tuple[bool, str]:
+        path = os.path.relpath(path)
+        if shadow_path != self.shadows.get(path):
+            raise ValueError(f"No shadow file registered for {path}")
+        with self._lock:
+            if not self.started:
+                return errors_in_paths(self._run(), [path])
+            path_arg = shlex.quote(path)
+            result = self._dmypy(f"recheck --remove {path_arg} --update {path_arg}")
+            return errors_in_paths(result, [path])
+
+    def refresh(self, path: str) -> None:
+        if self.started:
+            self.check(path, self.shadows[os.path.relpath(path)])
+
+    def release(self, *paths: str) -> None:
+        with self._lock:
+            registered = [p for p in map(os.path.relpath, paths) if p in self.shadows]
+            if self.started and registered:
+                self._dmypy(
+                    "recheck --remove " + " ".join(map(shlex.quote, registered))
+                )
+            super().release(*registered)
+
+    def stop(self) -> None:
+        if self.started:
+            self._dmypy("stop")
+            self.started = False
+
+
+class PyrightChecker(TypeChecker):
+    """
+    Keeps a pyright language server running for the session and talks to it
+    over stdio. Shadow content is sent as the text of the open document, so
+    a check spawns nothing and only waits for the diagnostics of that file.
+    Registered files are all kept open, which makes modules importing them
+    see their shadows.
+    """
+
+    def __init__(
+        self,
+        shadows: dict[str, str],
+        command: str = PYRIGHT_COMMAND,
+        timeout: float = PYRIGHT_TIMEOUT,
+    ):
+        super().__init__(shadows)
+        self.command = command
+        self.timeout = timeout
+        self._process: Optional[subprocess.Popen] = None
+        self._next_id = 0
+        self._versions: dict[str, int] = {}
+        self._encodings: dict[str, str] = {}
+        # Filled by the reader thread, guarded by `_received`.
+        self._responses: dict[int, dict] = {}
+        self._diagnostics: dict[str, tuple[Optional[int], list]] = {}
+        self._received = threading.Condition()
+        self._write_lock = threading.Lock()
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def available() -> bool:
+        return shutil.which(shlex.split(PYRIGHT_COMMAND)[0]) is not None
+
+    def _send(self, message: dict) -> None:
+        assert self._process and self._process.stdin
+        body = json.dumps({"jsonrpc": "2.0", **message}).encode("utf-8")
+        with self._write_lock:
+            self._process.stdin.write(f"Content-Length: {len(body)}\r\n\r\n".encode())
+            self._process.stdin.write(body)
+            self._process.stdin.flush()
+
+    def _read_messages(self) -> None:
+        assert self._process and self._process.stdout
+        stdout = self._process.stdout
+        while True:
+            headers = {}
+            while True:
+                line = stdout.readline()
+                if not line:
+                    with self._received:
+                        self._process = None
+                        self._received.notify_all()
+                    return
+                if not line.strip():
+                    break
+                key, _, value = line.decode("ascii").partition(":")
+                headers[key.strip().lower()] = value.strip()
+            body = stdout.read(int(headers["content-length"]))
+            self._handle(json.loads(body))
+
+    def _handle(self, message: dict) -> None:
+        method = message.get("method")
+        if method and "id" in message:
+            # The server waits on its own requests, answer them all.
+            result = None
+            if method == "workspace/configuration":
+                result = [
+                    (
+                        PYRIGHT_SETTINGS
+                        if item.get("section") == "python.analysis"
+                        else None
+                    )
+                    for item in message["params"]["items"]
+                ]
+            self._send({"id": message["id"], "result": result})
+        elif method == "textDocument/publishDiagnostics":
+            params = message["params"]
+            with self._received:
+                self._diagnostics[params["uri"]] = (
+                    params.get("version"),
+                    params["diagnostics"],
+                )
+                self._received.notify_all()
+        elif "id" in message:
+            with self._received:
+                self._responses[message["id"]] = message
+                self._received.notify_all()
+
+    def _wait_for(self, predicate) -> None:
+        with self._received:
+            done = self._received.wait_for(
+                lambda: predicate() or self._process is None, self.timeout
+            )
+            if not done or self._process is None:
+                raise RuntimeError(f"No answer from '{self.command}'")
+
+    def _request(self, method: str, params: dict) -> dict:
+        self._next_id += 1
+        request_id = self._next_id
+        self._send({"id": request_id, "method": method, "params": params})
+        self._wait_for(lambda: request_id in self._responses)
+        with self._received:
+            return self._responses.pop(request_id)
+
+    def _start(self) -> None:
+        self._process = subprocess.Popen(
+            shlex.split(self.command),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+        threading.Thread(target=self._read_messages, daemon=True).start()
+        root_uri = Path.cwd().as_uri()
+        self._request(
+            "initialize",
+            {
+                "processId": os.getpid(),
+                "rootUri": root_uri,
+                "workspaceFolders": [{"uri": root_uri, "name": "root"}],
+                "capabilities": {
+                    "workspace": {"configuration": True},
+                    "textDocument": {"publishDiagnostics": {"versionSupport": True}},
+                },
+            },
+        )
+        self._send({"method": "initialized", "params": {}})
+        for path in self.shadows:
+            self._sync(path)
+
+    def _shadow_text(self, path: str) -> str:
+        """Shadows are written in the encoding of their source file."""
+        if path not in self._encodings:
+            from menderbot.source_file import SourceFile  # Lazy import
+
+            source_file = SourceFile(path)
+            source_file.load_source_as_utf8()
+            self._encodings[path] = source_file.encoding or "utf_8"
+        with open(self.shadows[path], "r", encoding=self._encodings[path]) as shadow:
+            return shadow.read()
+
+    def _sync(self, path: str) -> tuple[str, int]:
+        """Send the current shadow of `path` as its document text."""
+        text = self._shadow_text(path)
+        uri = Path(path).resolve().as_uri()
+        version = self._versions.get(uri, 0) + 1
+        self._versions[uri] = version
+        with self._received:
+            self._diagnostics.pop(uri, None)
+        if version == 1:
+            document = {"uri": uri, "languageId": "python", "version": 1, "text": text}
+            self._send(
+                {"method": "textDocument/didOpen", "params": {"textDocument": document}}
+            )
+        else:
+            self._send(
+                {
+                    "method": "textDocument/didChange",
+                    "params": {
+                        "textDocument": {"uri": uri, "version": version},
+                        "contentChanges": [{"text": text}],
+                    },
+                }
+            )
+        return (uri, version)
+
+    def _errors(self, path: str, uri: str, version: int) -> list[str]:
+        def is_current():
+            if uri not in self._diagnostics:
+                return False
+            published = self._diagnostics[uri][0]
+            return published is None or published >= version
+
+        self._wait_for(is_current)
+        with self._received:
+            diagnostics = self._diagnostics[uri][1]
+        errors = []
+        for diagnostic in diagnostics:
+            # Severity 1 is an error, the default when left out.
+            if diagnostic.get("severity", 1) != 1:
+                continue
+            start = diagnostic["range"]["start"]
+            message = " ".join(diagnostic["message"].split())
+            rule = f"  [{diagnostic['code']}]" if diagnostic.get("code") else ""
+            errors.append(
+                f"{path}:{start['line'] + 1}:{start['character'] + 1}: error: {message}{rule}"
+            )
+        return errors
+
+    def baseline(self, *paths: str) -> tuple[bool, str]:
+        with self._lock:
+            if self._process is None:
+                self._start()
+            errors = []
+            for path in [os.path.relpath(p) for p in paths] or list(self.shadows):
+                errors += self._errors(path, *self._sync(path))
+            return (not errors, "\n".join(errors))
+
+    def check(self, path: str, shadow_path: str) -> tuple[bool, str]:
+        path = os.path.relpath(path)
+        if shadow_path != self.shadows.get(path):
+            raise ValueError(f"No shadow file registered for {path}")
+        with self._lock:
+            if self._process is None:
+                self._start()
+            errors = self._errors(path, *self._sync(path))
+            return (not errors, "\n".join(errors))
+
+    def refresh(self, path: str) -> None:
+        with self._lock:
+            if self._process is not None:
+                self._sync(os.path.relpath(path))
+
+    def release(self, *paths: str) -> None:
+        with self._lock:
+            for path in paths:
+                uri = Path(path).resolve().as_uri()
+                opened = self._versions.pop(uri, 0)
+                with self._received:
+                    self._diagnostics.pop(uri, None)
+                if self._process is not None and opened:
+                    # Importers see the file on disk again.
+                    params = {"textDocument": {"uri": uri}}
+                    self._send({"method": "textDocument/didClose", "params": params})
+                self._encodings.pop(os.path.relpath(path), None)
+            super().release(*paths)
+
+    def stop(self) -> None:
+        with self._lock:
+            process = self._process
+            if process is None:
+                return
+            try:
+                self._request("shutdown", {})
+                self._send({"method": "exit"})
+                process.wait(timeout=5)
+            except (RuntimeError, OSError, subprocess.TimeoutExpired):
+                process.kill()
+            self._process = None
+            self._versions.clear()
+
+
+CHECKERS: dict[str, type[TypeChecker]] = {
+    "dmypy": DmypyChecker,
+    "mypy": MypyChecker,
+    "pyright": PyrightChecker,
+}
+# Tried in order by "auto". Pyright judges hints differently, so it is only
+# used when asked for by name.
+AUTO_CHECKERS = ("dmypy", "mypy")
+
+
+def select_checker(shadows: dict[str, str], name: str = "auto") -> TypeChecker:
+    """The named checker, or with "auto" the first of AUTO_CHECKERS available."""
+    if name == "auto":
+        name = next((n for n in AUTO_CHECKERS if CHECKERS[n].available()), "mypy")
+    checker_class = CHECKERS[name]
+    return checker_class(shadows)
@@ -81,6 +81,10 @@ class LanguageStrategy(ABC):
     def get_function_nodes(self, tree) -> list:
         pass
 
+    @abstractmethod
+    def get_function_node_name(self, node) -> str:
+        pass
+
     def get_imports(self, tree) -> list:
         del tree
         return []
@@ -138,19 +142,22 @@ class PythonLanguageStrategy(LanguageStrategy):
 
         class MyListener(PythonParserListener):
             def enterFrom_stmt(self, ctx: PythonParser.From_stmtContext):
+                # Relative imports keep their leading dots, as in the source.
+                module = "." * len(ctx.DOT()) + "..." * len(ctx.ELLIPSIS())
                 dotted_name_ctx: PythonParser.Dotted_nameContext = ctx.dotted_name()
+                if dotted_name_ctx:
+                    module += dotted_name_ctx.getText()
                 import_as_names_ctx: PythonParser.Import_as_namesContext = (
                     ctx.import_as_names()
                 )
+                if not import_as_names_ctx:
+                    results.append((module, "*"))
+                    return
                 import_as_name_ctxs: list[PythonParser.Import_as_nameContext] = (
                     import_as_names_ctx.import_as_name()
                 )
-                # print(type(import_as_name_ctxs))
                 for import_as_name_ctx in import_as_name_ctxs:
-                    results.append(
-                        (dotted_name_ctx.getText(), node_str(import_as_name_ctx))
-                    )
-                # print(ctx.toStringTree(recog=parser))
+                    results.append((module, node_str(import_as_name_ctx)))
 
             def enterImport_stmt(self, ctx: PythonParser.Import_stmtContext):
                 dotted_as_names_ctx: PythonParser.Dotted_as_namesContext = (
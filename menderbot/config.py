@@ -1,15 +1,74 @@
+import os
+import threading
 from os.path import exists, join
+from typing import Optional
 
 import yaml
 
 from menderbot.git_client import git_show_top_level
 
+CONFIG_FILE_NAME = ".menderbot-config.yaml"
+
+
+class RepoContext:
+    """
+    The git top level and the parsed config, resolved once per process
+    instead of on every call. The top level is looked up again only when the
+    working directory changes, the config when its mtime does.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._cwd: Optional[str] = None
+        self._top_level: Optional[str] = None
+        self._config_key: Optional[tuple[str, int]] = None
+        self._config: Optional[dict] = None
+
+    @property
+    def top_level(self) -> Optional[str]:
+        cwd = os.getcwd()
+        with self._lock:
+            if cwd != self._cwd:
+                self._top_level = git_show_top_level()
+                self._cwd = cwd
+            return self._top_level
+
+    @property
+    def config_path(self) -> Optional[str]:
+        top_level = self.top_level
+        return join(top_level, CONFIG_FILE_NAME) if top_level else None
+
+    def config(self) -> Optional[dict]:
+        """The parsed config file, None if there is none."""
+        config_path = self.config_path
+        if not config_path:
+            return None
+        try:
+            key = (config_path, os.stat(config_path).st_mtime_ns)
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            if key != self._config_key:
+                with open(config_path, "rb") as conf_file:
+                    self._config = yaml.load(conf_file, Loader=yaml.SafeLoader)
+                self._config_key = key
+            return self._config
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._cwd = None
+            self._config_key = None
+
+
+_repo_context = RepoContext()
+
+
+def repo_context() -> RepoContext:
+    return _repo_context
+
 
 def get_config_path():
-    git_path = git_show_top_level()
-    if not git_path:
-        return None
-    return join(git_path, ".menderbot-config.yaml")
+    return repo_context().config_path
 
 
 DEFAULT_CONFIG_YAML = """
@@ -23,6 +82,17 @@ apis:
         api_key_env_var: OPENAI_API_KEY
         # organization_env_var: OPENAI_ORGANIZATION
         # api_base: https://api.openai.com/v1
+# The index is stored in shards, only those with changed files are rewritten.
+# ingest:
+#     shard_by: directory  # top-level directory, or hash
+#     shard_count: 16  # for hash
+#     store: json  # or sqlite, documents are then read as needed
+# Answers to `ask` are cached per index version. With semantic_cache, a
+# question close enough to an earlier one gets its answer, labeled as cached.
+# ask:
+#     semantic_cache: no
+#     similarity_threshold: 0.95
+#     max_cached_answers: 500
 """
 
 
@@ -32,7 +102,7 @@ def has_llm_consent():
 
 def has_config():
     config_path = get_config_path()
-    return config_path and exists(get_config_path())
+    return config_path and exists(config_path)
 
 
 def create_default_config(message="Writing default config"):
@@ -49,13 +119,12 @@ def create_default_config(message="Writing default config"):
 
 
 def load_config() -> dict:
-    loader = yaml.SafeLoader
     config_path = get_config_path()
     if not config_path:
         print("Cannot resolve config path. Not in git repo?")
         # Maybe should raise?
-        return yaml.load("", Loader=loader)
+        return yaml.load("", Loader=yaml.SafeLoader)
     if not has_config():
         create_default_config()
-    with open(config_path, "rb") as conf_file:
-        return yaml.load(conf_file, Loader=loader)
+    # Shared across callers, treat as read-only.
+    return repo_context().config() or {}
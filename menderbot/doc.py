@@ -2,7 +2,8 @@ import logging
 import os
 from typing import Callable
 
-from menderbot.code import LANGUAGE_STRATEGIES, node_start_line, node_str
+from menderbot.analysis import FunctionSummary, summarize_functions
+from menderbot.code import LANGUAGE_STRATEGIES
 from menderbot.source_file import Insertion, SourceFile
 
 logger = logging.getLogger("doc")
@@ -41,21 +42,29 @@ def document_file(source_file: SourceFile, doc_gen: Callable) -> list[Insertion]
 
     source = source_file.load_source_as_utf8()
     tree = language_strategy.parse_source_to_tree(source)
+    return document_functions(
+        summarize_functions(language_strategy, tree), file_extension, doc_gen
+    )
+
+
+def document_functions(
+    functions: list[FunctionSummary], file_extension: str, doc_gen: Callable
+) -> list[Insertion]:
+    """
+    Generates documentation for the summarized functions that don't have it,
+    for callers that already parsed the file, e.g. with `analyze_files`.
+    """
     insertions = []
-    for node in language_strategy.get_function_nodes(tree):
-        if not language_strategy.function_has_comment(node):
-            name = language_strategy.get_function_node_name(node)
+    for function in functions:
+        if not function.has_comment:
+            name = function.name
             logger.info('Found undocumented function "%s"', name)
-            code = node_str(node)
+            code = function.text
             comment = doc_gen(code, file_extension)
-            function_start_line = node_start_line(node)
-            doc_start_line = (
-                function_start_line + language_strategy.function_doc_line_offset
-            )
             if comment:
                 logger.info("Documenting with: %s", comment)
                 logger.info("For code: %s", code)
                 insertions.append(
-                    Insertion(text=comment, line_number=doc_start_line, label=name)
+                    Insertion(text=comment, line_number=function.doc_line, label=name)
                 )
     return insertions
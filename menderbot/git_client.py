@@ -1,3 +1,4 @@
+import hashlib
 import subprocess
 import tempfile
 from typing import Optional
@@ -28,3 +29,10 @@ def git_show_top_level() -> Optional[str]:
         ).strip()
     except subprocess.CalledProcessError:
         return None
+
+
+def git_blob_sha(path: str) -> str:
+    """The object id git gives the file's content, without running git."""
+    with open(path, "rb") as blob_file:
+        data = blob_file.read()
+    return hashlib.sha1(b"blob %d\0" % len(data) + data).hexdigest()
@@ -0,0 +1,107 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Iterable, Optional
+
+HINT_CACHE_FILE = ".menderbot/type_hints.json"
+# Rejected hints remembered per function, oldest dropped first.
+MAX_REJECTED = 5
+
+Hints = list[tuple[str, str]]
+
+
+def bound_name(module: str, name: str) -> str:
+    """The name an import binds, as in `get_imports` entries."""
+    name, _, alias = name.partition(" as ")
+    if alias:
+        return alias.strip()
+    return name.strip() if module else name.strip().split(".")[0]
+
+
+def relevant_imports(
+    function_text: str, imports: Iterable[tuple[str, str]]
+) -> list[tuple[str, str]]:
+    """Imports whose bound name appears in the function."""
+    words = set(re.findall(r"\b\w+\b", function_text))
+    return sorted(
+        {
+            (module, name)
+            for module, name in imports
+            if bound_name(module, name) in words
+        }
+    )
+
+
+def _normalize(hints: Iterable) -> Hints:
+    return sorted((ident, new_type) for ident, new_type in hints)
+
+
+class HintCache:
+    """
+    Hints the type checker accepted or rejected on earlier runs. Keyed by a
+    hash of the function text and the imports it refers to, so a change to
+    either misses. Safe to use from the threads typing several files.
+    """
+
+    def __init__(self, path: str = HINT_CACHE_FILE):
+        self.path = path
+        self.entries: dict[str, dict] = {}
+        self._dirty = False
+        self._lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, "r", encoding="utf-8") as cache_file:
+                    self.entries = json.load(cache_file)
+            except (OSError, ValueError):
+                # Only a cache, start over.
+                self.entries = {}
+
+    @staticmethod
+    def key(function_text: str, imports: Iterable[tuple[str, str]]) -> str:
+        digest = hashlib.sha256(function_text.encode("utf-8"))
+        for module, name in relevant_imports(function_text, imports):
+            digest.update(f"\n{module}:{name}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def accepted(self, key: str) -> Optional[Hints]:
+        with self._lock:
+            hints = self.entries.get(key, {}).get("accepted")
+        return [(ident, new_type) for ident, new_type in hints] if hints else None
+
+    def rejection(self, key: str, hints: Iterable) -> Optional[str]:
+        """The checker errors from when these hints failed before, if they did."""
+        hints = _normalize(hints)
+        with self._lock:
+            for rejected in self.entries.get(key, {}).get("rejected", []):
+                if _normalize(rejected["hints"]) == hints:
+                    return rejected["errors"]
+        return None
+
+    def accept(self, key: str, hints: Iterable) -> None:
+        with self._lock:
+            self.entries.setdefault(key, {})["accepted"] = _normalize(hints)
+            self._dirty = True
+
+    def reject(self, key: str, hints: Iterable, errors: str) -> None:
+        with self._lock:
+            entry = self.entries.setdefault(key, {})
+            rejected = entry.setdefault("rejected", [])
+            rejected.append({"hints": _normalize(hints), "errors": errors})
+            del rejected[:-MAX_REJECTED]
+            # Failing in this context means the old answer no longer holds.
+            if _normalize(entry.get("accepted") or []) == _normalize(hints):
+                entry.pop("accepted", None)
+            self._dirty = True
+
+    def save(self) -> None:
+        with self._lock:
+            if not self._dirty:
+                return
+            cache_dir = os.path.dirname(self.path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            with open(self.path, "w", encoding="utf-8") as cache_file:
+                json.dump(self.entries, cache_file, indent=1, sort_keys=True)
+            self._dirty = False
@@ -1,37 +1,107 @@
+import asyncio
 import glob
+import json
 import os
+import shutil
+from concurrent.futures import Future, ThreadPoolExecutor
 from os.path import splitext
+from typing import Callable, Iterable, Optional
+from uuid import uuid4
 
 from git import Repo
 from llama_index.agent.openai import OpenAIAgent  # type: ignore[import-untyped]
 from llama_index.core import (
+    Document,
     ServiceContext,
     SimpleDirectoryReader,
     StorageContext,
     VectorStoreIndex,
     load_index_from_storage,
 )
+from llama_index.core.base.base_query_engine import BaseQueryEngine
+from llama_index.core.base.response.schema import Response
 from llama_index.core.llms.mock import MockLLM
+from llama_index.core.query_engine import RetrieverQueryEngine
+from llama_index.core.schema import QueryBundle
 from llama_index.core.tools import QueryEngineTool
+from llama_index.core.vector_stores.types import (
+    FilterOperator,
+    MetadataFilter,
+    MetadataFilters,
+)
 from llama_index.embeddings.openai import (  # type: ignore[import-untyped]
     OpenAIEmbedding,
 )
 from llama_index.llms.openai import OpenAI  # type: ignore[import-untyped]
 
-from menderbot.llm import is_test_override
+from menderbot.answer_cache import (
+    DEFAULT_SIMILARITY_THRESHOLD,
+    MAX_ANSWERS,
+    AnswerCache,
+)
+from menderbot.config import load_config
+from menderbot.git_client import git_blob_sha
+from menderbot.llm_config import is_test_override
+from menderbot.sharded_index import (
+    DEFAULT_SHARD_COUNT,
+    LAYOUT_FILE,
+    SHARD_BY_DIRECTORY,
+    STORE_JSON,
+    ShardedIndex,
+)
+from menderbot.watch import WATCH_DEBOUNCE_SECONDS, watch_changes
 
 PERSIST_DIR = ".menderbot/ingest"
+SHARDS_DIR_NAME = "shards"
+SHARDS_DIR = os.path.join(PERSIST_DIR, SHARDS_DIR_NAME)
+INDEX_META_FILE = os.path.join(PERSIST_DIR, "meta.json")
 INDEX_FILE_NAMES = [
     "docstore.json",
     "graph_store.json",
     "index_store.json",
     "vector_store.json",
 ]
+LANGUAGE_BY_EXTENSION = {
+    ".py": "python",
+    ".java": "java",
+    ".c": "c",
+    ".cpp": "cpp",
+    ".cc": "cpp",
+    ".go": "go",
+    ".sh": "shell",
+    ".bat": "batch",
+    ".js": "javascript",
+    ".ts": "typescript",
+    ".tsx": "typescript",
+    ".dart": "dart",
+    ".md": "markdown",
+    ".txt": "text",
+    ".test": "text",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+}
+# Metadata only for filtering retrieval, kept out of embeddings and prompts.
+FILTER_METADATA_KEYS = ["extension", "language", "top_dir", "path_prefixes"]
+# Bumped when documents get new metadata, so the next ingest rebuilds.
+DOCUMENT_METADATA_VERSION = 1
 
 
 def delete_index(persist_dir: str) -> None:
     if os.path.exists(persist_dir):
-        map(os.remove, glob.glob(os.path.join(persist_dir, "*.json")))
+        for path in glob.glob(os.path.join(persist_dir, "*.json")):
+            os.remove(path)
+        shutil.rmtree(os.path.join(persist_dir, SHARDS_DIR_NAME), ignore_errors=True)
+
+
+def shard_settings() -> dict:
+    """The `ingest` section of the config, which may choose the shard layout."""
+    ingest_config = load_config().get("ingest") or {}
+    return {
+        "shard_by": ingest_config.get("shard_by", SHARD_BY_DIRECTORY),
+        "shard_count": int(ingest_config.get("shard_count", DEFAULT_SHARD_COUNT)),
+        "store": ingest_config.get("store", STORE_JSON),
+        "metadata_version": DOCUMENT_METADATA_VERSION,
+    }
 
 
 def is_path_included(path: str) -> bool:
@@ -60,34 +130,131 @@ def is_path_included(path: str) -> bool:
 
 
 def ingest_repo(replace=False) -> None:
-    if replace:
-        delete_index(PERSIST_DIR)
-
     repo = Repo(".")
     commit = repo.commit("HEAD")
 
-    file_paths = [
+    file_paths: list[str] = [
         item.path  # type: ignore
         for item in commit.tree.traverse()
         if item.type == "blob" and is_path_included(item.path)  # type: ignore
     ]
 
-    def filename_fn(filename: str) -> dict:
-        return {"file_name": filename}
+    settings = shard_settings()
+    index = None if replace else load_sharded_index()
+    if index is None or index.layout != settings:
+        # Also clears an index from before sharding.
+        delete_index(PERSIST_DIR)
+        index = ShardedIndex(SHARDS_DIR, **settings)
+    blob_shas = {path: git_blob_sha(path) for path in file_paths}
+    # Only a sqlite index knows what it was built from, JSON reloads all.
+    changed = [
+        path for path in file_paths if not index.unchanged(path, blob_shas[path])
+    ]
+    removed = index.indexed_paths() - set(file_paths)
+    index.update(load_documents(changed), [*changed, *removed], blob_shas)
+    written = index.persist()
+    if written or index_stamp() is None:
+        write_index_meta(commit.hexsha)
+    print(f"Wrote {len(written)} of {len(index.shards)} index shards.")
+
+
+def write_index_meta(commit_sha: str) -> None:
+    """
+    Record the commit the index was built from, and a stamp that is new
+    every time the index changes, for invalidating cached answers.
+    """
+    meta = {"commit": commit_sha, "stamp": f"{commit_sha[:12]}-{uuid4().hex[:8]}"}
+    os.makedirs(PERSIST_DIR, exist_ok=True)
+    with open(INDEX_META_FILE, "w", encoding="utf-8") as meta_file:
+        json.dump(meta, meta_file)
+
+
+def index_stamp() -> Optional[str]:
+    try:
+        with open(INDEX_META_FILE, "r", encoding="utf-8") as meta_file:
+            return json.load(meta_file)["stamp"]
+    except (OSError, ValueError, KeyError):
+        return None
+
 
+def language_of(path: str) -> str:
+    _, ext = splitext(path)
+    return LANGUAGE_BY_EXTENSION.get(ext.lower(), ext.lower().lstrip("."))
+
+
+def document_metadata(path: str) -> dict:
+    """
+    The file's path, plus what `ask --path/--lang` filter on. `path_prefixes`
+    holds every leading part of the path, so a directory filter is one
+    containment test.
+    """
+    parts = path.replace(os.sep, "/").split("/")
+    _, ext = splitext(path)
+    return {
+        "file_name": path,
+        "extension": ext.lower(),
+        "language": language_of(path),
+        "top_dir": parts[0] if len(parts) > 1 else "",
+        "path_prefixes": ["/".join(parts[:i]) for i in range(1, len(parts) + 1)],
+    }
+
+
+def load_documents(file_paths: list) -> list[Document]:
+    if not file_paths:
+        return []
+    # Ids from the path let a later update replace a file's document.
     documents = SimpleDirectoryReader(
         input_files=file_paths,
-        recursive=True,
-        file_metadata=filename_fn,
+        file_metadata=document_metadata,
+        filename_as_id=True,
     ).load_data()
-    index = VectorStoreIndex.from_documents(
-        documents,
-        show_progress=True,
-    )
-    index.storage_context.persist(persist_dir=PERSIST_DIR)
+    for document in documents:
+        document.excluded_embed_metadata_keys = [
+            *document.excluded_embed_metadata_keys,
+            *FILTER_METADATA_KEYS,
+        ]
+        document.excluded_llm_metadata_keys = [
+            *document.excluded_llm_metadata_keys,
+            *FILTER_METADATA_KEYS,
+        ]
+    return documents
 
 
-def index_exists() -> bool:
+def working_tree_paths() -> list[str]:
+    """Files to index in the working tree, tracked or not but not ignored."""
+    listed = Repo(".").git.ls_files("--cached", "--others", "--exclude-standard")
+    return [
+        path
+        for path in listed.splitlines()
+        if is_path_included(path) and not path.startswith(".menderbot/")
+    ]
+
+
+def watch_repo(debounce: float = WATCH_DEBOUNCE_SECONDS, poll=False) -> None:
+    """Keep the index up to date with the working tree until interrupted."""
+    index = load_sharded_index()
+    if index is None:
+        print("No index yet, ingesting first.")
+        ingest_repo()
+        index = load_sharded_index()
+    assert index is not None
+    print("Watching for changes, Ctrl-C to stop.")
+    try:
+        for paths in watch_changes(
+            working_tree_paths, debounce=debounce, use_watchdog=not poll
+        ):
+            print(f"Updating {len(paths)} file(s): {', '.join(sorted(paths))}")
+            present = sorted(path for path in paths if os.path.isfile(path))
+            blob_shas = {path: git_blob_sha(path) for path in present}
+            index.update(load_documents(present), paths, blob_shas)
+            if index.persist():
+                write_index_meta(Repo(".").head.commit.hexsha)
+    except KeyboardInterrupt:
+        pass
+
+
+def legacy_index_exists() -> bool:
+    """An index from before sharding, all in the top of PERSIST_DIR."""
     return all(
         [
             os.path.exists(os.path.join(PERSIST_DIR, filename))
@@ -96,7 +263,31 @@ def index_exists() -> bool:
     )
 
 
-def load_index():
+def index_exists() -> bool:
+    return ShardedIndex.exists(SHARDS_DIR) or legacy_index_exists()
+
+
+def index_version() -> Optional[float]:
+    """Changes whenever the stored index is written, None without one."""
+    for path in [
+        os.path.join(SHARDS_DIR, LAYOUT_FILE),
+        os.path.join(PERSIST_DIR, INDEX_FILE_NAMES[0]),
+    ]:
+        if os.path.exists(path):
+            return os.path.getmtime(path)
+    return None
+
+
+def load_sharded_index(embed_model=None) -> Optional[ShardedIndex]:
+    if not ShardedIndex.exists(SHARDS_DIR):
+        return None
+    return ShardedIndex(SHARDS_DIR, embed_model=embed_model).load()
+
+
+def load_index(embed_model=None):
+    sharded_index = load_sharded_index(embed_model)
+    if sharded_index:
+        return sharded_index
     storage_context = StorageContext.from_defaults(persist_dir=PERSIST_DIR)
     return load_index_from_storage(storage_context)
 
@@ -115,29 +306,225 @@ def get_service_context() -> ServiceContext:
     )
 
 
-def get_query_engine():
-    if index_exists():
-        return load_index().as_query_engine(
-            similarity_top_k=5, service_context=get_service_context()
+def scope_path(path: Optional[str]) -> Optional[str]:
+    """`path` as recorded in `path_prefixes`, None for the whole repo."""
+    if not path:
+        return None
+    path = os.path.normpath(path).replace(os.sep, "/")
+    return None if path == "." else path
+
+
+def normalize_language(name: str) -> str:
+    """`--lang` takes a language name or an extension such as `py`."""
+    name = name.lower()
+    ext = name if name.startswith(".") else f".{name}"
+    return LANGUAGE_BY_EXTENSION.get(ext, name.lstrip("."))
+
+
+def metadata_filters(
+    path: Optional[str] = None, langs: Iterable[str] = ()
+) -> Optional[MetadataFilters]:
+    """Files under `path` in any of `langs`, None to search everything."""
+    filters: list = []
+    path = scope_path(path)
+    if path:
+        filters.append(
+            MetadataFilter(
+                key="path_prefixes", value=path, operator=FilterOperator.CONTAINS
+            )
+        )
+    languages = sorted({normalize_language(lang) for lang in langs})
+    if languages:
+        filters.append(
+            MetadataFilter(key="language", value=languages, operator=FilterOperator.IN)
+        )
+    return MetadataFilters(filters=filters) if filters else None
+
+
+def filter_scope(path: Optional[str] = None, langs: Iterable[str] = ()) -> str:
+    """Names the filters in the answer cache, empty for no filters."""
+    parts = []
+    path = scope_path(path)
+    if path:
+        parts.append(f"path={path}")
+    languages = sorted({normalize_language(lang) for lang in langs})
+    if languages:
+        parts.append(f"lang={','.join(languages)}")
+    return " ".join(parts)
+
+
+def get_query_engine(path: Optional[str] = None, langs: Iterable[str] = (), index=None):
+    """
+    Searches only files under `path` and in `langs` when given, the filters
+    apply before similarity scoring. Pass an `index` from `load_index` to
+    build several engines from one load.
+    """
+    service_context = get_service_context()
+    if index is None and index_exists():
+        index = load_index(service_context.embed_model)
+    filters = metadata_filters(path, langs)
+    if isinstance(index, ShardedIndex):
+        return RetrieverQueryEngine.from_args(
+            index.as_retriever(
+                similarity_top_k=5, filters=filters, path=scope_path(path)
+            ),
+            service_context=service_context,
+        )
+    if index is not None:
+        return index.as_query_engine(
+            similarity_top_k=5, service_context=service_context, filters=filters
         )
     return VectorStoreIndex.from_documents([]).as_query_engine(
-        service_context=get_service_context()
+        service_context=service_context
     )
 
 
-def ask_index(query: str):
-    return get_query_engine().query(query)
+def ask_cache_settings() -> dict:
+    """
+    The `ask` section of the config: `semantic_cache` turns on answering
+    paraphrases from the cache, `similarity_threshold` is how close they must
+    be, `max_cached_answers` how many answers are kept.
+    """
+    ask_config = load_config().get("ask") or {}
+    threshold = None
+    if ask_config.get("semantic_cache"):
+        threshold = float(
+            ask_config.get("similarity_threshold", DEFAULT_SIMILARITY_THRESHOLD)
+        )
+    return {
+        "threshold": threshold,
+        "max_answers": int(ask_config.get("max_cached_answers", MAX_ANSWERS)),
+    }
+
+
+def similar_answer_text(question: str, answer: str, similarity: float) -> str:
+    return (
+        f'(Cached answer to the similar question "{question}",'
+        f" similarity {similarity:.2f})\n{answer}"
+    )
+
 
+def ask_index(
+    query: str,
+    cache: Optional[AnswerCache] = None,
+    query_engine=None,
+    threshold: Optional[float] = None,
+    embed_model=None,
+    path: Optional[str] = None,
+    langs: Iterable[str] = (),
+) -> str:
+    """
+    The answer from the index, or from `cache` when the same question was
+    answered by this version of the index. With a `threshold`, a question
+    that close to an earlier one gets its answer, labeled as such. `path`
+    and `langs` limit the search, see `get_query_engine`.
+    """
+    stamp = index_stamp()
+    scope = filter_scope(path, langs)
+    if cache:
+        cached = cache.answer(stamp, query, scope)
+        if cached is not None:
+            cache.save()
+            return cached
+    embedding = cache.embedding(query) if cache else None
+    if cache and threshold is not None:
+        if embedding is None:
+            embed_model = embed_model or get_service_context().embed_model
+            embedding = embed_model.get_query_embedding(query)
+        similar = cache.similar(stamp, embedding, threshold, scope)
+        if similar:
+            cache.save()
+            return similar_answer_text(*similar)
+    # The retrievers fill in the embedding when it is not cached.
+    query_bundle = QueryBundle(query, embedding=embedding)
+    query_engine = query_engine or get_query_engine(path, langs)
+    answer = str(query_engine.query(query_bundle))
+    if cache:
+        cache.put(stamp, query, answer, query_bundle.embedding, scope)
+        cache.save()
+    return answer
 
-def get_chat_engine(verbose=False) -> OpenAIAgent:
+
+class CachedQueryEngine(BaseQueryEngine):
+    """Answers through `ask_index`, so chat's tool queries use the cache too."""
+
+    def __init__(
+        self, query_engine, cache: AnswerCache, threshold=None, path=None, langs=()
+    ):
+        super().__init__(callback_manager=None)
+        self._query_engine = query_engine
+        self._cache = cache
+        self._threshold = threshold
+        self._path = path
+        self._langs = langs
+
+    def _get_prompt_modules(self) -> dict:
+        return {}
+
+    def _query(self, query_bundle: QueryBundle):
+        answer = ask_index(
+            query_bundle.query_str,
+            self._cache,
+            self._query_engine,
+            self._threshold,
+            path=self._path,
+            langs=self._langs,
+        )
+        return Response(answer)
+
+    async def _aquery(self, query_bundle: QueryBundle):
+        return self._query(query_bundle)
+
+
+class DeferredQueryEngine(BaseQueryEngine):
+    """
+    Builds the real query engine on a background thread as soon as it is
+    created, queries wait for it. Lets chat take a question while a large
+    index is still loading.
+    """
+
+    def __init__(self, load: Callable[[], BaseQueryEngine] = get_query_engine):
+        super().__init__(callback_manager=None)
+        executor = ThreadPoolExecutor(max_workers=1)
+        self._engine: Future = executor.submit(load)
+        executor.shutdown(wait=False)
+
+    def ready(self) -> bool:
+        return self._engine.done()
+
+    def _get_prompt_modules(self) -> dict:
+        return {}
+
+    def _query(self, query_bundle: QueryBundle):
+        return self._engine.result().query(query_bundle)
+
+    async def _aquery(self, query_bundle: QueryBundle):
+        engine = await asyncio.wrap_future(self._engine)
+        return await engine.aquery(query_bundle)
+
+
+def get_chat_engine(
+    verbose=False,
+    cache: Optional[AnswerCache] = None,
+    path: Optional[str] = None,
+    langs: Iterable[str] = (),
+) -> OpenAIAgent:
     system_prompt = """
 You are a Menderbot chat agent discussing a legacy codebase.
 """
     tool_description = """Useful for running a natural language query
 about the codebase and get back a natural language response.
 """
+    threshold = ask_cache_settings()["threshold"] if cache else None
+
+    def load():
+        query_engine = get_query_engine(path, langs)
+        if cache is None:
+            return query_engine
+        return CachedQueryEngine(query_engine, cache, threshold, path, langs)
+
     query_engine_tool = QueryEngineTool.from_defaults(
-        query_engine=get_query_engine(), description=tool_description
+        query_engine=DeferredQueryEngine(load), description=tool_description
     )
     service_context = get_service_context()
     llm = service_context.llm
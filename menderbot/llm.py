@@ -9,11 +9,14 @@ from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.llms.openai import OpenAI  # type: ignore[import-untyped]
 from tenacity import retry, stop_after_attempt, wait_random_exponential
 
-from menderbot.config import has_llm_consent, load_config
-
-INSTRUCTIONS = (
-    """You are helpful electronic assistant with knowledge of Software Engineering."""
+from menderbot.config import has_llm_consent
+from menderbot.llm_config import (  # pylint: disable=unused-import
+    has_key,
+    is_test_override,
+    key_env_var,
+    openai_config,
 )
+from menderbot.prompts import INSTRUCTIONS  # pylint: disable=unused-import
 
 MODEL = "gpt-4-1106-preview"
 TEMPERATURE = 0.5
@@ -24,29 +27,20 @@ PRESENCE_PENALTY = 0.6
 MAX_CONTEXT_QUESTIONS = 10
 
 
+# Created on first use, not at import, see `init_openai`.
 __openai_client: Optional[OpenAI] = None
-__key_env_var = "OPENAI_API_KEY"
-
-
-def key_env_var() -> str:
-    return __key_env_var
 
 
 def init_openai():
     # pylint: disable-next=[global-statement]
     global __openai_client
-    global __key_env_var
     if has_llm_consent():
-        config = load_config()
-        openai_config = config.get("apis", {}).get("openai", {})
-        __key_env_var = openai_config.get("api_key_env_var", "OPENAI_API_KEY")
-        organization_env_var = openai_config.get(
-            "organization_env_var", "OPENAI_ORGANIZATION"
-        )
+        config = openai_config()
+        organization_env_var = config.get("organization_env_var", "OPENAI_ORGANIZATION")
         __openai_client = OpenAI(
-            api_key=os.getenv(__key_env_var),
+            api_key=os.getenv(key_env_var()),
             organization=os.getenv(organization_env_var),
-            base_url=openai_config.get("api_base", "https://api.openai.com/v1"),
+            base_url=config.get("api_base", "https://api.openai.com/v1"),
             temperature=TEMPERATURE,
             max_tokens=MAX_TOKENS,
             top_p=1,
@@ -55,20 +49,6 @@ def init_openai():
         )
 
 
-init_openai()
-
-
-def is_test_override() -> bool:
-    return (
-        os.getenv(key_env_var())
-        == "sk-TEST00000000000000000000000000000000000000000000"
-    )
-
-
-def has_key() -> bool:
-    return os.getenv(key_env_var(), "") != ""
-
-
 def override_response_for_test(messages) -> str:
     del messages
     return "<LLM Output>"
@@ -109,6 +89,8 @@ def get_response(
         print("===")
     if is_test_override():
         return override_response_for_test(history)
+    if __openai_client is None:
+        init_openai()
     if __openai_client is None:
         raise ValueError("OpenAI client is not initialized, check consent?")
     Settings.llm = __openai_client
@@ -0,0 +1,30 @@
+"""
+Which API key the LLM client uses, without loading the client itself, so
+commands that only report on setup stay fast.
+"""
+
+import os
+
+from menderbot.config import has_llm_consent, load_config
+
+DEFAULT_KEY_ENV_VAR = "OPENAI_API_KEY"
+TEST_KEY = "sk-TEST00000000000000000000000000000000000000000000"
+
+
+def openai_config() -> dict:
+    """The `apis.openai` section of the repo config, empty without LLM consent."""
+    if not has_llm_consent():
+        return {}
+    return load_config().get("apis", {}).get("openai", {}) or {}
+
+
+def key_env_var() -> str:
+    return openai_config().get("api_key_env_var", DEFAULT_KEY_ENV_VAR)
+
+
+def is_test_override() -> bool:
+    return os.getenv(key_env_var()) == TEST_KEY
+
+
+def has_key() -> bool:
+    return os.getenv(key_env_var(), "") != ""
@@ -1,3 +1,8 @@
+INSTRUCTIONS = (
+    """You are helpful electronic assistant with knowledge of Software Engineering."""
+)
+
+
 def type_prompt(function_text: str, needs_typing: list, previous_error: str) -> str:
     # print("previous_error", previous_error)
     needs_typing_text = ",".join(needs_typing)
@@ -1,11 +1,13 @@
 import dataclasses
 import json
+import os
+import re
 import sys
-from dataclasses import dataclass
-from typing import Optional
+import tokenize
+from typing import Iterable, Iterator, NamedTuple, Optional, TextIO, Union
 
 import libcst as cst
-from libcst.metadata import PositionProvider, WhitespaceInclusivePositionProvider
+from libcst.metadata import PositionProvider
 
 KIND_FN = "fn"
 KIND_PARAM = "param"
@@ -26,8 +28,7 @@ class DataClassJsonEncoder(json.JSONEncoder):
         return super().default(o)
 
 
-@dataclass
-class SourcePosition:
+class SourcePosition(NamedTuple):
     line: int
     col: int
 
@@ -35,8 +36,7 @@ class SourcePosition:
         return f"{self.line}:{self.col}"
 
 
-@dataclass
-class SourceRange:
+class SourceRange(NamedTuple):
     start: SourcePosition
     end: SourcePosition
 
@@ -44,45 +44,170 @@ class SourceRange:
         return f"{self.start.render()}-{self.end.render()}"
 
 
-@dataclass
+# Line breaks as the tokenizer sees them, unlike str.splitlines().
+_LINE_RE = re.compile(r"[^\r\n]*(?:\r\n|\r|\n)|[^\r\n]+")
+
+
+class SourceText:
+    """Original module source, split into lines only when first needed."""
+
+    __slots__ = ("code", "_lines")
+
+    def __init__(self, code: str):
+        self.code = code
+        self._lines: Optional[list[str]] = None
+
+    def lines(self) -> list[str]:
+        if self._lines is None:
+            self._lines = _LINE_RE.findall(self.code)
+        return self._lines
+
+    def __getstate__(self):
+        return self.code
+
+    def __setstate__(self, state):
+        self.code = state
+        self._lines = None
+
+
+class SourceSpan(NamedTuple):
+    """
+    Lines `start.line` through `end_line`, dedented by the indentation before
+    `start`, as libcst renders a nested node on its own.
+    """
+
+    source: SourceText
+    start: SourcePosition
+    end_line: int
+
+    def extract(self) -> str:
+        lines = self.source.lines()[self.start.line - 1 : self.end_line]
+        if not lines:
+            return ""
+        indent = lines[0][: self.start.col - 1]
+        if not indent:
+            return "".join(lines)
+        verbatim = _continuation_lines(lines)
+        return "".join(
+            (
+                line[len(indent) :]
+                if index not in verbatim and line.startswith(indent)
+                else line
+            )
+            for index, line in enumerate(lines)
+        )
+
+
+def _continuation_lines(lines: list[str]) -> set[int]:
+    """
+    Indexes of lines continuing a multi-line string or a backslash-joined
+    line, which libcst keeps as they are.
+    """
+    continued: set[int] = set()
+    line_ended, last_row = True, 0
+    try:
+        for token in tokenize.generate_tokens(iter(lines).__next__):
+            # Rows are from 1, so these are the indexes of the rows after.
+            continued.update(range(token.start[0], token.end[0]))
+            if not line_ended and token.start[0] > last_row:
+                continued.add(token.start[0] - 1)
+            line_ended = token.type in (tokenize.NEWLINE, tokenize.NL)
+            last_row = token.end[0]
+    except (tokenize.TokenError, SyntaxError):
+        pass
+    return continued
+
+
 class AstNode:
-    kind: str
-    src_range: SourceRange
-    props: dict[str, str]
-    children: list["AstNode"]  # forward declaration
-    text: Optional[str]
-
-    def __init__(self, kind, src_range):
-        self.kind = kind
-        self.src_range = src_range
-        self.props = {}
-        self.children = []
-        self.text = None
+    """
+    Compact syntax node, we may hold a great many of these for a whole repo.
 
-    def as_dict(self) -> dict:
+    Kinds are interned, ranges are tuples, and `props` / `children` are
+    only allocated when first touched. Text may be given as a `SourceSpan`
+    to be cut from the original source on first access.
+    """
+
+    __slots__ = ("kind", "src_range", "_props", "_children", "_text")
+
+    def __init__(self, kind: str, src_range: SourceRange):
+        self.kind = sys.intern(kind)
+        self.src_range = src_range
+        self._props: Optional[dict[str, str]] = None
+        self._children: Optional[list["AstNode"]] = None
+        self._text: Union[None, str, SourceSpan] = None
+
+    @property
+    def text(self) -> Optional[str]:
+        if isinstance(self._text, SourceSpan):
+            self._text = self._text.extract()
+        return self._text
+
+    @text.setter
+    def text(self, value: Union[None, str, SourceSpan]) -> None:
+        self._text = value
+
+    @property
+    def props(self) -> dict[str, str]:
+        if self._props is None:
+            self._props = {}
+        return self._props
+
+    @property
+    def children(self) -> list["AstNode"]:
+        if self._children is None:
+            self._children = []
+        return self._children
+
+    def as_dict(self, include_text=True) -> dict:
         d = {
             "kind": self.kind,
             "range": self.src_range.render(),
         }
-        if self.props:
-            d["props"] = self.props
-        if self.children:
-            d["children"] = self.children
-        if self.text:
+        if self._props:
+            d["props"] = self._props
+        if self._children:
+            d["children"] = self._children
+        if include_text and self.text:
             d["text"] = self.text
         return d
 
     def children_filtered(self, kind):
-        return [child for child in self.children if child.kind == kind]
+        if not self._children:
+            return []
+        return [child for child in self._children if child.kind == kind]
+
+    def __eq__(self, other):
+        if not isinstance(other, AstNode):
+            return NotImplemented
+        return (
+            self.kind == other.kind
+            and self.src_range == other.src_range
+            and (self._props or {}) == (other._props or {})
+            and (self._children or []) == (other._children or [])
+            and self.text == other.text
+        )
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self):
+        return (
+            f"AstNode(kind={self.kind!r}, src_range={self.src_range!r}, "
+            f"props={self._props or {}!r}, children={self._children or []!r}, "
+            f"text={self.text!r})"
+        )
+
+    def __getstate__(self):
+        return (self.kind, self.src_range, self._props, self._children, self._text)
+
+    def __setstate__(self, state):
+        kind, self.src_range, self._props, self._children, self._text = state
+        self.kind = sys.intern(kind)
 
 
 class FunctionCollector(cst.CSTVisitor):
-    METADATA_DEPENDENCIES = (
-        PositionProvider,
-        WhitespaceInclusivePositionProvider,
-    )
+    METADATA_DEPENDENCIES = (PositionProvider,)
 
-    def __init__(self, enclosing_module, copy_function_text=False):
+    def __init__(self, enclosing_module, copy_function_text=False, source=None):
         # stack for storing the canonical name of the current function
         super().__init__()
         self.stack: list[str] = []
@@ -93,6 +218,8 @@ class FunctionCollector(cst.CSTVisitor):
         ] = {}
         self.enclosing_module = enclosing_module
         self.copy_function_text: bool = copy_function_text
+        # Function text is cut from here lazily rather than regenerated.
+        self.source: Optional[SourceText] = source
         self.function_asts: list[AstNode] = []
 
     def visit_ClassDef(self, node: cst.ClassDef) -> Optional[bool]:
@@ -111,25 +238,23 @@ class FunctionCollector(cst.CSTVisitor):
 
         return_text = ""
         fn_ast = AstNode(kind=KIND_FN, src_range=src_range)
+        param_text = self.enclosing_module.code_for_node(node.params)
         if node.returns:
             signature_end = self._src_range(node.returns).end
             return_type = self.enclosing_module.code_for_node(node.returns.annotation)
             return_text = " -> " + return_type
             fn_ast.props[PROP_RETURN_TYPE] = return_type
         else:
-            # Include space and add 1 to get after the paren.
-            signature_end = self._src_range(node.params, include_whitespace=True).end
-            signature_end.col = signature_end.col + 1
+            signature_end = self._after_params(node, src_range.start, param_text)
         signature_range = SourceRange(signature_start, signature_end)
         qname = ".".join(tuple(self.stack))
 
         fn_ast.props[PROP_NAME] = qname
         signature_ast = AstNode(kind=KIND_SIGNATURE, src_range=signature_range)
-        param_text = self.enclosing_module.code_for_node(node.params)
         signature_ast.text = f"def {name}({param_text}){return_text}"
         fn_ast.children.append(signature_ast)
         if self.copy_function_text:
-            fn_ast.text = self.enclosing_module.code_for_node(node)
+            fn_ast.text = self._function_text(node, src_range)
         for param in node.params.params:
             signature_ast.children.append(self._param_node_to_ast(param))
         if isinstance(node.params.star_arg, cst.Param):
@@ -149,13 +274,43 @@ class FunctionCollector(cst.CSTVisitor):
     def leave_FunctionDef(self, original_node: cst.FunctionDef) -> None:
         self.stack.pop()
 
-    def _src_range(self, node: cst.CSTNode, include_whitespace=False):
-        if include_whitespace:
-            cst_range = self.get_metadata(
-                cst.metadata.WhitespaceInclusivePositionProvider, node
-            )
-        else:
-            cst_range = self.get_metadata(cst.metadata.PositionProvider, node)
+    def _function_text(
+        self, node: cst.FunctionDef, src_range: SourceRange
+    ) -> Union[str, SourceSpan]:
+        if self.source is None:
+            return self.enclosing_module.code_for_node(node)
+        start = src_range.start
+        if node.decorators:
+            start = self._src_range(node.decorators[0]).start
+        return SourceSpan(self.source, start, src_range.end.line)
+
+    def _after_params(
+        self, node: cst.FunctionDef, def_start: SourcePosition, param_text: str
+    ) -> SourcePosition:
+        """
+        Position just after the closing paren, found by walking the generated
+        text from the name. Avoids a whole-module WhitespaceInclusivePositionProvider.
+        """
+        code_for_node = self.enclosing_module.code_for_node
+        text = "".join(
+            [
+                code_for_node(node.whitespace_after_name),
+                "(",
+                code_for_node(node.whitespace_before_params),
+                param_text,
+                ")",
+            ]
+        )
+        name_end = self._src_range(node.name).end
+        newlines = text.count("\n")
+        if not newlines:
+            return SourcePosition(name_end.line, name_end.col + len(text))
+        # Generated alone, wrapped lines are missing the def's own indentation.
+        last_line = text[text.rfind("\n") + 1 :]
+        return SourcePosition(name_end.line + newlines, def_start.col + len(last_line))
+
+    def _src_range(self, node: cst.CSTNode):
+        cst_range = self.get_metadata(cst.metadata.PositionProvider, node)
         return SourceRange(
             start=SourcePosition(
                 line=cst_range.start.line, col=cst_range.start.column + 1
@@ -186,24 +341,112 @@ class FunctionCollector(cst.CSTVisitor):
     #         print(f"{node.value} found at line {pos.line}, column {pos.column}")
 
 
-def collect_function_asts(code: str):
-    module = cst.parse_module(code)
-    wrapper = cst.metadata.MetadataWrapper(module)
-    visitor = FunctionCollector(module, copy_function_text=True)
+class ImportCollector(cst.CSTVisitor):
+    """Imports anywhere in a module, as `(module, name)` like `get_imports`."""
+
+    def __init__(self, enclosing_module: cst.Module):
+        super().__init__()
+        self.enclosing_module = enclosing_module
+        self.imports: list[tuple[str, str]] = []
+
+    def _alias_text(self, alias: cst.ImportAlias) -> str:
+        text = self.enclosing_module.code_for_node(alias.name)
+        if alias.asname:
+            text += " as " + self.enclosing_module.code_for_node(alias.asname.name)
+        return text
+
+    def visit_Import(self, node: cst.Import) -> Optional[bool]:
+        for alias in node.names:
+            self.imports.append(("", self._alias_text(alias)))
+        return False
+
+    def visit_ImportFrom(self, node: cst.ImportFrom) -> Optional[bool]:
+        # Relative imports keep their leading dots, as in the source.
+        module = "." * len(node.relative)
+        if node.module:
+            module += self.enclosing_module.code_for_node(node.module)
+        if isinstance(node.names, cst.ImportStar):
+            self.imports.append((module, "*"))
+        else:
+            for alias in node.names:
+                self.imports.append((module, self._alias_text(alias)))
+        return False
+
+
+def _function_asts(module: cst.Module, code: Union[str, bytes]) -> list[AstNode]:
+    if isinstance(code, bytes):
+        code = code.decode(module.encoding)
+    wrapper = cst.metadata.MetadataWrapper(module, unsafe_skip_copy=True)
+    visitor = FunctionCollector(
+        module, copy_function_text=True, source=SourceText(code)
+    )
     wrapper.visit(visitor)
     return visitor.function_asts
 
 
+def collect_function_asts(code: Union[str, bytes]):
+    return _function_asts(cst.parse_module(code), code)
+
+
+def collect_functions_and_imports(
+    code: Union[str, bytes],
+) -> tuple[list[AstNode], list[tuple[str, str]]]:
+    """Function ASTs and imports from a single parse."""
+    module = cst.parse_module(code)
+    imports = ImportCollector(module)
+    module.visit(imports)
+    return (_function_asts(module, code), imports.imports)
+
+
 def to_json(o):
     return json.dumps(o, cls=DataClassJsonEncoder, indent=2)
 
 
+def to_ndjson_line(o) -> str:
+    return json.dumps(o, cls=DataClassJsonEncoder, separators=(",", ":")) + "\n"
+
+
+def iter_python_paths(paths: Iterable[str]) -> Iterator[str]:
+    """Files as given, directories walked for .py files, skipping hidden ones."""
+    for path in paths:
+        if not os.path.isdir(path):
+            yield path
+            continue
+        for dirpath, dirnames, filenames in os.walk(path):
+            dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+            for filename in sorted(filenames):
+                if filename.endswith(".py"):
+                    yield os.path.join(dirpath, filename)
+
+
+def iter_function_records(paths: Iterable[str], include_text=False) -> Iterator[dict]:
+    """
+    One record per function, produced a file at a time so memory does not
+    grow with the size of the codebase. Files that cannot be read or parsed
+    yield an error record.
+    """
+    for path in iter_python_paths(paths):
+        try:
+            with open(path, "rb") as file:
+                code = file.read()
+            function_asts = collect_function_asts(code)
+        except (cst.ParserSyntaxError, SyntaxError, UnicodeDecodeError, OSError) as e:
+            yield {"path": path, "kind": "error", "message": str(e)}
+            continue
+        for fn_ast in function_asts:
+            yield {"path": path, **fn_ast.as_dict(include_text=include_text)}
+
+
+def write_ndjson(records: Iterable, out: TextIO) -> int:
+    count = 0
+    for record in records:
+        out.write(to_ndjson_line(record))
+        count += 1
+    return count
+
+
 def _main():
-    print("Reading", sys.argv[0])
-    with open(sys.argv[0], "r") as file:
-        code = file.read()
-    for ast in collect_function_asts(code):
-        print(to_json(ast))
+    write_ndjson(iter_function_records(sys.argv[1:], include_text=True), sys.stdout)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,332 @@
+"""
+`menderbot serve`: a long-running process that keeps llama_index, the LLM
+client, the loaded index and the parsers warm, and answers JSON-RPC 2.0
+requests from the CLI over a Unix socket, one JSON message per line.
+"""
+
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict
+from typing import Any, Callable, Optional
+
+from menderbot.answer_cache import AnswerCache
+from menderbot.config import repo_context
+
+SOCKET_PATH = ".menderbot/menderbot.sock"
+# Set to 1 to always run commands in the CLI process.
+NO_SERVER_ENV = "MENDERBOT_NO_SERVER"
+# Answers to identical review and diff prompts, kept for the server's life.
+MAX_CACHED_RESPONSES = 256
+# Seconds to wait for the server to accept, and for each message it sends.
+# Past either, the command runs in the CLI process instead.
+CONNECT_TIMEOUT_SECONDS = 2.0
+READ_TIMEOUT_SECONDS = 300.0
+
+METHOD_NOT_FOUND = -32601
+SERVER_ERROR = -32000
+
+logger = logging.getLogger("server")
+# The current request's way of sending notifications to its client.
+_request = threading.local()
+
+
+class RemoteError(Exception):
+    """The server ran the request and it failed."""
+
+
+class ServerRunningError(Exception):
+    """Another server already answers on the socket."""
+
+
+def socket_path() -> str:
+    """The socket of the repo containing the working directory."""
+    return os.path.join(repo_context().top_level or ".", SOCKET_PATH)
+
+
+def call(
+    method: str,
+    params: dict,
+    path: Optional[str] = None,
+    on_output: Optional[Callable[[str], None]] = None,
+) -> Any:
+    """
+    The result of `method`. Output the server prints for the request comes
+    first as `output` notifications, passed to `on_output`.
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT_SECONDS)
+        sock.connect(path or socket_path())
+        sock.settimeout(READ_TIMEOUT_SECONDS)
+        request = {"jsonrpc": "2.0", "id": 1, "method": method, "params": params}
+        sock.sendall(json.dumps(request).encode("utf-8") + b"\n")
+        with sock.makefile("rb") as stream:
+            while True:
+                line = stream.readline()
+                if not line:
+                    raise RemoteError("Server closed the connection")
+                response = json.loads(line)
+                if "id" in response:
+                    break
+                if response.get("method") == "output" and on_output:
+                    on_output(response["params"]["text"])
+    if "error" in response:
+        raise RemoteError(response["error"]["message"])
+    return response["result"]
+
+
+def try_call(
+    method: str, params: dict, on_output: Optional[Callable[[str], None]] = None
+) -> tuple[bool, Any]:
+    """(True, result) from a running server, (False, None) without one."""
+    path = socket_path()
+    if os.environ.get(NO_SERVER_ENV) == "1" or not os.path.exists(path):
+        return (False, None)
+    try:
+        return (True, call(method, params, path, on_output))
+    except (ConnectionRefusedError, FileNotFoundError):
+        # Left behind by a server that did not shut down cleanly.
+        return (False, None)
+    except TimeoutError:
+        logger.warning("menderbot serve is not answering, running here instead.")
+        return (False, None)
+
+
+class _ClientOutput(io.TextIOBase):
+    """A file whose writes go to the client as `output` notifications."""
+
+    def __init__(self, notify: Callable[[dict], None]):
+        super().__init__()
+        self._notify = notify
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        if text:
+            self._notify(
+                {"jsonrpc": "2.0", "method": "output", "params": {"text": text}}
+            )
+        return len(text)
+
+
+@contextmanager
+def _output_to_client(console):
+    """Send what the rich `console` prints, from any thread, to the client."""
+    notify = getattr(_request, "notify", None)
+    if notify is None:
+        yield
+        return
+    saved = console.file
+    console.file = _ClientOutput(notify)
+    try:
+        yield
+    finally:
+        console.file = saved
+
+
+def _insertions_to_json(results: dict) -> dict:
+    return {
+        path: {"mtime": mtime, "insertions": [asdict(ins) for ins in insertions]}
+        for path, (mtime, insertions) in results.items()
+    }
+
+
+class MenderbotService:
+    """The methods served, each takes keyword params and returns JSON data."""
+
+    def __init__(self):
+        self._index = None
+        self._query_engines: dict[str, Any] = {}
+        self._index_version: Optional[float] = None
+        self._responses: dict[str, str] = {}
+        self._answers = AnswerCache()
+        self._lock = threading.Lock()
+        # Type checkers share one dmypy status file and the scratch shadow
+        # paths, so requests that edit files run one at a time.
+        self._edit_lock = threading.Lock()
+
+    def _get_query_engine(self, path=None, langs=()):
+        from menderbot.ingest import (  # Lazy import
+            filter_scope,
+            get_query_engine,
+            get_service_context,
+            index_version,
+            load_index,
+        )
+
+        # Reload when `menderbot ingest` wrote a new index.
+        version = index_version()
+        scope = filter_scope(path, langs)
+        with self._lock:
+            if self._index is None or version != self._index_version:
+                self._index = load_index(get_service_context().embed_model)
+                self._query_engines = {}
+                self._index_version = version
+            if scope not in self._query_engines:
+                # One loaded index serves every combination of filters.
+                self._query_engines[scope] = get_query_engine(
+                    path, langs, index=self._index
+                )
+            return self._query_engines[scope]
+
+    def _cached_response(self, prompt: str) -> str:
+        from menderbot.__main__ import get_response  # Lazy import
+        from menderbot.prompts import INSTRUCTIONS  # Lazy import
+
+        with self._lock:
+            if prompt in self._responses:
+                return self._responses[prompt]
+        response = get_response(INSTRUCTIONS, [], prompt)
+        with self._lock:
+            if len(self._responses) >= MAX_CACHED_RESPONSES:
+                self._responses.pop(next(iter(self._responses)))
+            self._responses[prompt] = response
+        return response
+
+    def ping(self) -> dict:
+        return {"pid": os.getpid()}
+
+    def ask(
+        self,
+        question: str,
+        use_cache: bool = True,
+        path: Optional[str] = None,
+        langs: Optional[list[str]] = None,
+    ) -> Optional[str]:
+        from menderbot.ingest import (  # Lazy import
+            ask_cache_settings,
+            ask_index,
+            index_exists,
+        )
+
+        if not index_exists():
+            return None
+        cache = self._answers if use_cache else None
+        threshold = ask_cache_settings()["threshold"]
+        langs = langs or []
+        return ask_index(
+            question,
+            cache,
+            self._get_query_engine(path, langs),
+            threshold,
+            path=path,
+            langs=langs,
+        )
+
+    def review(self, diff: str) -> str:
+        from menderbot.prompts import code_review_prompt  # Lazy import
+
+        return self._cached_response(code_review_prompt(diff))
+
+    def diff(self, diff: str) -> str:
+        from menderbot.prompts import change_list_prompt  # Lazy import
+
+        return self._cached_response(change_list_prompt(diff))
+
+    def doc(self, files: list[str]) -> list[dict]:
+        from menderbot.__main__ import document_paths  # Lazy import
+
+        with self._edit_lock:
+            results = list(document_paths(files))
+        return [
+            {
+                "path": path,
+                "mtime": mtime,
+                "insertions": [asdict(ins) for ins in insertions],
+                "error": error,
+            }
+            for path, mtime, insertions, error in results
+        ]
+
+    def type(self, paths: list[str], **options) -> Optional[dict]:
+        from menderbot import __main__ as cli_main  # Lazy import
+
+        # The lock also keeps the console to one client.
+        with self._edit_lock, _output_to_client(cli_main.console):
+            results = cli_main.infer_type_hints(paths, **options)
+        return None if results is None else _insertions_to_json(results)
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    server: "MenderbotServer"
+
+    def handle(self):
+        # Notifications may come from the request's worker threads.
+        lock = threading.Lock()
+
+        def send(message: dict) -> None:
+            with lock:
+                self.wfile.write(json.dumps(message).encode("utf-8") + b"\n")
+                self.wfile.flush()
+
+        for line in self.rfile:
+            if not line.strip():
+                continue
+            send(self.server.dispatch(json.loads(line), send))
+
+
+class MenderbotServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, service: Optional[MenderbotService] = None):
+        self.service = service or MenderbotService()
+        if os.path.exists(path):
+            try:
+                call("ping", {}, path)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Stale from a server that did not shut down cleanly.
+                os.unlink(path)
+            except (OSError, RemoteError) as e:
+                raise ServerRunningError(f"{path} is in use: {e}") from e
+            else:
+                raise ServerRunningError(f"A server is already running on {path}")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        super().__init__(path, _Handler)
+        os.chmod(path, 0o600)
+        self.path = path
+
+    def dispatch(
+        self, request: dict, notify: Optional[Callable[[dict], None]] = None
+    ) -> dict:
+        response: dict[str, Any] = {"jsonrpc": "2.0", "id": request.get("id")}
+        method: Optional[Callable] = None
+        name = request.get("method", "")
+        if not name.startswith("_"):
+            method = getattr(self.service, name, None)
+        if method is None:
+            response["error"] = {
+                "code": METHOD_NOT_FOUND,
+                "message": f"Unknown method '{name}'",
+            }
+            return response
+        _request.notify = notify
+        try:
+            response["result"] = method(**request.get("params", {}))
+        # pylint: disable-next=broad-exception-caught
+        except Exception as e:
+            response["error"] = {
+                "code": SERVER_ERROR,
+                "message": f"{type(e).__name__}: {e}",
+            }
+        finally:
+            _request.notify = None
+        return response
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+def run_server(path: Optional[str] = None) -> None:
+    with MenderbotServer(path or socket_path()) as server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,361 @@
+"""
+The ingest index split into shards that are stored apart, so an update only
+rewrites the shards holding changed files. Queries go to every shard, or
+with a path filter and directory shards only to the shard of that path.
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+from typing import Iterable, Optional
+
+from llama_index.core import (
+    Settings,
+    StorageContext,
+    VectorStoreIndex,
+    load_index_from_storage,
+)
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.indices.base import BaseIndex
+from llama_index.core.schema import Document, NodeWithScore, QueryBundle
+from llama_index.core.vector_stores.types import MetadataFilters
+
+from menderbot.sqlite_store import SqliteKVStore
+
+SHARD_BY_DIRECTORY = "directory"
+SHARD_BY_HASH = "hash"
+DEFAULT_SHARD_COUNT = 16
+# Shard of files at the top level of the repo, for SHARD_BY_DIRECTORY.
+ROOT_SHARD = "_root"
+# Records how paths were assigned, for noticing a config change.
+LAYOUT_FILE = ".layout.json"
+# Where shards keep their documents, vectors always stay in JSON.
+STORE_JSON = "json"
+STORE_SQLITE = "sqlite"
+SQLITE_FILE = ".index.sqlite"
+# Shard directories a sqlite index still has to move in place, committed
+# with the documents so an interrupted persist can be finished.
+PENDING_COLLECTION = "persist"
+PENDING_KEY = "pending"
+
+
+def shard_of(
+    path: str, shard_by: str = SHARD_BY_DIRECTORY, shard_count=DEFAULT_SHARD_COUNT
+) -> str:
+    """Name of the shard holding `path`, safe to use as a directory name."""
+    if shard_by == SHARD_BY_HASH:
+        digest = hashlib.sha1(path.encode("utf-8")).digest()
+        return f"hash-{int.from_bytes(digest[:4], 'big') % shard_count:03d}"
+    if shard_by != SHARD_BY_DIRECTORY:
+        raise ValueError(f"Unknown shard_by '{shard_by}'")
+    top, sep, _ = path.replace(os.sep, "/").partition("/")
+    if not sep:
+        return ROOT_SHARD
+    # Dot-prefixed names are kept for half-written shards.
+    return re.sub(r"^\.|[^\w.-]", "_", top)
+
+
+def update_index(
+    index,
+    documents: list[Document],
+    paths: Iterable[str],
+    existing_ids: Optional[Iterable[str]] = None,
+) -> bool:
+    """
+    Make `index` hold `documents` in place of what it had for `paths`. Paths
+    without a document are dropped, unchanged documents are recognized by
+    their hash and not embedded again. True if anything changed.
+
+    Without `existing_ids`, the ids now held for `paths`, every document in
+    the index is looked at to find them.
+    """
+    paths = set(paths)
+    if existing_ids is None:
+        # Also catches documents from before ids were derived from paths.
+        existing_ids = [
+            ref_doc_id
+            for ref_doc_id, info in index.ref_doc_info.items()
+            if info.metadata.get("file_name") in paths
+        ]
+    stale_ids = set(existing_ids) - {document.doc_id for document in documents}
+    for ref_doc_id in sorted(stale_ids):
+        index.delete_ref_doc(ref_doc_id, delete_from_docstore=True)
+    return any(index.refresh_ref_docs(documents)) or bool(stale_ids)
+
+
+class ShardedIndex:
+    def __init__(
+        self,
+        persist_dir: str,
+        shard_by: str = SHARD_BY_DIRECTORY,
+        shard_count: int = DEFAULT_SHARD_COUNT,
+        embed_model=None,
+        store: str = STORE_JSON,
+        metadata_version: int = 0,
+    ):
+        self.persist_dir = persist_dir
+        self.shard_by = shard_by
+        self.shard_count = shard_count
+        self.embed_model = embed_model
+        self.store = store
+        # Of the caller's document metadata, a new one calls for a rebuild.
+        self.metadata_version = metadata_version
+        self.shards: dict[str, BaseIndex] = {}
+        self._dirty: set[str] = set()
+        self._catalog: Optional[SqliteKVStore] = None
+
+    @staticmethod
+    def exists(persist_dir: str) -> bool:
+        return os.path.isdir(persist_dir) and any(
+            not name.startswith(".") for name in os.listdir(persist_dir)
+        )
+
+    @property
+    def layout(self) -> dict:
+        return {
+            "shard_by": self.shard_by,
+            "shard_count": self.shard_count,
+            "store": self.store,
+            "metadata_version": self.metadata_version,
+        }
+
+    @property
+    def catalog(self) -> Optional[SqliteKVStore]:
+        """The SQLite store of a sqlite index, None for JSON."""
+        if self.store != STORE_SQLITE:
+            return None
+        if self._catalog is None:
+            os.makedirs(self.persist_dir, exist_ok=True)
+            self._catalog = SqliteKVStore(os.path.join(self.persist_dir, SQLITE_FILE))
+        return self._catalog
+
+    def _storage_context(self, name: str, shard_dir: Optional[str] = None):
+        catalog = self.catalog
+        if catalog is None:
+            return StorageContext.from_defaults(persist_dir=shard_dir)
+        return StorageContext.from_defaults(
+            docstore=catalog.docstore(name),
+            index_store=catalog.index_store(name),
+            persist_dir=shard_dir,
+        )
+
+    def load(self) -> "ShardedIndex":
+        """Read all shards, taking the layout they were written with."""
+        layout_path = os.path.join(self.persist_dir, LAYOUT_FILE)
+        if os.path.exists(layout_path):
+            with open(layout_path, "r", encoding="utf-8") as layout_file:
+                layout = json.load(layout_file)
+            self.shard_by = layout["shard_by"]
+            self.shard_count = layout["shard_count"]
+            self.store = layout.get("store", STORE_JSON)
+            self.metadata_version = layout.get("metadata_version", 0)
+        if not os.path.isdir(self.persist_dir):
+            return self
+        # Dot-prefixed are half-written by an interrupted persist.
+        names = {
+            name for name in os.listdir(self.persist_dir) if not name.startswith(".")
+        }
+        pending = self._pending()
+        # Read-only here, the next persist finishes the moves.
+        names = (names | set(pending["swap"])) - set(pending["remove"])
+        for name in sorted(names):
+            shard_dir = os.path.join(self.persist_dir, name)
+            temp_dir = self._temp_dir(name)
+            if name in pending["swap"] and os.path.exists(temp_dir):
+                shard_dir = temp_dir
+            storage_context = self._storage_context(name, shard_dir)
+            self.shards[name] = load_index_from_storage(
+                storage_context, embed_model=self.embed_model
+            )
+        return self
+
+    def _temp_dir(self, name: str) -> str:
+        return os.path.join(self.persist_dir, f".{name}.tmp")
+
+    def _pending(self) -> dict:
+        pending = None
+        if self.catalog is not None:
+            pending = self.catalog.get(PENDING_KEY, PENDING_COLLECTION)
+        return pending or {"swap": [], "remove": []}
+
+    def _move_in_place(self, swap: Iterable[str], remove: Iterable[str]) -> None:
+        """Swap in the written shard directories, delete those of dropped shards."""
+        for name in remove:
+            shutil.rmtree(os.path.join(self.persist_dir, name), ignore_errors=True)
+        for name in swap:
+            shard_dir = os.path.join(self.persist_dir, name)
+            temp_dir = self._temp_dir(name)
+            old_dir = os.path.join(self.persist_dir, f".{name}.old")
+            if not os.path.exists(temp_dir):
+                # Moved before an interruption.
+                continue
+            shutil.rmtree(old_dir, ignore_errors=True)
+            if os.path.exists(shard_dir):
+                os.rename(shard_dir, old_dir)
+            os.rename(temp_dir, shard_dir)
+            shutil.rmtree(old_dir, ignore_errors=True)
+
+    def shard_of(self, path: str) -> str:
+        return shard_of(path, self.shard_by, self.shard_count)
+
+    def shards_under(self, path: Optional[str]) -> list[str]:
+        """Names of the shards that can hold `path`, a file or directory."""
+        if not path or self.shard_by != SHARD_BY_DIRECTORY:
+            return sorted(self.shards)
+        path = os.path.normpath(path).replace(os.sep, "/")
+        # Top-level files are in the root shard, directories in their own.
+        names = {self.shard_of(path), self.shard_of(f"{path}/_")}
+        return sorted(names & set(self.shards))
+
+    def indexed_paths(self) -> set[str]:
+        if self.catalog is not None:
+            return self.catalog.paths()
+        return {
+            info.metadata["file_name"]
+            for shard in self.shards.values()
+            for info in shard.ref_doc_info.values()
+            if "file_name" in info.metadata
+        }
+
+    def unchanged(self, path: str, blob_sha: str) -> bool:
+        """Whether `path` is indexed from content with this git blob SHA."""
+        return self.catalog is not None and self.catalog.blob_sha(path) == blob_sha
+
+    def update(
+        self,
+        documents: list[Document],
+        paths: Iterable[str],
+        blob_shas: Optional[dict[str, str]] = None,
+    ) -> None:
+        """
+        See `update_index`, touching only the shards of `paths`. A sqlite
+        index records `blob_shas` so `unchanged` can skip files next time.
+        """
+        by_shard: dict[str, tuple[list[Document], set[str]]] = {}
+        for path in paths:
+            by_shard.setdefault(self.shard_of(path), ([], set()))[1].add(path)
+        for document in documents:
+            path = document.metadata["file_name"]
+            by_shard.setdefault(self.shard_of(path), ([], set()))[0].append(document)
+        for name, (shard_documents, shard_paths) in sorted(by_shard.items()):
+            if name not in self.shards:
+                self.shards[name] = VectorStoreIndex(
+                    nodes=[],
+                    storage_context=self._storage_context(name),
+                    embed_model=self.embed_model,
+                )
+            catalog = self.catalog
+            existing_ids = None
+            if catalog is not None:
+                existing_ids = [
+                    doc_id for path in shard_paths for doc_id in catalog.doc_ids(path)
+                ]
+            if update_index(
+                self.shards[name], shard_documents, shard_paths, existing_ids
+            ):
+                self._dirty.add(name)
+            if catalog is not None:
+                for path in shard_paths:
+                    doc_ids = [
+                        document.doc_id
+                        for document in shard_documents
+                        if document.metadata["file_name"] == path
+                    ]
+                    sha = (blob_shas or {}).get(path)
+                    catalog.record_documents(name, path, sha, doc_ids)
+
+    def persist(self) -> list[str]:
+        """
+        Write the shards changed since loading, returns their names. Each
+        shard is written beside its directory and swapped in, so it is never
+        half-written. A sqlite index commits its documents before the swaps,
+        together with the list of swaps, and an interrupted persist is
+        finished by the next one.
+        """
+        written = sorted(self._dirty)
+        os.makedirs(self.persist_dir, exist_ok=True)
+        catalog = self.catalog
+        if catalog is not None:
+            pending = self._pending()
+            self._move_in_place(pending["swap"], pending["remove"])
+        swap, remove = [], []
+        for name in written:
+            if not self.shards[name].ref_doc_info:
+                del self.shards[name]
+                remove.append(name)
+                if catalog is not None:
+                    catalog.drop_shard(name)
+                continue
+            temp_dir = self._temp_dir(name)
+            shutil.rmtree(temp_dir, ignore_errors=True)
+            self.shards[name].storage_context.persist(persist_dir=temp_dir)
+            swap.append(name)
+        if catalog is not None:
+            # Documents and index structs of all written shards at once.
+            catalog.put(
+                PENDING_KEY, {"swap": swap, "remove": remove}, PENDING_COLLECTION
+            )
+            catalog.commit()
+        self._move_in_place(swap, remove)
+        if catalog is not None:
+            catalog.delete(PENDING_KEY, PENDING_COLLECTION)
+            catalog.commit()
+        layout_path = os.path.join(self.persist_dir, LAYOUT_FILE)
+        if written or not os.path.exists(layout_path):
+            # Written last, so its mtime tells readers the index changed.
+            with open(layout_path, "w", encoding="utf-8") as layout_file:
+                json.dump(self.layout, layout_file)
+        self._dirty.clear()
+        return written
+
+    def as_retriever(
+        self,
+        similarity_top_k: int = 5,
+        filters: Optional[MetadataFilters] = None,
+        path: Optional[str] = None,
+    ) -> "ShardedRetriever":
+        return ShardedRetriever(self, similarity_top_k, filters, path)
+
+
+class ShardedRetriever(BaseRetriever):
+    """
+    The best `similarity_top_k` nodes across all shards that can hold
+    `path`. Nodes not matching `filters` are dropped before scoring.
+    """
+
+    def __init__(
+        self,
+        index: ShardedIndex,
+        similarity_top_k: int = 5,
+        filters: Optional[MetadataFilters] = None,
+        path: Optional[str] = None,
+    ):
+        super().__init__()
+        self.index = index
+        self.similarity_top_k = similarity_top_k
+        self.filters = filters
+        self.path = path
+
+    def _retrieve(self, query_bundle: QueryBundle) -> list[NodeWithScore]:
+        shards = [
+            self.index.shards[name] for name in self.index.shards_under(self.path)
+        ]
+        if not shards:
+            return []
+        if query_bundle.embedding is None and query_bundle.embedding_strs:
+            # Embed the query once rather than once per shard.
+            embed_model = self.index.embed_model or Settings.embed_model
+            query_bundle.embedding = embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+        nodes = [
+            node
+            for shard in shards
+            for node in shard.as_retriever(
+                similarity_top_k=self.similarity_top_k, filters=self.filters
+            ).retrieve(query_bundle)
+        ]
+        nodes.sort(key=lambda node: node.score or 0.0, reverse=True)
+        return nodes[: self.similarity_top_k]
@@ -1,12 +1,37 @@
-import itertools
+import codecs
 import os
+import stat
 import tempfile
+from contextlib import suppress
 from dataclasses import dataclass
 from pathlib import Path
-from typing import Iterable
+from typing import Iterable, Iterator, Optional, Union
 
 import rich_click as click
-from charset_normalizer import from_path
+from charset_normalizer import from_bytes
+
+# Encodings found by charset detection, by path and mtime, so files read
+# again in the same process skip it.
+_detected_encodings: dict[tuple[str, int], str] = {}
+
+SCRATCH_DIR_ENV = "MENDERBOT_SCRATCH_DIR"
+DEFAULT_SCRATCH_DIR = ".menderbot/scratch"
+# Set to 1 to fsync rewritten files, so they survive a crash as well.
+FSYNC_ENV = "MENDERBOT_FSYNC"
+WRITE_BUFFER_SIZE = 1 << 16
+
+
+def scratch_dir() -> str:
+    """Where shadow files go, set MENDERBOT_SCRATCH_DIR to use a tmpfs instead."""
+    return os.environ.get(SCRATCH_DIR_ENV) or DEFAULT_SCRATCH_DIR
+
+
+def shadow_path_for(path: str) -> str:
+    """Mirrors the layout of the sources, so shadows of same-named files differ."""
+    relative = os.path.relpath(os.path.abspath(path))
+    if relative.startswith(os.pardir):
+        relative = os.path.splitdrive(os.path.abspath(path))[1].lstrip(os.sep)
+    return os.path.join(scratch_dir(), relative)
 
 
 @dataclass
@@ -18,77 +43,253 @@ class Insertion:
     inline: bool = False  # Insert into existing line instead of adding new line
 
 
-def partition(pred, iterable):
-    "Use a predicate to partition entries into false entries and true entries"
-    # partition(is_odd, range(10)) --> 0 2 4 6 8   and  1 3 5 7 9
-    t1, t2 = itertools.tee(iterable)
-    return itertools.filterfalse(pred, t1), filter(pred, t2)
+@dataclass
+class Replacement:
+    """
+    Replace the text from (`line_number`, `col`) up to (`end_line`,
+    `end_col`), end exclusive. Columns are 1-indexed like `Insertion.col`.
+    """
+
+    text: str
+    line_number: int
+    col: int
+    end_line: int
+    end_col: int
+    label: str
+
 
+Edit = Union[Insertion, Replacement]
 
-def insert_in_lines(lines: Iterable[str], insertions: Iterable[Insertion]):
-    # TODO: verbose flag
-    # print("INSERTION", insertions)
+
+def _edit_start(edit: Edit) -> tuple[int, int]:
+    # Full-line insertions go before the first column of their line.
+    if isinstance(edit, Insertion) and not edit.inline:
+        return (edit.line_number, 0)
+    return (edit.line_number, edit.col)
+
+
+def sort_edits(edits: Iterable[Edit]) -> list[Edit]:
+    """
+    Order edits by position, keeping the given order for equal positions,
+    and raise ValueError if a replacement overlaps another edit.
+    """
+    ordered = sorted(edits, key=_edit_start)
+    covered_until = (0, 0)
+    covered_by = None
+    for edit in ordered:
+        start = _edit_start(edit)
+        if start < covered_until:
+            raise ValueError(
+                f"Edit '{edit.label}' at {start[0]}:{start[1]} overlaps"
+                f" replacement '{covered_by}'"
+            )
+        if isinstance(edit, Replacement):
+            end = (edit.end_line, edit.end_col)
+            if end < start:
+                raise ValueError(f"Replacement '{edit.label}' ends before it starts")
+            covered_until, covered_by = end, edit.label
+    return ordered
+
+
+def apply_edits(lines: Iterable[str], edits: Iterable[Edit]) -> Iterator[str]:
+    """
+    Apply insertions and replacements to `lines` in one pass, yielding the
+    output a line (or a full-line insertion) at a time. Edits may come in any
+    order, positions refer to the original lines.
+    """
     lines = iter(lines)
-    last_line = 1
-    insertion_groups = itertools.groupby(insertions, key=lambda ins: ins.line_number)
-    for line_number, insertion_group in insertion_groups:
-        for line in itertools.islice(lines, line_number - last_line):
+    line_number = 0  # Of the line being edited, 0 before the first.
+    current: Optional[str] = None  # Its text, written up to `pos`.
+    pos = 0
+    pieces: list[str] = []
+
+    def finish_line():
+        nonlocal current
+        if current is not None:
+            pieces.append(current[pos:])
+            current = None
+        edited = "".join(pieces)
+        pieces.clear()
+        return edited
+
+    def copy_until(target):
+        nonlocal line_number
+        while line_number < target - 1:
+            line_number += 1
+            line = next(lines, None)
+            if line is None:
+                line_number = target - 1
+                break
             yield line
-            last_line += 1
-        full_insertions, inline_insertions = partition(
-            lambda ins: ins.inline, insertion_group
-        )
-        for insertion in full_insertions:
-            yield insertion.text + "\n"
-
-        line_to_edit = None
-        col_offset = 0
-        for insertion in inline_insertions:
-            if not line_to_edit:
-                line_to_edit = next(lines, "")
-            # insertion.col is 1-indexed, col is zero indexed
-            col = insertion.col + col_offset - 1
-            col_offset += len(insertion.text)
-            line_to_edit = line_to_edit[:col] + insertion.text + line_to_edit[col:]
-        if line_to_edit:
-            yield line_to_edit
-            last_line += 1
+
+    def skip_until(target):
+        nonlocal line_number
+        while line_number < target - 1:
+            line_number += 1
+            next(lines, None)
+
+    for edit in sort_edits(edits):
+        if isinstance(edit, Insertion) and not edit.inline:
+            if line_number < edit.line_number:
+                edited = finish_line()
+                if edited:
+                    yield edited
+                yield from copy_until(edit.line_number)
+            yield edit.text + "\n"
+            continue
+        if current is None or line_number < edit.line_number:
+            edited = finish_line()
+            if edited:
+                yield edited
+            yield from copy_until(edit.line_number)
+            line_number = edit.line_number
+            current, pos = next(lines, ""), 0
+        col = edit.col - 1
+        pieces.append(current[pos:col])
+        pieces.append(edit.text)
+        pos = col
+        if isinstance(edit, Replacement):
+            if edit.end_line > line_number:
+                skip_until(edit.end_line)
+                line_number = edit.end_line
+                current = next(lines, "")
+            pos = edit.end_col - 1
+    edited = finish_line()
+    if edited:
+        yield edited
     yield from lines
 
 
+def insert_in_lines(lines: Iterable[str], insertions: Iterable[Insertion]):
+    return apply_edits(lines, insertions)
+
+
 class SourceFile:
+    # Read on first render, every shadow is built from these.
+    _lines: Optional[list[str]] = None
+
     def __init__(self, path: str):
         self.path = path
-        self.encoding = None
+        self.encoding: Optional[str] = None
         self._initial_modified_time = os.path.getmtime(path)
 
-    def load_source_as_utf8(self):
-        loaded = from_path(self.path)
-        best_guess = loaded.best()
-        self.encoding = best_guess.encoding
-        return best_guess.output(encoding="utf_8")
+    def load_source_as_utf8(self) -> bytes:
+        """
+        The file content as UTF-8 bytes. Nearly all sources already are, so
+        charset detection only runs when a strict UTF-8 decode fails.
+        """
+        with open(self.path, "rb") as filehandle:
+            raw = filehandle.read()
+            mtime = os.fstat(filehandle.fileno()).st_mtime_ns
+        if raw.startswith(codecs.BOM_UTF8):
+            # Reading and writing with utf_8_sig keeps the BOM in place.
+            encoding, raw = "utf_8_sig", raw[len(codecs.BOM_UTF8) :]
+        else:
+            encoding = "utf_8"
+        try:
+            raw.decode("utf_8")
+            self.encoding = encoding
+            return raw
+        except UnicodeDecodeError:
+            pass
+        key = (os.path.abspath(self.path), mtime)
+        if key not in _detected_encodings:
+            best_guess = from_bytes(raw).best()
+            if best_guess is None:
+                raise click.FileError(self.path, "Could not detect the encoding.")
+            _detected_encodings[key] = best_guess.encoding
+        encoding = _detected_encodings[key]
+        self.encoding = encoding
+        return raw.decode(encoding).encode("utf_8")
 
     def is_unicode(self):
         return self.encoding.startswith("utf")
 
-    def update_file(self, insertions: Iterable[Insertion], suffix: str) -> None:
+    def update_file(
+        self, insertions: Iterable[Edit], suffix: str, fsync: Optional[bool] = None
+    ) -> None:
         path_obj = Path(self.path)
         with path_obj.open("r", encoding=self.encoding) as filehandle:
             if self.modified_after_loaded():
                 raise click.FileError(
                     self.path, "File was externally modified, try again."
                 )
-            new_lines = list(insert_in_lines(lines=filehandle, insertions=insertions))
             out_file = path_obj.with_suffix(f"{path_obj.suffix}{suffix}")
-            self._write_result(new_lines, out_file)
-
-    def _write_result(self, lines: list, output_file: Path) -> None:
-        with tempfile.TemporaryDirectory() as tempdir:
-            my_tempfile: Path = Path(tempdir) / "output.txt"
-            with my_tempfile.open("w") as filehandle:
-                for line in lines:
-                    filehandle.write(line)
-            my_tempfile.replace(output_file)
+            # Edited lines go straight to the output as they are produced.
+            self._write_result(apply_edits(filehandle, insertions), out_file, fsync)
+
+    @property
+    def initial_modified_time(self) -> float:
+        return self._initial_modified_time
+
+    @property
+    def shadow_path(self) -> str:
+        return shadow_path_for(self.path)
+
+    def _source_lines(self) -> list[str]:
+        if self._lines is None:
+            with open(self.path, "r", encoding=self.encoding) as filehandle:
+                if self.modified_after_loaded():
+                    raise click.FileError(
+                        self.path, "File was externally modified, try again."
+                    )
+                self._lines = filehandle.readlines()
+        return self._lines
+
+    def render(self, insertions: Iterable[Edit]) -> str:
+        return "".join(apply_edits(self._source_lines(), insertions))
+
+    def write_shadow(self, insertions: Iterable[Edit]) -> str:
+        """
+        Write the file with `insertions` to its shadow in the scratch directory
+        and return the shadow's path. Only the type checker reads shadows, so it
+        is a plain overwrite.
+        """
+        shadow_path = self.shadow_path
+        os.makedirs(os.path.dirname(shadow_path), exist_ok=True)
+        with open(shadow_path, "w", encoding=self.encoding) as filehandle:
+            filehandle.writelines(apply_edits(self._source_lines(), insertions))
+        return shadow_path
+
+    def remove_shadow(self) -> None:
+        with suppress(FileNotFoundError):
+            os.unlink(self.shadow_path)
+
+    def _write_result(
+        self, lines: Iterable[str], output_file: Path, fsync: Optional[bool] = None
+    ) -> None:
+        """
+        Write to a temporary file in the same directory, then rename it over
+        `output_file`, so it holds either the old or the new content.
+        """
+        if fsync is None:
+            fsync = os.environ.get(FSYNC_ENV) == "1"
+        fd, temp_path = tempfile.mkstemp(
+            dir=output_file.parent, prefix=f".{output_file.name}.", suffix=".tmp"
+        )
+        try:
+            with open(
+                fd, "w", encoding=self.encoding, buffering=WRITE_BUFFER_SIZE
+            ) as filehandle:
+                filehandle.writelines(lines)
+                if fsync:
+                    filehandle.flush()
+                    os.fsync(filehandle.fileno())
+            # mkstemp makes it private, keep the mode of the file it replaces.
+            mode_from = output_file if output_file.exists() else Path(self.path)
+            os.chmod(temp_path, stat.S_IMODE(mode_from.stat().st_mode))
+            os.replace(temp_path, output_file)
+        except BaseException:
+            with suppress(FileNotFoundError):
+                os.unlink(temp_path)
+            raise
+        if fsync and hasattr(os, "O_DIRECTORY"):
+            # Make the rename itself durable.
+            dir_fd = os.open(output_file.parent, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
 
     def modified_after_loaded(self) -> bool:
         return os.path.getmtime(self.path) > self._initial_modified_time
@@ -0,0 +1,161 @@
+"""
+SQLite storage for the ingest index's docstore and index store, chosen with
+`ingest: store: sqlite` in the config. Rows are read as they are needed
+rather than parsing whole JSON files, and a `documents` table finds a file's
+documents by path or blob SHA through an index.
+"""
+
+import json
+import sqlite3
+import threading
+from typing import Iterable, Optional
+
+from llama_index.core.storage.docstore.keyval_docstore import KVDocumentStore
+from llama_index.core.storage.index_store.keyval_index_store import KVIndexStore
+from llama_index.core.storage.kvstore.types import DEFAULT_COLLECTION, BaseKVStore
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS kv (
+    collection TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (collection, key)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    shard TEXT NOT NULL,
+    path TEXT NOT NULL,
+    blob_sha TEXT
+);
+CREATE INDEX IF NOT EXISTS documents_path ON documents (path);
+CREATE INDEX IF NOT EXISTS documents_blob_sha ON documents (blob_sha);
+"""
+
+
+class SqliteKVStore(BaseKVStore):
+    """
+    A llama_index key-value store in one SQLite file, plus the `documents`
+    table mapping repo paths to document ids. Writes become visible to other
+    connections on `commit`, so an update is applied whole or not at all.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        # Shared with the server's request threads, hence the lock.
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+
+    def put(self, key: str, val: dict, collection: str = DEFAULT_COLLECTION) -> None:
+        self.put_all([(key, val)], collection)
+
+    async def aput(
+        self, key: str, val: dict, collection: str = DEFAULT_COLLECTION
+    ) -> None:
+        self.put(key, val, collection)
+
+    def put_all(
+        self,
+        kv_pairs: list[tuple[str, dict]],
+        collection: str = DEFAULT_COLLECTION,
+        batch_size: int = 1,
+    ) -> None:
+        del batch_size  # One executemany whatever the batch size.
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO kv (collection, key, value) VALUES (?, ?, ?)",
+                [(collection, key, json.dumps(val)) for key, val in kv_pairs],
+            )
+
+    def get(self, key: str, collection: str = DEFAULT_COLLECTION) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM kv WHERE collection = ? AND key = ?",
+                (collection, key),
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def aget(
+        self, key: str, collection: str = DEFAULT_COLLECTION
+    ) -> Optional[dict]:
+        return self.get(key, collection)
+
+    def get_all(self, collection: str = DEFAULT_COLLECTION) -> dict[str, dict]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT key, value FROM kv WHERE collection = ?", (collection,)
+            ).fetchall()
+        return {key: json.loads(value) for key, value in rows}
+
+    async def aget_all(self, collection: str = DEFAULT_COLLECTION) -> dict[str, dict]:
+        return self.get_all(collection)
+
+    def delete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "DELETE FROM kv WHERE collection = ? AND key = ?", (collection, key)
+            )
+        return cursor.rowcount > 0
+
+    async def adelete(self, key: str, collection: str = DEFAULT_COLLECTION) -> bool:
+        return self.delete(key, collection)
+
+    def docstore(self, shard: str) -> KVDocumentStore:
+        return KVDocumentStore(self, namespace=f"{shard}/docstore")
+
+    def index_store(self, shard: str) -> KVIndexStore:
+        return KVIndexStore(self, namespace=f"{shard}/index_store")
+
+    def record_documents(
+        self, shard: str, path: str, blob_sha: Optional[str], doc_ids: Iterable[str]
+    ) -> None:
+        """Make `doc_ids` the documents of `path`, none to forget it."""
+        with self._lock:
+            self._conn.execute("DELETE FROM documents WHERE path = ?", (path,))
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO documents (doc_id, shard, path, blob_sha)"
+                " VALUES (?, ?, ?, ?)",
+                [(doc_id, shard, path, blob_sha) for doc_id in doc_ids],
+            )
+
+    def doc_ids(self, path: str) -> list[str]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT doc_id FROM documents WHERE path = ?", (path,)
+            ).fetchall()
+        return [doc_id for (doc_id,) in rows]
+
+    def blob_sha(self, path: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT blob_sha FROM documents WHERE path = ? LIMIT 1", (path,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def paths(self) -> set[str]:
+        with self._lock:
+            rows = self._conn.execute("SELECT DISTINCT path FROM documents").fetchall()
+        return {path for (path,) in rows}
+
+    def drop_shard(self, shard: str) -> None:
+        prefix = f"{shard}/"
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM kv WHERE substr(collection, 1, ?) = ?",
+                (len(prefix), prefix),
+            )
+            self._conn.execute("DELETE FROM documents WHERE shard = ?", (shard,))
+
+    def commit(self) -> None:
+        with self._lock:
+            self._conn.commit()
+
+    def rollback(self) -> None:
+        with self._lock:
+            self._conn.rollback()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
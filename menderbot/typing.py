@@ -1,12 +1,17 @@
 import logging
 import os
 import re
+from typing import Iterable, Optional
 
 from menderbot import python_cst
 from menderbot.source_file import Insertion, SourceFile
 
 logger = logging.getLogger("typing")
 
+CHECK_ERROR_RE = re.compile(
+    r"^(?P<path>[^:\n]+):(?P<line>\d+):(?:\d+:)? error: (?P<message>.*)$", re.MULTILINE
+)
+
 
 def process_untyped_functions(source_file: SourceFile):
     path = source_file.path
@@ -109,6 +114,83 @@ def what_needs_typing(fn_ast: python_cst.AstNode) -> list[str]:
     return needs_typing
 
 
+def parse_check_errors(check_output: str, path: str) -> list[tuple[int, str]]:
+    """Line number and full text of each error the checker reported in `path`."""
+    abs_path = os.path.abspath(path)
+    return [
+        (int(match["line"]), match.group(0))
+        for match in CHECK_ERROR_RE.finditer(check_output)
+        if os.path.abspath(match["path"]) == abs_path
+    ]
+
+
+def source_line(shadow_line: int, insertions: Iterable[Insertion]) -> Optional[int]:
+    """Map a line of the shadow file back to the source, None if it was inserted."""
+    offset = 0
+    for insertion in sorted(
+        (ins for ins in insertions if not ins.inline), key=lambda ins: ins.line_number
+    ):
+        start = insertion.line_number + offset
+        if shadow_line < start:
+            break
+        inserted_lines = insertion.text.count("\n") + 1
+        if shadow_line < start + inserted_lines:
+            return None
+        offset += inserted_lines
+    return shadow_line - offset
+
+
+def attribute_errors(
+    check_output: str,
+    path: str,
+    function_asts: list[python_cst.AstNode],
+    insertions: list[Insertion],
+) -> tuple[dict[str, list[str]], list[str]]:
+    """
+    Group checker errors by the function they belong to, by line range or
+    else by a quoted function name in the message. Returns the groups keyed
+    by qualified name, and the errors that could not be placed.
+    """
+    by_function: dict[str, list[str]] = {}
+    unattributed = []
+    for line, error in parse_check_errors(check_output, path):
+        owner = None
+        line_in_source = source_line(line, insertions)
+        for fn_ast in function_asts:
+            if (
+                line_in_source is not None
+                and fn_ast.src_range.start.line
+                <= line_in_source
+                <= fn_ast.src_range.end.line
+            ):
+                owner = fn_ast
+                break
+        if owner is None:
+            for fn_ast in function_asts:
+                short_name = fn_ast.props["name"].rsplit(".", 1)[-1]
+                if f'"{short_name}"' in error:
+                    owner = fn_ast
+                    break
+        if owner is None:
+            unattributed.append(error)
+        else:
+            by_function.setdefault(owner.props["name"], []).append(error)
+    return (by_function, unattributed)
+
+
+def merge_insertions(insertions: Iterable[Insertion]) -> list[Insertion]:
+    """Combine insertions for several functions: in order, imports only once."""
+    merged = []
+    seen_imports = set()
+    for insertion in insertions:
+        if insertion.label == "type_import":
+            if insertion.text in seen_imports:
+                continue
+            seen_imports.add(insertion.text)
+        merged.append(insertion)
+    return sorted(merged, key=lambda ins: (ins.line_number, ins.col))
+
+
 # def get_function_param_nodes(
 #     node: PythonParser.FuncdefContext,
 # ) -> Generator[PythonParser.Def_parameterContext, None, None]:
@@ -0,0 +1,121 @@
+"""
+Notice changed files in the working tree, through watchdog (inotify and
+friends) when it is installed and by polling mtimes otherwise.
+"""
+
+import os
+import threading
+import time
+from typing import Callable, Iterable, Iterator
+
+# Quiet time after the last change before a batch is handed out, so a save
+# touching several files, or a checkout, becomes one update.
+WATCH_DEBOUNCE_SECONDS = 1.0
+WATCH_POLL_SECONDS = 1.0
+WATCHED_EVENTS = {"created", "modified", "deleted", "moved"}
+
+
+class ChangeCollector:
+    """Changed paths gathered from any thread, handed out once they settle."""
+
+    def __init__(self, debounce: float = WATCH_DEBOUNCE_SECONDS):
+        self.debounce = debounce
+        self._paths: set[str] = set()
+        self._last_change = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, paths: Iterable[str]) -> None:
+        paths = set(paths)
+        if not paths:
+            return
+        with self._lock:
+            self._paths |= paths
+            self._last_change = time.monotonic()
+
+    def take_settled(self) -> set[str]:
+        """The pending paths if nothing changed for `debounce`, else none."""
+        with self._lock:
+            if not self._paths or (
+                time.monotonic() - self._last_change < self.debounce
+            ):
+                return set()
+            paths, self._paths = self._paths, set()
+            return paths
+
+
+def snapshot(paths: Iterable[str]) -> dict[str, tuple[int, int]]:
+    """(mtime_ns, size) of each path that exists."""
+    stats = {}
+    for path in paths:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        stats[path] = (stat.st_mtime_ns, stat.st_size)
+    return stats
+
+
+def changed_paths(before: dict, after: dict) -> set[str]:
+    return {
+        path
+        for path in before.keys() | after.keys()
+        if before.get(path) != after.get(path)
+    }
+
+
+def start_observer(root: str, collector: ChangeCollector):
+    """A running watchdog observer feeding `collector`, None without watchdog."""
+    try:
+        from watchdog.events import FileSystemEventHandler  # type: ignore
+        from watchdog.observers import Observer  # type: ignore
+    except ImportError:
+        return None
+
+    class Handler(FileSystemEventHandler):
+        def on_any_event(self, event):
+            if event.is_directory or event.event_type not in WATCHED_EVENTS:
+                return
+            paths = [event.src_path, getattr(event, "dest_path", "")]
+            collector.add(os.path.relpath(path, root) for path in paths if path)
+
+    observer = Observer()
+    observer.schedule(Handler(), root, recursive=True)
+    observer.start()
+    return observer
+
+
+def watch_changes(
+    list_paths: Callable[[], Iterable[str]],
+    root: str = ".",
+    debounce: float = WATCH_DEBOUNCE_SECONDS,
+    poll: float = WATCH_POLL_SECONDS,
+    use_watchdog: bool = True,
+) -> Iterator[set[str]]:
+    """
+    Yields sets of changed paths, relative to `root`, among those
+    `list_paths` returns. It is called again on every batch, so new files
+    are picked up and files it drops are reported once as changed. Polls
+    when watchdog is not installed or `use_watchdog` is off.
+    """
+    collector = ChangeCollector(debounce)
+    observer = start_observer(root, collector) if use_watchdog else None
+    known = set(list_paths())
+    stats = snapshot(known) if observer is None else {}
+    try:
+        while True:
+            time.sleep(poll if observer is None else debounce / 4)
+            if observer is None:
+                latest = snapshot(list_paths())
+                collector.add(changed_paths(stats, latest))
+                stats = latest
+            batch = collector.take_settled()
+            if observer is not None and batch:
+                listed = set(list_paths())
+                batch &= known | listed
+                known = listed
+            if batch:
+                yield batch
+    finally:
+        if observer is not None:
+            observer.stop()
+            observer.join()
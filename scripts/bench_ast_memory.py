@@ -0,0 +1,117 @@
+"""
+Compare memory held by python_cst.AstNode trees against the previous
+dataclass-based layout (per-instance dict, list and position objects).
+
+Usage: python scripts/bench_ast_memory.py [FILE ...] [--copies N]
+"""
+
+import argparse
+import tracemalloc
+from dataclasses import dataclass
+from typing import Optional
+
+from menderbot import python_cst
+
+DEFAULT_FILES = ["menderbot/antlr_generated/PythonParser.py"]
+
+
+@dataclass
+class LegacySourcePosition:
+    line: int
+    col: int
+
+
+@dataclass
+class LegacySourceRange:
+    start: LegacySourcePosition
+    end: LegacySourcePosition
+
+
+@dataclass
+class LegacyAstNode:
+    kind: str
+    src_range: LegacySourceRange
+    props: dict[str, str]
+    children: list["LegacyAstNode"]
+    text: Optional[str]
+
+    def __init__(self, kind, src_range):
+        self.kind = kind
+        self.src_range = src_range
+        self.props = {}
+        self.children = []
+        self.text = None
+
+
+def _fresh_str(s: str) -> str:
+    # Parsing produces a new string object per node, don't let the
+    # benchmark share the already-interned ones.
+    return "".join(list(s))
+
+
+def _to_legacy(node: python_cst.AstNode) -> LegacyAstNode:
+    start, end = node.src_range
+    legacy = LegacyAstNode(
+        _fresh_str(node.kind),
+        LegacySourceRange(
+            LegacySourcePosition(start.line, start.col),
+            LegacySourcePosition(end.line, end.col),
+        ),
+    )
+    legacy.props.update(node.props)
+    legacy.children.extend(_to_legacy(child) for child in node.children)
+    return legacy
+
+
+def _to_compact(node: python_cst.AstNode) -> python_cst.AstNode:
+    start, end = node.src_range
+    compact = python_cst.AstNode(
+        _fresh_str(node.kind),
+        python_cst.SourceRange(
+            python_cst.SourcePosition(start.line, start.col),
+            python_cst.SourcePosition(end.line, end.col),
+        ),
+    )
+    if node.props:
+        compact.props.update(node.props)
+    for child in node.children:
+        compact.children.append(_to_compact(child))
+    return compact
+
+
+def _count(nodes) -> int:
+    return sum(1 + _count(node.children) for node in nodes)
+
+
+def _measure(build, asts, copies: int) -> tuple[int, list]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    held = [build(ast) for _ in range(copies) for ast in asts]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before, held
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    parser.add_argument("--copies", type=int, default=20)
+    args = parser.parse_args()
+
+    asts = []
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as file:
+            asts += python_cst.collect_function_asts(file.read())
+    node_count = _count(asts) * args.copies
+    legacy_bytes, _ = _measure(_to_legacy, asts, args.copies)
+    compact_bytes, _ = _measure(_to_compact, asts, args.copies)
+    print(f"nodes:   {node_count}")
+    print(f"legacy:  {legacy_bytes:>12,} bytes ({legacy_bytes / node_count:.0f}/node)")
+    print(
+        f"compact: {compact_bytes:>12,} bytes ({compact_bytes / node_count:.0f}/node)"
+    )
+    print(f"saved:   {1 - compact_bytes / legacy_bytes:.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+"""
+Time the metadata passes behind python_cst.collect_function_asts, which is
+what `menderbot type` runs on each file, with and without the
+whitespace-inclusive positions it used to request.
+
+Usage: python scripts/bench_python_cst_parse.py [FILE ...] [--repeat N]
+"""
+
+import argparse
+import time
+
+import libcst as cst
+from libcst.metadata import PositionProvider, WhitespaceInclusivePositionProvider
+
+from menderbot import python_cst
+
+DEFAULT_FILES = ["menderbot/antlr_generated/PythonParser.py"]
+
+
+def _best_of(repeat: int, fn) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _resolve(module: cst.Module, providers) -> None:
+    wrapper = cst.metadata.MetadataWrapper(module, unsafe_skip_copy=True)
+    wrapper.resolve_many(providers)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    for path in args.files:
+        with open(path, "r", encoding="utf-8") as file:
+            code = file.read()
+        module = cst.parse_module(code)
+        both = _best_of(
+            args.repeat,
+            lambda: _resolve(
+                module, [PositionProvider, WhitespaceInclusivePositionProvider]
+            ),
+        )
+        one = _best_of(args.repeat, lambda: _resolve(module, [PositionProvider]))
+        parse = _best_of(args.repeat, lambda: cst.parse_module(code))
+        collect = _best_of(args.repeat, lambda: python_cst.collect_function_asts(code))
+        print(f"{path} ({code.count(chr(10))} lines)")
+        print(f"  parse_module:                   {parse:.2f}s")
+        print(f"  positions, both providers:      {both:.2f}s")
+        print(f"  positions, PositionProvider:    {one:.2f}s")
+        print(f"  collect_function_asts (total):  {collect:.2f}s")
+        print(f"  metadata saved:                 {1 - one / both:.0%}")
+
+
+if __name__ == "__main__":
+    main()
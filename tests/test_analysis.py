@@ -0,0 +1,139 @@
+import pickle
+from unittest.mock import patch
+
+from menderbot import python_cst
+from menderbot.analysis import (
+    FileAnalysis,
+    analyze_file,
+    analyze_files,
+    dependency_order,
+    import_graph,
+    module_name,
+)
+from menderbot.code import PythonLanguageStrategy
+
+
+def write_sources(tmp_path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f"mod{i}.py"
+        path.write_text(
+            f"""import os
+from typing import Any
+
+def foo{i}(a):
+    \"\"\"Doc\"\"\"
+    return a
+
+def bar{i}(b):
+    return b
+""",
+            encoding="utf-8",
+        )
+        paths.append(str(path))
+    return paths
+
+
+def test_analyze_file_summarizes_functions(tmp_path):
+    [path, *_] = write_sources(tmp_path)
+    analysis = analyze_file(path)
+
+    assert analysis.error is None
+    assert [f.name for f in analysis.functions] == ["foo0", "bar0"]
+    assert [f.has_comment for f in analysis.functions] == [True, False]
+    assert analysis.functions[1].doc_line == 9
+    assert analysis.imports == [("", "os"), ("typing", "Any")]
+    restored = pickle.loads(pickle.dumps(analysis))
+    assert restored.functions == analysis.functions
+    assert restored.source_file.encoding == analysis.source_file.encoding
+
+
+def test_analyze_file_with_types_uses_libcst_only(tmp_path):
+    [path, *_] = write_sources(tmp_path)
+    with patch("menderbot.analysis.summarize_functions") as summarize:
+        analysis = analyze_file(path, with_types=True)
+
+    summarize.assert_not_called()
+    assert analysis.error is None
+    assert analysis.functions == []
+    assert analysis.imports == [("", "os"), ("typing", "Any")]
+    assert [fn.props["name"] for fn in analysis.function_asts] == ["foo0", "bar0"]
+    restored = pickle.loads(pickle.dumps(analysis))
+    assert restored.function_asts == analysis.function_asts
+
+
+def test_libcst_imports_match_antlr_imports():
+    code = """import typing, foo.Bar as Baz
+from . import sibling
+from ..pkg.mod import Thing, Other as O
+from os.path import *
+from x import (a,
+    b)
+
+def f():
+    import inner
+"""
+    strategy = PythonLanguageStrategy()
+    antlr_imports = strategy.get_imports(strategy.parse_source_to_tree(code.encode()))
+    _, imports = python_cst.collect_functions_and_imports(code)
+    assert imports == antlr_imports
+
+
+def test_analyze_files_on_process_pool(tmp_path):
+    paths = write_sources(tmp_path)
+    broken = tmp_path / "broken.py"
+    broken.write_text("def oops(:\n", encoding="utf-8")
+    paths.append(str(broken))
+
+    results = {a.path: a for a in analyze_files(paths, max_workers=2)}
+    typed = {a.path: a for a in analyze_files(paths, max_workers=2, with_types=True)}
+
+    assert set(results) == set(typed) == set(paths)
+    assert results[paths[2]].functions[0].name == "foo2"
+    assert typed[paths[2]].function_asts[0].text.startswith("def foo2(a):")
+    assert typed[str(broken)].error
+
+
+def test_analyze_files_skips_unknown_extension(tmp_path):
+    path = tmp_path / "notes.txt"
+    path.write_text("def foo(): pass\n", encoding="utf-8")
+
+    [analysis] = analyze_files([str(path)])
+
+    assert analysis.error is None
+    assert analysis.functions == []
+
+
+def test_import_graph_resolves_local_modules(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "pkg" / "sub").mkdir(parents=True)
+    for path in ["pkg/__init__.py", "pkg/sub/__init__.py"]:
+        (tmp_path / path).write_text("")
+    analyses = [
+        FileAnalysis("pkg/__init__.py", imports=[(".", "util")]),
+        FileAnalysis("pkg/util.py", imports=[("", "os")]),
+        FileAnalysis("pkg/sub/mod.py", imports=[("..util", "helper")]),
+        FileAnalysis("pkg/sub/other.py", imports=[("pkg.sub", "mod")]),
+        FileAnalysis("script.py", imports=[("", "pkg.sub.other as other")]),
+    ]
+
+    assert module_name("pkg/sub/__init__.py") == "pkg.sub"
+    assert import_graph(analyses) == {
+        "pkg/__init__.py": {"pkg/util.py"},
+        "pkg/util.py": set(),
+        "pkg/sub/mod.py": {"pkg/util.py"},
+        "pkg/sub/other.py": {"pkg/sub/mod.py"},
+        "script.py": {"pkg/sub/other.py"},
+    }
+
+
+def test_dependency_order_breaks_cycles():
+    sorter = dependency_order({"a": {"b"}, "b": {"a"}, "c": {"a"}})
+    order = []
+    while sorter.is_active():
+        ready = sorted(sorter.get_ready())
+        order += ready
+        sorter.done(*ready)
+
+    assert order.index("c") > order.index("a")
+    assert sorted(order) == ["a", "b", "c"]
@@ -0,0 +1,94 @@
+import os
+
+import pytest
+
+from menderbot.answer_cache import AnswerCache, normalize_question
+
+
+def test_normalize_question():
+    assert normalize_question("  How does\nAuth work?? ") == "how does auth work"
+
+
+def test_answers_are_per_stamp_and_persist(tmp_path):
+    path = str(tmp_path / "answers.json")
+    cache = AnswerCache(path)
+    cache.put("v1", "How does auth work?", "With tokens.", [0.5, 0.5])
+    assert cache.answer("v1", "how does auth work") == "With tokens."
+    assert cache.answer(None, "how does auth work") is None
+    cache.save()
+
+    reloaded = AnswerCache(path)
+    assert reloaded.answer("v1", "How does auth work?") == "With tokens."
+    assert reloaded.answer("v2", "How does auth work?") is None
+    assert reloaded.embedding("HOW DOES AUTH WORK") == [0.5, 0.5]
+
+    reloaded.put("v2", "What is menderbot?", "A tool.")
+    # Re-ingesting dropped the old answer, its embedding is still good.
+    assert reloaded.answers.keys() == {
+        key for key, entry in reloaded.answers.items() if entry["stamp"] == "v2"
+    }
+    assert reloaded.embedding("How does auth work?") == [0.5, 0.5]
+
+
+def test_oldest_answers_are_evicted(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.json"), max_answers=2)
+    cache.put("v1", "question 0", "answer 0")
+    cache.put("v1", "question 1", "answer 1")
+    # Served, so no longer the least recently used.
+    assert cache.answer("v1", "question 0") == "answer 0"
+    cache.put("v1", "question 2", "answer 2")
+    assert cache.answer("v1", "question 1") is None
+    assert cache.answer("v1", "question 0") == "answer 0"
+
+
+def test_similar_question_within_threshold(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.json"))
+    cache.put("v1", "How does auth work?", "With tokens.", [1.0, 0.0])
+    cache.put("v1", "What is the CLI?", "Click.", [0.0, 1.0])
+
+    question, answer, score = cache.similar("v1", [0.99, 0.1], threshold=0.95)
+    assert (question, answer) == ("How does auth work?", "With tokens.")
+    assert score > 0.99
+    assert cache.similar("v1", [0.7, 0.7], threshold=0.95) is None
+    assert cache.similar("v2", [1.0, 0.0], threshold=0.95) is None
+
+
+def test_answers_are_per_scope(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.json"))
+    cache.put("v1", "How does auth work?", "Everywhere.", [0.5, 0.5])
+    cache.put("v1", "How does auth work?", "In src.", [0.5, 0.5], "path=src")
+    assert cache.answer("v1", "How does auth work?") == "Everywhere."
+    assert cache.answer("v1", "How does auth work?", "path=src") == "In src."
+    assert cache.answer("v1", "How does auth work?", "path=doc") is None
+    similar = cache.similar("v1", [0.5, 0.5], 0.9, "path=src")
+    assert similar == ("How does auth work?", "In src.", pytest.approx(1.0))
+    assert cache.similar("v1", [0.5, 0.5], 0.9, "path=doc") is None
+
+
+def test_serving_does_not_rewrite_the_cache(tmp_path):
+    path = tmp_path / "answers.json"
+    cache = AnswerCache(str(path))
+    cache.put("v1", "How does auth work?", "With tokens.", [1.0, 0.0])
+    cache.save()
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".tmp")]
+
+    reloaded = AnswerCache(str(path))
+    assert reloaded.answer("v1", "How does auth work?") == "With tokens."
+    assert reloaded.similar("v1", [1.0, 0.0], threshold=0.95) is not None
+    path.unlink()
+    reloaded.save()
+    assert not path.exists()
+
+
+def test_embeddings_are_capped_and_kept_aside(tmp_path):
+    path = tmp_path / "answers.json"
+    cache = AnswerCache(str(path), max_answers=2)
+    for number in range(3):
+        cache.put(None, f"question {number}", "", [float(number), 1.0])
+    cache.save()
+    assert not path.exists()
+
+    reloaded = AnswerCache(str(path))
+    assert reloaded.embedding("question 0") is None
+    assert reloaded.embedding("question 2") == [2.0, 1.0]
+    assert "question" not in (tmp_path / "answers.embeddings.json").read_text()
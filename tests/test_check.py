@@ -0,0 +1,144 @@
+import pytest
+
+from menderbot.check import (
+    DmypyChecker,
+    MypyChecker,
+    PyrightChecker,
+    package_root,
+    select_checker,
+)
+from menderbot.source_file import SourceFile
+
+
+def test_package_root(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "pkg" / "sub").mkdir(parents=True)
+    (tmp_path / "pkg" / "__init__.py").write_text("")
+    (tmp_path / "pkg" / "sub" / "__init__.py").write_text("")
+    (tmp_path / "pkg" / "sub" / "mod.py").write_text("")
+    (tmp_path / "script.py").write_text("")
+
+    assert package_root("pkg/sub/mod.py") == "pkg"
+    assert package_root("script.py") == "script.py"
+
+
+def test_select_checker_prefers_mypy_daemon(monkeypatch):
+    shadows = {"mod.py": "shadow/mod.py"}
+    # Only used when asked for.
+    monkeypatch.setattr(PyrightChecker, "available", staticmethod(lambda: True))
+    monkeypatch.setattr(DmypyChecker, "available", staticmethod(lambda: True))
+    assert isinstance(select_checker(shadows), DmypyChecker)
+    monkeypatch.setattr(DmypyChecker, "available", staticmethod(lambda: False))
+    assert isinstance(select_checker(shadows), MypyChecker)
+    checker = select_checker(shadows, "pyright")
+    assert isinstance(checker, PyrightChecker)
+    assert checker.shadows == shadows
+
+
+@pytest.mark.skipif(not DmypyChecker.available(), reason="dmypy not installed")
+def test_dmypy_checker_sees_new_shadow_content(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "mod.py").write_text("def f(a):\n    return a\n\nf(1)\n")
+    shadow = tmp_path / "mod.py.shadow"
+    shadow.write_text("def f(a):\n    return a\n\nf(1)\n")
+    checker = DmypyChecker(
+        {"mod.py": "mod.py.shadow"}, status_file=str(tmp_path / "dmypy.json")
+    )
+    try:
+        assert checker.baseline("mod.py")[0]
+        shadow.write_text("def f(a: str) -> int:\n    return a\n\nf(1)\n")
+        success, output = checker.check("mod.py", "mod.py.shadow")
+        assert not success
+        assert "mod.py:2: error" in output
+        shadow.write_text("def f(a: int) -> int:\n    return a\n\nf(1)\n")
+        assert checker.check("mod.py", "mod.py.shadow")[0]
+    finally:
+        checker.stop()
+
+
+@pytest.mark.skipif(not DmypyChecker.available(), reason="dmypy not installed")
+def test_dmypy_checker_releases_shadows(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "a.py").write_text("def f(a):\n    return a\n")
+    (tmp_path / "a.py.shadow").write_text("def f(a: int) -> int:\n    return a\n")
+    (tmp_path / "b.py").write_text("from a import f\n\nf(1)\n")
+    (tmp_path / "b.py.shadow").write_text("from a import f\n\nf(1)\n")
+    checker = DmypyChecker(
+        {"a.py": "a.py.shadow", "b.py": "b.py.shadow"},
+        status_file=str(tmp_path / "dmypy.json"),
+    )
+    try:
+        assert checker.baseline("a.py", "b.py")[0]
+        checker.release("a.py")
+        (tmp_path / "a.py.shadow").unlink()
+        assert checker.shadows == {"b.py": "b.py.shadow"}
+        (tmp_path / "b.py.shadow").write_text('from a import f\n\nf("s")\n')
+        assert checker.check("b.py", "b.py.shadow")[0]
+        with pytest.raises(ValueError):
+            checker.check("a.py", "a.py.shadow")
+    finally:
+        checker.stop()
+
+
+@pytest.mark.skipif(not DmypyChecker.available(), reason="dmypy not installed")
+def test_dmypy_checker_ignores_errors_in_other_modules(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "__init__.py").write_text("")
+    (tmp_path / "pkg" / "a.py").write_text("def f(a):\n    return a\n")
+    (tmp_path / "pkg" / "a.py.shadow").write_text("def f(a):\n    return a\n")
+    (tmp_path / "pkg" / "other.py").write_text('x: int = "s"\n')
+    checker = DmypyChecker(
+        {"pkg/a.py": "pkg/a.py.shadow"}, status_file=str(tmp_path / "dmypy.json")
+    )
+    try:
+        assert checker.baseline("pkg/a.py") == (True, "")
+        (tmp_path / "pkg" / "a.py.shadow").write_text(
+            "def f(a: int) -> str:\n    return a\n"
+        )
+        success, output = checker.check("pkg/a.py", "pkg/a.py.shadow")
+        assert not success
+        assert output.startswith("pkg/a.py:2: error")
+        assert "other.py" not in output
+    finally:
+        checker.stop()
+
+
+def test_pyright_checker_reads_shadows_in_source_encoding(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    source = "# Café au lait, crème brûlée, déjà vu.\ndef f(a):\n    return a\n"
+    (tmp_path / "mod.py").write_bytes(source.encode("latin-1"))
+    source_file = SourceFile("mod.py")
+    source_file.load_source_as_utf8()
+    shadow_path = source_file.write_shadow([])
+    checker = PyrightChecker({"mod.py": shadow_path})
+    text = checker._shadow_text("mod.py")
+    assert text == source_file.render([])
+    assert text.startswith("# Caf") and text.endswith("def f(a):\n    return a\n")
+
+
+@pytest.mark.skipif(not PyrightChecker.available(), reason="pyright not installed")
+def test_pyright_checker_sees_new_shadow_content(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "mod.py").write_text("def f(a):\n    return a\n\nf(1)\n")
+    (tmp_path / "user.py").write_text("from mod import f\n\nf(1)\n")
+    shadow = tmp_path / "mod.py.shadow"
+    shadow.write_text("def f(a):\n    return a\n\nf(1)\n")
+    user_shadow = tmp_path / "user.py.shadow"
+    user_shadow.write_text("from mod import f\n\nf(1)\n")
+    checker = PyrightChecker({"mod.py": "mod.py.shadow", "user.py": "user.py.shadow"})
+    try:
+        assert checker.baseline("mod.py", "user.py")[0]
+        shadow.write_text("def f(a: str) -> int:\n    return a\n\nf(1)\n")
+        success, output = checker.check("mod.py", "mod.py.shadow")
+        assert not success
+        assert "mod.py:2:12: error" in output
+        assert "mod.py:4:3: error" in output
+        # Other open files see the shadow once it is refreshed.
+        shadow.write_text("def f(a: str) -> str:\n    return a\n")
+        checker.refresh("mod.py")
+        success, output = checker.check("user.py", "user.py.shadow")
+        assert not success
+        assert output.startswith("user.py:3:3: error")
+    finally:
+        checker.stop()
@@ -1,7 +1,13 @@
+import json
+import subprocess
+import sys
+import time
+
 import pytest
 from click.testing import CliRunner
 
 from menderbot.__main__ import ask, cli
+from menderbot.check import PyrightChecker
 
 
 @pytest.fixture
@@ -14,3 +20,65 @@ def test_noargs_shows_usage_message(runner):
     result = runner.invoke(cli, [])
     assert result.exit_code == 0
     assert "Usage:" in result.output
+
+
+# Well above the ~0.3s `--help` takes, far below the seconds llama_index costs.
+STARTUP_BUDGET_SECONDS = 1.5
+HEAVY_MODULES = ["llama_index", "openai", "git", "nltk", "tiktoken", "libcst"]
+
+
+def test_startup_does_not_load_heavy_modules():
+    code = f"""
+import sys
+import menderbot
+heavy = {HEAVY_MODULES!r}
+print(sorted({{m.split(".")[0] for m in sys.modules}} & set(heavy)))
+"""
+    output = subprocess.check_output([sys.executable, "-c", code], text=True)
+    assert output.strip() == "[]"
+
+
+def test_help_starts_within_budget():
+    best = float("inf")
+    for _ in range(3):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, "-m", "menderbot", "--help"],
+            capture_output=True,
+            check=True,
+        )
+        best = min(best, time.perf_counter() - start)
+    assert best < STARTUP_BUDGET_SECONDS
+
+
+def test_functions_streams_ndjson(runner, tmp_path):
+    (tmp_path / "a.py").write_text("def foo(a):\n    pass\n", encoding="utf-8")
+    (tmp_path / "pkg").mkdir()
+    (tmp_path / "pkg" / "b.py").write_text("def bar():\n    pass\n", encoding="utf-8")
+    (tmp_path / "pkg" / "broken.py").write_text("def (:\n", encoding="utf-8")
+    # Latin-1 without a coding cookie.
+    (tmp_path / "pkg" / "c.py").write_bytes(b"s = '\xe9'\ndef baz():\n    pass\n")
+    (tmp_path / "pkg" / "d.py").write_text("def qux():\n    pass\n", encoding="utf-8")
+
+    result = runner.invoke(
+        cli, ["functions", str(tmp_path), str(tmp_path / "missing.py")]
+    )
+
+    assert result.exit_code == 0
+    records = [json.loads(line) for line in result.output.splitlines()]
+    assert [(r["kind"], r.get("props", {}).get("name")) for r in records] == [
+        ("fn", "foo"),
+        ("fn", "bar"),
+        ("error", None),
+        ("error", None),
+        ("fn", "qux"),
+        ("error", None),
+    ]
+    assert "text" not in records[0]
+
+
+def test_type_with_missing_checker_fails(runner, monkeypatch, tmp_path):
+    monkeypatch.setattr(PyrightChecker, "available", staticmethod(lambda: False))
+    result = runner.invoke(cli, ["type", "--checker", "pyright", str(tmp_path)])
+    assert result.exit_code == 2
+    assert "pyright is not installed" in result.output
@@ -1,3 +1,5 @@
+import pickle
+
 import pytest
 
 from menderbot import python_cst
@@ -148,3 +150,76 @@ def foo(a, b):
     sig_ast = fn_ast.children_filtered(kind=python_cst.KIND_SIGNATURE)[0]
     sig_end = sig_ast.src_range.end
     assert (sig_end.line, sig_end.col) == (3, 14)
+
+
+def test_ast_node_props_and_children_created_lazily():
+    src_range = python_cst.SourceRange(
+        python_cst.SourcePosition(1, 1), python_cst.SourcePosition(2, 5)
+    )
+    node = python_cst.AstNode(kind=python_cst.KIND_PARAM, src_range=src_range)
+    assert node.children_filtered(kind=python_cst.KIND_PARAM) == []
+    assert node.as_dict() == {"kind": "param", "range": "1:1-2:5"}
+    node.props[python_cst.PROP_NAME] = "a"
+    assert node.as_dict()["props"] == {"name": "a"}
+
+
+def test_ast_node_pickle_round_trip():
+    fn_ast = python_cst.collect_function_asts("def foo(a, b=1):\n    pass\n")[0]
+    restored = pickle.loads(pickle.dumps(fn_ast))
+    assert restored == fn_ast
+    assert restored.kind is python_cst.KIND_FN
+
+
+def test_function_text_cut_from_source():
+    code = """
+# comment
+@decorator
+def foo(a,
+        b):  # trailing
+    return a  # done
+
+class Cls:
+    def bar(self): return 1
+"""
+    foo_ast, bar_ast = python_cst.collect_function_asts(bytes(code, "utf-8"))
+    assert foo_ast.text == (
+        "@decorator\ndef foo(a,\n        b):  # trailing\n    return a  # done\n"
+    )
+    assert bar_ast.text == "def bar(self): return 1\n"
+
+
+def test_method_text_is_dedented():
+    code = """
+class Cls:
+    @staticmethod
+    def m(x):
+        if x and \\
+                x:
+            return \"\"\"
+text
+\"\"\"
+
+        def inner():
+            pass
+"""
+    (m_ast,) = python_cst.collect_function_asts(bytes(code, "utf-8"))
+    assert m_ast.text == (
+        "@staticmethod\ndef m(x):\n    if x and \\\n                x:\n"
+        '        return """\ntext\n"""\n'
+        "\n    def inner():\n        pass\n"
+    )
+
+
+def test_python_end_of_wrapped_params_in_method(py_strat):
+    code = """
+class Cls:
+    def foo(
+        self,
+        a,
+    ):
+        pass
+"""
+    fn_ast = python_cst.collect_function_asts(code)[0]
+    sig_ast = fn_ast.children_filtered(kind=python_cst.KIND_SIGNATURE)[0]
+    sig_end = sig_ast.src_range.end
+    assert (sig_end.line, sig_end.col) == (6, 6)
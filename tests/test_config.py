@@ -0,0 +1,40 @@
+import os
+from unittest.mock import patch
+
+from menderbot.config import RepoContext
+
+
+def test_repo_context_resolves_once_and_reloads_on_change(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    config_path = tmp_path / ".menderbot-config.yaml"
+    config_path.write_text("consent: no\n", encoding="utf-8")
+    context = RepoContext()
+
+    with patch(
+        "menderbot.config.git_show_top_level", return_value=str(tmp_path)
+    ) as top_level:
+        assert context.config() == {"consent": False}
+        assert context.config() == {"consent": False}
+        assert context.config_path == str(config_path)
+        assert top_level.call_count == 1
+
+        config_path.write_text("consent: yes\n", encoding="utf-8")
+        stat = config_path.stat()
+        os.utime(config_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000))
+        assert context.config() == {"consent": True}
+
+        (tmp_path / "sub").mkdir()
+        monkeypatch.chdir(tmp_path / "sub")
+        context.config()
+        assert top_level.call_count == 2
+
+
+def test_repo_context_without_repo_or_config(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    context = RepoContext()
+    with patch("menderbot.config.git_show_top_level", return_value=None):
+        assert context.config_path is None
+        assert context.config() is None
+    with patch("menderbot.config.git_show_top_level", return_value=str(tmp_path)):
+        context.invalidate()
+        assert context.config() is None
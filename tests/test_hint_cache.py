@@ -0,0 +1,45 @@
+from menderbot.hint_cache import HintCache, relevant_imports
+
+
+def test_relevant_imports_by_bound_name():
+    imports = [
+        ("", "os.path"),
+        ("", "numpy as np"),
+        ("typing", "Any"),
+        ("typing", "Optional"),
+    ]
+    text = "def f(a):\n    return np.array(os.getcwd(), Any)\n"
+    assert relevant_imports(text, imports) == [
+        ("", "numpy as np"),
+        ("", "os.path"),
+        ("typing", "Any"),
+    ]
+
+
+def test_key_changes_with_text_and_used_imports_only():
+    text = "def f(a):\n    return Path(a)\n"
+    key = HintCache.key(text, [("pathlib", "Path")])
+    assert key == HintCache.key(text, [("pathlib", "Path"), ("os", "sep")])
+    assert key != HintCache.key(text, [("my.paths", "Path")])
+    assert key != HintCache.key(text + "\n", [("pathlib", "Path")])
+
+
+def test_hints_survive_save_and_reload(tmp_path):
+    path = str(tmp_path / "cache" / "type_hints.json")
+    cache = HintCache(path)
+    cache.accept("k", [("return", "int"), ("a", "str")])
+    cache.reject("k", [("a", "int")], "m.py:2: error: nope")
+    cache.save()
+
+    reloaded = HintCache(path)
+    assert reloaded.accepted("k") == [("a", "str"), ("return", "int")]
+    assert reloaded.rejection("k", [("a", "int")]) == "m.py:2: error: nope"
+    assert reloaded.rejection("k", [("a", "str")]) is None
+    assert reloaded.accepted("other") is None
+
+
+def test_rejecting_accepted_hints_forgets_them(tmp_path):
+    cache = HintCache(str(tmp_path / "type_hints.json"))
+    cache.accept("k", [("a", "int")])
+    cache.reject("k", [("a", "int")], "error")
+    assert cache.accepted("k") is None
@@ -0,0 +1,91 @@
+import threading
+from unittest.mock import patch
+
+from llama_index.core import MockEmbedding
+from llama_index.core.base.response.schema import Response
+
+from menderbot.answer_cache import AnswerCache
+from menderbot.ingest import (
+    DeferredQueryEngine,
+    ask_index,
+    document_metadata,
+    filter_scope,
+)
+
+
+class EchoEngine:
+    def query(self, query_bundle):
+        return Response(f"answer to {query_bundle.query_str}")
+
+
+def test_deferred_query_engine_waits_for_load():
+    release = threading.Event()
+
+    def load():
+        release.wait(timeout=5)
+        return EchoEngine()
+
+    engine = DeferredQueryEngine(load)
+    assert not engine.ready()
+    threading.Timer(0.1, release.set).start()
+
+    assert str(engine.query("what?")) == "answer to what?"
+    assert engine.ready()
+
+
+class CountingEngine:
+    def __init__(self):
+        self.embeddings = []
+
+    def query(self, query_bundle):
+        self.embeddings.append(query_bundle.embedding)
+        if query_bundle.embedding is None:
+            query_bundle.embedding = [1.0, 0.0]
+        return Response("It uses tokens.")
+
+
+def test_ask_index_caches_per_index_stamp(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.json"))
+    engine = CountingEngine()
+    with patch("menderbot.ingest.index_stamp", return_value="v1"):
+        assert ask_index("How does auth work?", cache, engine) == "It uses tokens."
+        assert ask_index("how does  auth work", cache, engine) == "It uses tokens."
+    assert engine.embeddings == [None]
+
+    with patch("menderbot.ingest.index_stamp", return_value="v2"):
+        ask_index("How does auth work?", cache, engine)
+    # Asked again after re-ingesting, without embedding the question again.
+    assert engine.embeddings == [None, [1.0, 0.0]]
+
+
+def test_ask_index_serves_paraphrase_labeled(tmp_path):
+    cache = AnswerCache(str(tmp_path / "answers.json"))
+    engine = CountingEngine()
+    # Every text gets the same vector, any two questions are identical.
+    embed_model = MockEmbedding(embed_dim=2)
+    with patch("menderbot.ingest.index_stamp", return_value="v1"):
+        ask_index("How does auth work?", cache, engine, 0.9, embed_model)
+        answer = ask_index("Explain authentication", cache, engine, 0.9, embed_model)
+
+    assert len(engine.embeddings) == 1
+    assert answer.startswith('(Cached answer to the similar question "How does')
+    assert answer.endswith("\nIt uses tokens.")
+
+
+def test_document_metadata_and_filter_scope():
+    assert document_metadata("menderbot/grammars/x.TS") == {
+        "file_name": "menderbot/grammars/x.TS",
+        "extension": ".ts",
+        "language": "typescript",
+        "top_dir": "menderbot",
+        "path_prefixes": [
+            "menderbot",
+            "menderbot/grammars",
+            "menderbot/grammars/x.TS",
+        ],
+    }
+    assert document_metadata("setup.py")["top_dir"] == ""
+    assert filter_scope() == filter_scope(".") == ""
+    assert filter_scope("src/", ["py", "Python", ".md"]) == (
+        "path=src lang=markdown,python"
+    )
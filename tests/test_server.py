@@ -0,0 +1,122 @@
+import socket
+import threading
+from unittest.mock import patch
+
+import pytest
+from click.testing import CliRunner
+
+from menderbot.__main__ import cli
+from menderbot.server import (
+    MenderbotServer,
+    RemoteError,
+    ServerRunningError,
+    call,
+    try_call,
+)
+
+
+@pytest.fixture
+def server(tmp_path):
+    path = str(tmp_path / "menderbot.sock")
+    with MenderbotServer(path) as running:
+        thread = threading.Thread(target=running.serve_forever, daemon=True)
+        thread.start()
+        with patch("menderbot.server.socket_path", return_value=path):
+            yield running
+        running.shutdown()
+
+
+def test_call_and_errors(server):
+    assert "pid" in call("ping", {}, server.path)
+    with pytest.raises(RemoteError, match="Unknown method '_lock'"):
+        call("_lock", {}, server.path)
+    with pytest.raises(RemoteError, match="TypeError"):
+        call("review", {"wrong": 1}, server.path)
+
+
+def test_review_is_served_and_cached(server):
+    del server
+    runner = CliRunner()
+    with (
+        patch(
+            "menderbot.__main__.get_response", return_value="Looks fine."
+        ) as get_response,
+        patch("menderbot.__main__.check_llm_consent"),
+    ):
+        for _ in range(2):
+            result = runner.invoke(cli, ["review"], input="+ x = 1\n")
+            assert result.exit_code == 0
+            assert "Looks fine." in result.output
+
+    assert get_response.call_count == 1
+
+
+def test_try_call_without_server(tmp_path):
+    with patch(
+        "menderbot.server.socket_path", return_value=str(tmp_path / "none.sock")
+    ):
+        assert try_call("ping", {}) == (False, None)
+
+
+def test_type_requests_run_one_at_a_time(server):
+    running = []
+    overlapped = []
+
+    def infer_type_hints(paths, **options):
+        running.append(paths)
+        overlapped.append(len(running) > 1)
+        threading.Event().wait(0.1)
+        running.remove(paths)
+        return {}
+
+    with patch("menderbot.__main__.infer_type_hints", infer_type_hints):
+        threads = [
+            threading.Thread(target=call, args=("type", {"paths": [name]}, server.path))
+            for name in ["a.py", "b.py"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert overlapped == [False, False]
+
+
+def test_second_server_does_not_take_the_socket(server, tmp_path):
+    with pytest.raises(ServerRunningError):
+        MenderbotServer(server.path)
+    assert "pid" in call("ping", {}, server.path)
+
+    stale = str(tmp_path / "stale.sock")
+    # Bound but no longer listening, as after a crash.
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(stale)
+    with MenderbotServer(stale) as replacement:
+        assert replacement.path == stale
+
+
+def test_type_output_reaches_the_client(server):
+    def infer_type_hints(paths, **options):
+        from menderbot.__main__ import console
+
+        console.print("Running type-checker baseline")
+        return {}
+
+    printed = []
+    with patch("menderbot.__main__.infer_type_hints", infer_type_hints):
+        result = call("type", {"paths": ["a.py"]}, server.path, printed.append)
+
+    assert result == {}
+    assert "".join(printed) == "Running type-checker baseline\n"
+
+
+def test_try_call_falls_back_when_server_hangs(tmp_path):
+    path = str(tmp_path / "hung.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as hung:
+        hung.bind(path)
+        hung.listen()
+        with (
+            patch("menderbot.server.socket_path", return_value=path),
+            patch("menderbot.server.READ_TIMEOUT_SECONDS", 0.1),
+        ):
+            assert try_call("ping", {}) == (False, None)
@@ -0,0 +1,129 @@
+import os
+
+import pytest
+from llama_index.core import MockEmbedding
+from llama_index.core.schema import Document
+
+from menderbot.ingest import document_metadata, metadata_filters
+from menderbot.sharded_index import ROOT_SHARD, ShardedIndex, shard_of
+
+
+def document(path, text):
+    return Document(text=text, id_=path, metadata=document_metadata(path))
+
+
+def test_shard_of():
+    assert shard_of("src/app/main.py") == "src"
+    assert shard_of("setup.py") == ROOT_SHARD
+    assert shard_of("we ird/x.py") == "we_ird"
+    assert shard_of(".github/workflows/ci.yml") == "_github"
+    bucket = shard_of("src/app/main.py", shard_by="hash", shard_count=4)
+    assert bucket == shard_of("src/app/main.py", shard_by="hash", shard_count=4)
+    assert bucket in {f"hash-{i:03d}" for i in range(4)}
+
+
+def test_only_changed_shards_are_written(tmp_path):
+    persist_dir = str(tmp_path / "shards")
+    embed_model = MockEmbedding(embed_dim=8)
+    index = ShardedIndex(persist_dir, embed_model=embed_model)
+    docs = [document("src/a.py", "def a(): pass"), document("doc/b.md", "# B")]
+    index.update(docs, ["src/a.py", "doc/b.md"])
+    assert index.persist() == ["doc", "src"]
+
+    index = ShardedIndex(persist_dir, embed_model=embed_model).load()
+    assert index.indexed_paths() == {"src/a.py", "doc/b.md"}
+    # Same content again, nothing to write.
+    index.update(docs, ["src/a.py", "doc/b.md"])
+    assert index.persist() == []
+
+    index.update([document("src/a.py", "def a(): return 1")], ["src/a.py"])
+    assert index.persist() == ["src"]
+    nodes = index.as_retriever(similarity_top_k=5).retrieve("a")
+    assert sorted(node.metadata["file_name"] for node in nodes) == [
+        "doc/b.md",
+        "src/a.py",
+    ]
+
+    index.update([], ["doc/b.md"])
+    assert index.persist() == ["doc"]
+    assert sorted(os.listdir(persist_dir)) == [".layout.json", "src"]
+
+
+def test_sqlite_store_skips_unchanged_files(tmp_path):
+    persist_dir = str(tmp_path / "shards")
+    embed_model = MockEmbedding(embed_dim=8)
+    index = ShardedIndex(persist_dir, embed_model=embed_model, store="sqlite")
+    docs = [document("src/a.py", "def a(): pass"), document("doc/b.md", "# B")]
+    index.update(docs, ["src/a.py", "doc/b.md"], {"src/a.py": "1", "doc/b.md": "2"})
+    assert index.persist() == ["doc", "src"]
+    assert not os.path.exists(os.path.join(persist_dir, "src", "docstore.json"))
+
+    index = ShardedIndex(persist_dir, embed_model=embed_model).load()
+    assert index.store == "sqlite"
+    assert index.indexed_paths() == {"src/a.py", "doc/b.md"}
+    assert index.unchanged("src/a.py", "1")
+    assert not index.unchanged("src/a.py", "3")
+
+    index.update([document("src/a.py", "def a(): return 1")], ["src/a.py"], {})
+    index.update([], ["doc/b.md"])
+    assert index.persist() == ["doc", "src"]
+    nodes = index.as_retriever(similarity_top_k=5).retrieve("a")
+    assert [node.text for node in nodes] == ["def a(): return 1"]
+    assert index.catalog.doc_ids("src/a.py") == ["src/a.py"]
+    assert index.catalog.doc_ids("doc/b.md") == []
+    assert index.catalog.get_all("doc/docstore/data") == {}
+
+
+def test_filters_prune_shards_and_nodes(tmp_path):
+    persist_dir = str(tmp_path / "shards")
+    index = ShardedIndex(persist_dir, embed_model=MockEmbedding(embed_dim=8))
+    paths = ["src/app/a.py", "src/app/b.md", "src/lib/c.py", "doc/d.md", "e.py"]
+    index.update([document(path, f"text of {path}") for path in paths], paths)
+    index.persist()
+    assert index.shards_under("src/app/") == ["src"]
+    assert index.shards_under("e.py") == [ROOT_SHARD]
+    assert index.shards_under(None) == ["_root", "doc", "src"]
+
+    def retrieve(path=None, langs=()):
+        retriever = index.as_retriever(
+            similarity_top_k=10, filters=metadata_filters(path, langs), path=path
+        )
+        return sorted(node.metadata["file_name"] for node in retriever.retrieve("a"))
+
+    assert retrieve("src/app/") == ["src/app/a.py", "src/app/b.md"]
+    assert retrieve("src", ["py"]) == ["src/app/a.py", "src/lib/c.py"]
+    assert retrieve(langs=["markdown"]) == ["doc/d.md", "src/app/b.md"]
+    assert retrieve("./e.py") == ["e.py"]
+    assert retrieve("sr") == []
+
+
+def test_sqlite_persist_interrupted_after_commit_is_finished(tmp_path, monkeypatch):
+    persist_dir = str(tmp_path / "shards")
+    embed_model = MockEmbedding(embed_dim=8)
+    index = ShardedIndex(persist_dir, embed_model=embed_model, store="sqlite")
+    index.update([document("src/a.py", "def a(): pass")], ["src/a.py"], {})
+    index.persist()
+
+    move_in_place = ShardedIndex._move_in_place
+
+    def interrupted(self, swap, remove):
+        if swap:
+            raise KeyboardInterrupt
+        move_in_place(self, swap, remove)
+
+    index.update([document("src/a.py", "def a(): return 1")], ["src/a.py"], {})
+    monkeypatch.setattr(ShardedIndex, "_move_in_place", interrupted)
+    with pytest.raises(KeyboardInterrupt):
+        index.persist()
+    monkeypatch.undo()
+    assert os.path.exists(os.path.join(persist_dir, ".src.tmp"))
+
+    # Documents were committed, so the written vectors are read with them.
+    index = ShardedIndex(persist_dir, embed_model=embed_model).load()
+    nodes = index.as_retriever(similarity_top_k=5).retrieve("a")
+    assert [node.text for node in nodes] == ["def a(): return 1"]
+    assert index.persist() == []
+    assert not os.path.exists(os.path.join(persist_dir, ".src.tmp"))
+    index = ShardedIndex(persist_dir, embed_model=embed_model).load()
+    nodes = index.as_retriever(similarity_top_k=5).retrieve("a")
+    assert [node.text for node in nodes] == ["def a(): return 1"]
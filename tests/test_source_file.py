@@ -1,4 +1,18 @@
-from menderbot.source_file import Insertion, insert_in_lines
+import os
+from unittest.mock import patch
+
+import pytest
+
+from menderbot import source_file as source_file_module
+from menderbot.source_file import (
+    SCRATCH_DIR_ENV,
+    Insertion,
+    Replacement,
+    SourceFile,
+    apply_edits,
+    insert_in_lines,
+    shadow_path_for,
+)
 
 
 def test_insert_in_lines_empty():
@@ -92,3 +106,165 @@ def foo(a: int) -> None:
         Insertion(text=" -> None", line_number=2, col=11, inline=True, label="foo"),
     ]
     assert list(insert_in_lines(lines, insertions)) == expected
+
+
+def test_apply_edits_sorts_unordered_edits():
+    lines = ["def foo(a, b):\n", "    pass\n"]
+    edits = [
+        Insertion(text=" -> None", line_number=1, col=14, inline=True, label="r"),
+        Insertion(text="import x", line_number=1, label="imp"),
+        Insertion(text=": str", line_number=1, col=13, inline=True, label="b"),
+        Insertion(text=": int", line_number=1, col=10, inline=True, label="a"),
+    ]
+    assert list(apply_edits(lines, edits)) == [
+        "import x\n",
+        "def foo(a: int, b: str) -> None:\n",
+        "    pass\n",
+    ]
+
+
+def test_apply_edits_replacements():
+    lines = ["x: List[int] = []\n", "y = (1,\n", "     2)\n", "z = 3\n"]
+    edits = [
+        Replacement(
+            text="(1, 2)", line_number=2, col=5, end_line=3, end_col=8, label="y"
+        ),
+        Replacement(
+            text="list", line_number=1, col=4, end_line=1, end_col=8, label="x"
+        ),
+        Insertion(text="  # joined", line_number=3, col=8, inline=True, label="c"),
+    ]
+    assert list(apply_edits(lines, edits)) == [
+        "x: list[int] = []\n",
+        "y = (1, 2)  # joined\n",
+        "z = 3\n",
+    ]
+
+
+def test_apply_edits_rejects_overlaps():
+    lines = ["abcdef\n"]
+    edits = [
+        Replacement(text="X", line_number=1, col=2, end_line=1, end_col=5, label="r"),
+        Insertion(text="!", line_number=1, col=3, inline=True, label="i"),
+    ]
+    with pytest.raises(ValueError, match="overlaps replacement 'r'"):
+        list(apply_edits(lines, edits))
+
+
+def test_shadow_path_mirrors_sources_under_scratch_dir(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.delenv(SCRATCH_DIR_ENV, raising=False)
+    assert shadow_path_for("pkg/mod.py") == os.path.join(
+        ".menderbot", "scratch", "pkg", "mod.py"
+    )
+    monkeypatch.setenv(SCRATCH_DIR_ENV, "/dev/shm/menderbot")
+    assert shadow_path_for("pkg/mod.py") == "/dev/shm/menderbot/pkg/mod.py"
+
+
+def test_write_shadow_leaves_source_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv(SCRATCH_DIR_ENV, str(tmp_path / "scratch"))
+    (tmp_path / "mod.py").write_text("def f(a):\n    pass\n", encoding="utf-8")
+    source_file = SourceFile("mod.py")
+    source_file.load_source_as_utf8()
+    hint = Insertion(text=": int", line_number=1, col=8, inline=True, label="f")
+
+    shadow_path = source_file.write_shadow([hint])
+    source_file.write_shadow([])
+
+    assert shadow_path == str(tmp_path / "scratch" / "mod.py")
+    assert source_file.render([hint]) == "def f(a: int):\n    pass\n"
+    assert (tmp_path / "scratch" / "mod.py").read_text() == "def f(a):\n    pass\n"
+    assert (tmp_path / "mod.py").read_text() == "def f(a):\n    pass\n"
+    assert set(os.listdir(tmp_path)) == {"mod.py", "scratch"}
+
+
+def test_load_source_as_utf8_skips_detection_for_utf8(tmp_path):
+    path = tmp_path / "mod.py"
+    path.write_bytes("s = 'héllo'\n".encode("utf-8"))
+    source_file = SourceFile(str(path))
+    with patch("menderbot.source_file.from_bytes") as from_bytes:
+        assert source_file.load_source_as_utf8() == "s = 'héllo'\n".encode("utf-8")
+    from_bytes.assert_not_called()
+    assert source_file.encoding == "utf_8"
+
+
+def test_load_source_as_utf8_keeps_bom_on_write(tmp_path):
+    path = tmp_path / "mod.py"
+    path.write_bytes("\ufeffx = 1\n".encode("utf-8"))
+    source_file = SourceFile(str(path))
+
+    assert source_file.load_source_as_utf8() == b"x = 1\n"
+    source_file.update_file(
+        [Insertion(text="# hi", line_number=1, label="...")], suffix=""
+    )
+    assert path.read_bytes() == "\ufeff# hi\nx = 1\n".encode("utf-8")
+
+
+def test_load_source_as_utf8_detects_other_encodings_once(tmp_path):
+    path = tmp_path / "mod.py"
+    text = "# Ça coûte très cher, déjà vu à l'été\ns = 'naïve café crème brûlée'\n"
+    path.write_bytes(text.encode("cp1252"))
+    with patch(
+        "menderbot.source_file.from_bytes",
+        wraps=source_file_module.from_bytes,
+    ) as from_bytes:
+        first = SourceFile(str(path))
+        loaded = first.load_source_as_utf8()
+        second = SourceFile(str(path))
+        assert second.load_source_as_utf8() == loaded
+    assert from_bytes.call_count == 1
+    assert first.encoding != "utf_8"
+    assert second.encoding == first.encoding
+    assert loaded == path.read_bytes().decode(first.encoding).encode("utf-8")
+
+
+def test_update_file_replaces_atomically_keeping_mode(tmp_path):
+    path = tmp_path / "script.py"
+    path.write_text("x = 1\n", encoding="utf-8")
+    path.chmod(0o755)
+    source_file = SourceFile(str(path))
+    source_file.load_source_as_utf8()
+
+    with patch("menderbot.source_file.os.fsync") as fsync:
+        source_file.update_file(
+            [Insertion(text="#!/usr/bin/env python", line_number=1, label="...")],
+            suffix="",
+            fsync=True,
+        )
+
+    assert path.read_text(encoding="utf-8") == "#!/usr/bin/env python\nx = 1\n"
+    assert path.stat().st_mode & 0o777 == 0o755
+    assert fsync.call_count == 2  # The file, then its directory.
+    assert os.listdir(tmp_path) == ["script.py"]
+
+
+def test_update_file_leaves_file_alone_on_bad_edits(tmp_path):
+    path = tmp_path / "mod.py"
+    path.write_text("abcdef\n", encoding="utf-8")
+    source_file = SourceFile(str(path))
+    source_file.load_source_as_utf8()
+    edits = [
+        Replacement(text="X", line_number=1, col=2, end_line=1, end_col=5, label="r"),
+        Insertion(text="!", line_number=1, col=3, inline=True, label="i"),
+    ]
+
+    with pytest.raises(ValueError):
+        source_file.update_file(edits, suffix="")
+
+    assert path.read_text(encoding="utf-8") == "abcdef\n"
+    assert os.listdir(tmp_path) == ["mod.py"]
+
+
+def test_remove_shadow(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv(SCRATCH_DIR_ENV, str(tmp_path / "scratch"))
+    (tmp_path / "mod.py").write_text("def f(a):\n    pass\n", encoding="utf-8")
+    source_file = SourceFile("mod.py")
+    source_file.load_source_as_utf8()
+    shadow_path = source_file.write_shadow([])
+
+    source_file.remove_shadow()
+    source_file.remove_shadow()
+    assert not os.path.exists(shadow_path)
+    assert (tmp_path / "mod.py").exists()
@@ -0,0 +1,23 @@
+from menderbot.sqlite_store import SqliteKVStore
+
+
+def test_kv_and_documents(tmp_path):
+    path = str(tmp_path / "index.sqlite")
+    store = SqliteKVStore(path)
+    store.put_all([("a", {"x": 1}), ("b", {"x": 2})], collection="_root/docstore/data")
+    store.record_documents("_root", "setup.py", "abc", ["setup.py"])
+    assert store.get("a", collection="_root/docstore/data") == {"x": 1}
+    # Not visible to other connections before the commit.
+    assert SqliteKVStore(path).get_all("_root/docstore/data") == {}
+    store.commit()
+
+    reopened = SqliteKVStore(path)
+    assert reopened.get_all("_root/docstore/data") == {"a": {"x": 1}, "b": {"x": 2}}
+    assert reopened.blob_sha("setup.py") == "abc"
+    assert reopened.delete("a", collection="_root/docstore/data")
+    # An underscore is not a LIKE wildcard here.
+    reopened.put("k", {}, collection="xroot/docstore/data")
+    reopened.drop_shard("_root")
+    assert reopened.get_all("_root/docstore/data") == {}
+    assert reopened.get_all("xroot/docstore/data") == {"k": {}}
+    assert reopened.paths() == set()
@@ -4,10 +4,27 @@ from unittest.mock import patch
 import pytest
 
 from menderbot import python_cst
-from menderbot.__main__ import try_function_type_hints
+from menderbot.__main__ import (
+    try_file_type_hints,
+    try_function_type_hints,
+    type_files_in_order,
+    type_functions_concurrently,
+    verify_function_hints,
+)
+from menderbot.analysis import FileAnalysis
 from menderbot.code import LanguageStrategy, PythonLanguageStrategy, node_str
+from menderbot.hint_cache import HintCache
 from menderbot.source_file import Insertion, SourceFile, insert_in_lines
-from menderbot.typing import add_type_hints, parse_type_hint_answer, what_needs_typing
+from menderbot.typing import (
+    add_type_hints,
+    attribute_errors,
+    merge_insertions,
+    parse_type_hint_answer,
+    process_untyped_functions,
+    source_line,
+    what_needs_typing,
+)
+from tests.test_doc import FakeSourceFile
 
 
 @pytest.fixture
@@ -88,8 +105,17 @@ class MockSourceFile(SourceFile):
     def load_source_as_utf8(self):
         return ""
 
-    def update_file(self, insertions: Iterable[Insertion], suffix: str) -> None:
-        pass
+    def write_shadow(self, insertions: Iterable[Insertion]) -> str:
+        return "shadow.py"
+
+
+class FakeChecker:
+    def __init__(self):
+        self.checked = []
+
+    def check(self, path, shadow_path):
+        self.checked.append((path, shadow_path))
+        return (True, "")
 
 
 def test_try_function_type_hints(py_strat):
@@ -98,17 +124,15 @@ def foo(a):
     pass
     """
     fn_asts = python_cst.collect_function_asts(code)
-    with patch(
-        "menderbot.check.run_check",
-        side_effect=lambda _: True,
-    ):
-        source_file = MockSourceFile()
-        no_hints = try_function_type_hints("..mypy..", source_file, fn_asts[0], [])
-        assert no_hints == []
-        one_hint_no_results = try_function_type_hints(
-            "..mypy..", source_file, fn_asts[0], ["a"]
-        )
-        assert one_hint_no_results == []
+    checker = FakeChecker()
+    source_file = MockSourceFile()
+    no_hints = try_function_type_hints(checker, source_file, fn_asts[0], [])
+    assert no_hints == []
+    one_hint_no_results = try_function_type_hints(
+        checker, source_file, fn_asts[0], ["a"]
+    )
+    assert one_hint_no_results == []
+    assert checker.checked == [("", "shadow.py")]
 
 
 def test_indented_function(py_strat):
@@ -164,3 +188,292 @@ def foo(a):
         ("", "typing.Foo"),
         ("", "foo.Bar as Baz"),
     ]
+
+
+def test_get_relative_and_star_imports(py_strat):
+    code = """
+from . import sibling
+from ..pkg.mod import Thing
+from os.path import *
+"""
+    tree = parse_string_to_tree(
+        code,
+        py_strat,
+    )
+    assert py_strat.get_imports(tree) == [
+        (".", "sibling"),
+        ("..pkg.mod", "Thing"),
+        ("os.path", "*"),
+    ]
+
+
+def test_source_line_skips_inserted_lines():
+    insertions = [
+        Insertion(text="from typing import Any", line_number=1, label="type_import"),
+        Insertion(text=": int", line_number=3, col=10, inline=True, label="foo"),
+        Insertion(text="x = 1\ny = 2", line_number=4, label="other"),
+    ]
+    assert source_line(1, insertions) is None
+    assert source_line(2, insertions) == 1
+    assert source_line(4, insertions) == 3
+    assert source_line(5, insertions) is None
+    assert source_line(6, insertions) is None
+    assert source_line(7, insertions) == 4
+
+
+def test_attribute_errors_by_line_and_name():
+    code = """def foo(a):
+    return a
+
+def bar(b):
+    return b
+
+foo(1)
+"""
+    fn_asts = python_cst.collect_function_asts(code)
+    insertions = [
+        Insertion(text="from typing import Any", line_number=1, label="type_import")
+    ]
+    check_output = """m.py:3: error: Incompatible return value type  [return-value]
+m.py:8: error: Argument 1 to "foo" has incompatible type "int"  [arg-type]
+m.py:6: error: Something else  [misc]
+m.py:1: error: Module has no attribute "Any"  [attr-defined]
+other.py:3: error: Not this file  [misc]
+"""
+    by_function, unattributed = attribute_errors(
+        check_output, "m.py", fn_asts, insertions
+    )
+    assert by_function == {
+        "foo": [
+            "m.py:3: error: Incompatible return value type  [return-value]",
+            'm.py:8: error: Argument 1 to "foo" has incompatible type "int"  [arg-type]',
+        ],
+        "bar": ["m.py:6: error: Something else  [misc]"],
+    }
+    assert unattributed == [
+        'm.py:1: error: Module has no attribute "Any"  [attr-defined]'
+    ]
+
+
+def test_merge_insertions_dedupes_imports():
+    imp = Insertion(text="from typing import Any", line_number=1, label="type_import")
+    foo = Insertion(text=": int", line_number=2, col=10, inline=True, label="foo")
+    bar = Insertion(text=": Any", line_number=5, col=9, inline=True, label="bar")
+    assert merge_insertions([bar, imp, foo, imp]) == [imp, foo, bar]
+
+
+class ShadowSourceFile(FakeSourceFile):
+    def write_shadow(self, insertions) -> str:
+        lines = self.original_text.splitlines(True)
+        self.shadow_text = "".join(insert_in_lines(lines, insertions))
+        return f"{self.path}.shadow"
+
+    def remove_shadow(self):
+        self.shadow_text = None
+
+
+class ScriptedChecker:
+    """Always rejects hints on function `bad`."""
+
+    def __init__(self, source_file):
+        self.source_file = source_file
+        self.calls = 0
+
+    def check(self, path, shadow_path):
+        self.calls += 1
+        text = self.source_file.shadow_text
+        errors = [
+            f"{path}:{number}: error: bad hint  [misc]"
+            for number, line in enumerate(text.splitlines(), start=1)
+            if "def bad(a: int)" in line
+        ]
+        return (not errors, "\n".join(errors))
+
+
+def test_try_file_type_hints_checks_together_and_retries_failures():
+    code = """def good(a):
+    return a
+
+def bad(a):
+    return a
+"""
+    source_file = ShadowSourceFile("m.py", code)
+    checker = ScriptedChecker(source_file)
+    with patch(
+        "menderbot.__main__.get_response",
+        return_value="a: int\nreturn: int",
+    ):
+        untyped = list(process_untyped_functions(source_file))
+        insertions = try_file_type_hints(checker, source_file, untyped)
+
+    # Pre-check, one check for both, one retry for `bad`.
+    assert checker.calls == 3
+    assert "def bad(a: int) -> int:" in source_file.shadow_text
+    assert {ins.label for ins in insertions} == {"good"}
+
+
+class CrashingChecker:
+    def __init__(self):
+        self.calls = 0
+
+    def check(self, path, shadow_path):
+        self.calls += 1
+        return (False, "Daemon crashed!")
+
+
+def test_try_file_type_hints_rejects_all_when_checker_fails_unreadably():
+    code = """def good(a):
+    return a
+"""
+    source_file = ShadowSourceFile("m.py", code)
+    checker = CrashingChecker()
+    with patch(
+        "menderbot.__main__.get_response",
+        return_value="a: int\nreturn: int",
+    ):
+        untyped = list(process_untyped_functions(source_file))
+        insertions = try_file_type_hints(checker, source_file, untyped)
+
+    assert checker.calls > 1
+    assert insertions == []
+
+
+def test_try_file_type_hints_reuses_cached_hints(tmp_path):
+    code = """def good(a):
+    return a
+
+def bad(a):
+    return a
+"""
+    cache = HintCache(str(tmp_path / "type_hints.json"))
+    source_file = ShadowSourceFile("m.py", code)
+    untyped = list(process_untyped_functions(source_file))
+    with patch(
+        "menderbot.__main__.get_response",
+        return_value="a: int\nreturn: int",
+    ) as get_response:
+        try_file_type_hints(
+            ScriptedChecker(source_file), source_file, untyped, cache=cache
+        )
+        # The retry of `bad` got the same answer, already known to fail.
+        assert get_response.call_count == 3
+        checker = ScriptedChecker(source_file)
+        insertions = try_file_type_hints(checker, source_file, untyped, cache=cache)
+
+    # `good` comes from the cache, `bad` is asked twice more but both
+    # answers are known to fail, so only the pre-check and one check ran.
+    assert get_response.call_count == 5
+    assert checker.calls == 2
+    assert {ins.label for ins in insertions} == {"good"}
+
+
+def test_type_functions_concurrently_retries_failures():
+    code = """def good(a):
+    return a
+
+def bad(a):
+    return a
+"""
+    source_file = ShadowSourceFile("m.py", code)
+    checker = ScriptedChecker(source_file)
+    with patch(
+        "menderbot.__main__.get_response",
+        return_value="a: int\nreturn: int",
+    ) as get_response:
+        untyped = process_untyped_functions(source_file)
+        insertions = type_functions_concurrently(
+            checker, source_file, untyped, concurrency=2
+        )
+
+    # Two pre-checks, then one check per answer: good, bad and bad's retry.
+    assert get_response.call_count == 3
+    assert checker.calls == 5
+    assert {ins.label for ins in insertions} == {"good"}
+
+
+class RecordingChecker:
+    def __init__(self):
+        self.paths: list[str] = []
+
+    def check(self, path, shadow_path):
+        self.paths.append(path)
+        return (True, "")
+
+    def refresh(self, path):
+        self.paths.append(f"refresh {path}")
+
+    def release(self, *paths):
+        self.paths.append(f"release {' '.join(paths)}")
+
+
+def test_type_files_in_order_types_imported_modules_first(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    code = """def good(a):
+    return a
+"""
+    analyses = [
+        FileAnalysis(
+            path,
+            source_file=ShadowSourceFile(path, code),
+            imports=imports,
+            function_asts=python_cst.collect_function_asts(code),
+        )
+        for path, imports in [("b.py", [("a", "good")]), ("a.py", [])]
+    ]
+    checker = RecordingChecker()
+    with patch(
+        "menderbot.__main__.get_response",
+        return_value="a: int\nreturn: int",
+    ):
+        results = type_files_in_order(
+            checker, analyses, batch=True, concurrency=2, jobs=2
+        )
+
+    assert checker.paths == [
+        "a.py",
+        "a.py",
+        "refresh a.py",
+        "b.py",
+        "b.py",
+        "refresh b.py",
+        # a.py's shadow is kept for b.py, which imports it.
+        "release b.py a.py",
+    ]
+    assert [analysis.source_file.shadow_text for analysis in analyses] == [None, None]
+    assert {path: [ins.label for ins in results[path]] for path in results} == {
+        "a.py": ["good", "good"],
+        "b.py": ["good", "good"],
+    }
+
+
+class ConcurrentFileChecker:
+    """Also reports the candidate hints of another file typed meanwhile."""
+
+    def __init__(self, source_file):
+        self.source_file = source_file
+
+    def check(self, path, shadow_path):
+        foreign = "a.py:1: error: Incompatible return value type  [return-value]"
+        if "a: str" in self.source_file.shadow_text:
+            return (False, f"{path}:1: error: bad hint  [misc]\n{foreign}")
+        return (False, foreign)
+
+
+def test_verify_function_hints_ignores_errors_in_other_files():
+    code = """def good(a):
+    return a
+"""
+    source_file = ShadowSourceFile("b.py", code)
+    checker = ConcurrentFileChecker(source_file)
+    (fn_ast,) = python_cst.collect_function_asts(code)
+
+    insertions, output = verify_function_hints(
+        checker, source_file, fn_ast, [("a", "int")]
+    )
+    assert [ins.label for ins in insertions] == ["good"]
+    assert output is None
+    insertions, output = verify_function_hints(
+        checker, source_file, fn_ast, [("a", "str")]
+    )
+    assert insertions == []
+    assert output == "b.py:1: error: bad hint  [misc]"
@@ -0,0 +1,49 @@
+import threading
+import time
+
+from menderbot.watch import ChangeCollector, changed_paths, snapshot, watch_changes
+
+
+def test_collector_waits_for_changes_to_settle():
+    collector = ChangeCollector(debounce=0.2)
+    collector.add(["a.py"])
+    collector.add(["b.py", "a.py"])
+    assert collector.take_settled() == set()
+
+    time.sleep(0.25)
+    assert collector.take_settled() == {"a.py", "b.py"}
+    assert collector.take_settled() == set()
+
+
+def test_changed_paths_between_snapshots(tmp_path):
+    kept, edited, removed = (str(tmp_path / name) for name in ["k", "e", "r"])
+    for path in [kept, edited, removed]:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("x")
+    before = snapshot([kept, edited, removed])
+    with open(edited, "a", encoding="utf-8") as f:
+        f.write("y")
+    (tmp_path / "r").unlink()
+
+    assert changed_paths(before, snapshot([kept, edited, removed])) == {
+        edited,
+        removed,
+    }
+
+
+def test_watch_changes_by_polling(tmp_path):
+    paths = [str(tmp_path / "a.py"), str(tmp_path / "b.py")]
+    for path in paths:
+        with open(path, "w", encoding="utf-8") as f:
+            f.write("x = 1\n")
+
+    def edit_later():
+        time.sleep(0.1)
+        for path in paths:
+            with open(path, "a", encoding="utf-8") as f:
+                f.write("y = 2\n")
+
+    threading.Thread(target=edit_later).start()
+    changes = watch_changes(lambda: paths, debounce=0.1, poll=0.05, use_watchdog=False)
+    assert next(changes) == set(paths)
+    changes.close()